@@ -0,0 +1,243 @@
+"""
+Static analysis of HRM programs.
+
+The control flow graph is built over real operations indexed by instruction
+index, with jump labels resolved to indexes, the same way `Program` sees
+them. It is used to report problems before a program runs, and by the
+optimizer to drop code that can never run.
+"""
+
+import hrmpy.operations as ops
+
+
+# Operations that read the tile they address. Indirect operations also read
+# the pointer tile.
+READ_OPERATIONS = ['COPYFROM', 'ADD', 'SUB', 'BUMPUP', 'BUMPDN']
+
+
+def split_operations(operations):
+    """
+    Split a list of parsed operations into the list of real operations and a
+    dict mapping each jump label to the index of the operation after it.
+    """
+    real_ops = []
+    jump_labels = {}
+    for op in operations:
+        if isinstance(op, ops.JumpLabel):
+            jump_labels[op.label] = len(real_ops)
+        elif not isinstance(op, ops.PseudoOperation):
+            real_ops.append(op)
+    return real_ops, jump_labels
+
+
+def _parts(op):
+    """
+    Return the operations a (possibly fused) operation was built from.
+    """
+    if isinstance(op, ops.SuperOperation):
+        return [op.first, op.second]
+    if isinstance(op, ops.CountingLoop):
+        if op.back is None:
+            return [op.bump, op.jump]
+        return [op.bump, op.jump, op.back]
+    return [op]
+
+
+def _jump_part(op):
+    """
+    Return the jump in an operation, or None if it doesn't have one.
+    """
+    for part in _parts(op):
+        if isinstance(part, ops.JumpOperation):
+            return part
+    return None
+
+
+class BasicBlock(object):
+    """
+    A run of instructions from `start` up to (but not including) `end` that
+    is only ever entered at the top and left at the bottom.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.successors = []
+
+
+class ControlFlowGraph(object):
+    """
+    The control flow graph of a list of real operations.
+
+    `successors[pc]` lists the instructions that can run after `pc`. An index
+    equal to `size` means the program finishes. Jumps to undefined labels
+    have no successor for the jump, because taking them stops the program.
+    """
+    def __init__(self, operations, jump_labels):
+        self.operations = operations
+        self.jump_labels = jump_labels
+        self.size = len(operations)
+        self.successors = []
+        self.undefined = []
+        for pc in range(self.size):
+            self.successors.append(self._successors(pc))
+        self.reachable = self._find_reachable()
+        self.blocks = self._find_blocks()
+
+    def _successors(self, pc):
+        op = self.operations[pc]
+        if isinstance(op, ops.CountingLoop):
+            if op.label is None:
+                return [pc + 1]
+            label = op.label
+            unconditional = True
+        else:
+            jump = _jump_part(op)
+            if jump is None:
+                return [pc + 1]
+            label = jump.label
+            unconditional = jump.name == 'JUMP'
+        successors = []
+        if not unconditional:
+            successors.append(pc + 1)
+        target = self.jump_labels.get(label, -1)
+        if target < 0:
+            self.undefined.append(pc)
+        elif target not in successors:
+            successors.append(target)
+        return successors
+
+    def _find_reachable(self):
+        reachable = [False] * self.size
+        pending = [0]
+        while pending:
+            pc = pending.pop()
+            if pc >= self.size or reachable[pc]:
+                continue
+            reachable[pc] = True
+            pending.extend(self.successors[pc])
+        return reachable
+
+    def _find_blocks(self):
+        starts = [False] * (self.size + 1)
+        starts[0] = True
+        for pc in range(self.size):
+            if _jump_part(self.operations[pc]) is not None:
+                starts[pc + 1] = True
+                for target in self.successors[pc]:
+                    starts[target] = True
+        blocks = []
+        block = None
+        for pc in range(self.size):
+            if starts[pc]:
+                block = BasicBlock(pc, pc + 1)
+                blocks.append(block)
+            else:
+                block.end = pc + 1
+        for block in blocks:
+            block.successors = self.successors[block.end - 1]
+        return blocks
+
+    def unreachable_ranges(self):
+        """
+        Return a list of (start, end) pairs for each run of instructions
+        that can never run.
+        """
+        ranges = []
+        start = -1
+        for pc in range(self.size + 1):
+            dead = pc < self.size and not self.reachable[pc]
+            if dead and start < 0:
+                start = pc
+            elif not dead and start >= 0:
+                ranges.append((start, pc))
+                start = -1
+        return ranges
+
+
+def program_cfg(program):
+    """
+    Build the control flow graph of a compiled `Program`.
+    """
+    operations = [program[pc] for pc in range(len(program))]
+    return ControlFlowGraph(operations, program.jump_labels())
+
+
+class Diagnostic(object):
+    """
+    A problem found in a program. Errors will stop the program if it gets
+    to them, other problems are just suspicious.
+    """
+    def __init__(self, pc, message, error=False):
+        self.pc = pc
+        self.message = message
+        self.error = error
+
+    def __str__(self):
+        kind = "warning"
+        if self.error:
+            kind = "error"
+        return "%d: %s: %s" % (self.pc, kind, self.message)
+
+
+def analyze(program, cfg=None):
+    """
+    Return a list of Diagnostics for a compiled `Program`, sorted by
+    instruction index.
+    """
+    if cfg is None:
+        cfg = program_cfg(program)
+    diagnostics = []
+    for pc in cfg.undefined:
+        op = cfg.operations[pc]
+        if isinstance(op, ops.CountingLoop):
+            label = op.label
+        else:
+            label = _jump_part(op).label
+        diagnostics.append(Diagnostic(
+            pc, "Jump to undefined label %s." % (label,), cfg.reachable[pc]))
+    for start, end in cfg.unreachable_ranges():
+        if end - start == 1:
+            message = "Instruction %d is unreachable." % (start,)
+        else:
+            message = "Instructions %d to %d are unreachable." % (
+                start, end - 1)
+        diagnostics.append(Diagnostic(start, message))
+    diagnostics.extend(_uninitialized_reads(program, cfg))
+    # A stable bucket sort, which RPython is happy with.
+    by_pc = [[] for _ in range(cfg.size + 1)]
+    for diagnostic in diagnostics:
+        by_pc[diagnostic.pc].append(diagnostic)
+    return [diagnostic for bucket in by_pc for diagnostic in bucket]
+
+
+def _uninitialized_reads(program, cfg):
+    """
+    Find reads of tiles that nothing can ever write to. If any reachable
+    instruction writes through a pointer, any tile might be written.
+    """
+    written = {}
+    for addr in program.initial_memory():
+        written[addr] = None
+    for pc in range(cfg.size):
+        if not cfg.reachable[pc]:
+            continue
+        for part in _parts(cfg.operations[pc]):
+            if part.name == 'COPYTO':
+                if part.indirect:
+                    return []
+                written[part.addr] = None
+    diagnostics = []
+    for pc in range(cfg.size):
+        if not cfg.reachable[pc]:
+            continue
+        for part in _parts(cfg.operations[pc]):
+            if not isinstance(part, ops.MemoryOperation):
+                continue
+            if not (part.indirect or part.name in READ_OPERATIONS):
+                continue
+            if part.addr not in written:
+                diagnostics.append(Diagnostic(
+                    pc, "Reads tile %d, which is never initialised." % (
+                        part.addr,)))
+                break
+    return diagnostics
@@ -0,0 +1,205 @@
+"""
+Run programs against many input files in a process pool.
+
+  $ python -m hrmpy.batch [--jobs N] [--format json|csv] [--report FILE] \
+        [--no-optimize] [--cache-dir DIR] [--max-steps N] \
+        [--max-seconds N] PROGRAMS INPUTS
+
+PROGRAMS and INPUTS may each be a file or a directory. Each program is parsed
+once and then run against every input file in a worker process. Output, step
+counts and errors for every (program, input) pair are collected into a single
+report. With --cache-dir, programs that were built before are loaded from
+the program cache instead of being parsed again. With --max-steps or
+--max-seconds, a run that goes over the limit is stopped and reported as an
+error, so a program that never stops can't hold up a worker forever.
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from hrmpy.budget import Budget, BudgetExceeded
+from hrmpy.cache import ProgramCache
+from hrmpy.main import Machine, build_program, read
+from hrmpy.operations import IllegalOperation
+from hrmpy.parser import FileInputTokenizer
+from hrmpy.profiler import Profiler
+from hrmpy.streams import ListOutputSink
+
+
+REPORT_FIELDS = ['program', 'input', 'steps', 'error', 'seconds', 'output']
+
+# Compiled programs, keyed by filename, the step and time limits, and whether
+# to record coverage. Set in each worker process.
+_programs = None
+_limits = (-1, -1.0)
+_coverage = False
+# A machine for each program, reused for every input it runs against.
+_machines = {}
+
+
+def find_files(path, extension):
+    """
+    Return a sorted list of files with the given extension in a directory, or
+    just the path itself if it is a file.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.endswith(extension))
+
+
+def _init_worker(programs, limits, coverage):
+    global _programs, _limits, _coverage
+    _programs = programs
+    _limits = limits
+    _coverage = coverage
+
+
+def run_program(program, input_filename, max_steps=-1, max_seconds=-1.0):
+    """
+    Run a compiled program against an input file and return a result dict.
+    """
+    return run_machine(
+        Machine(program, None, None), input_filename, max_steps, max_seconds)
+
+
+def run_machine(machine, input_filename, max_steps=-1, max_seconds=-1.0,
+                coverage=False):
+    """
+    Reset a machine and run it against an input file. With `coverage`, the
+    result also has a coverage bitmap for each instruction.
+    """
+    output = ListOutputSink()
+    result = {'input': input_filename, 'steps': None, 'error': None}
+    budget = None
+    if max_steps >= 0 or max_seconds >= 0:
+        budget = Budget(max_steps, max_seconds)
+    if coverage:
+        machine.profiler = Profiler(machine.program)
+    # A run stopped by its budget hasn't started the instruction it is at.
+    stop_pc = -1
+    start = time.time()
+    fd = os.open(input_filename, os.O_RDONLY)
+    try:
+        machine.reset(FileInputTokenizer(fd), output)
+        result['steps'] = machine.run(budget=budget)
+        stop_pc = machine.pc
+    except IllegalOperation as e:
+        result['steps'] = e.steps
+        result['error'] = str(e)
+        stop_pc = machine.pc
+    except BudgetExceeded as e:
+        result['steps'] = e.steps
+        result['error'] = str(e)
+    except Exception as e:
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        os.close(fd)
+    result['seconds'] = time.time() - start
+    result['output'] = output.output
+    if coverage:
+        result['coverage'] = machine.profiler.coverage(stop_pc)
+    return result
+
+
+def _run_job(job):
+    program_filename, input_filename = job
+    machine = _machines.get(program_filename)
+    if machine is None:
+        machine = Machine(_programs[program_filename], None, None)
+        _machines[program_filename] = machine
+    result = run_machine(machine, input_filename, *_limits, coverage=_coverage)
+    result['program'] = program_filename
+    return result
+
+
+def run_batch(program_filenames, input_filenames, processes=None,
+              optimized=True, cache_dir=None, max_steps=-1,
+              max_seconds=-1.0, coverage=False):
+    """
+    Run every program against every input file and return a list of result
+    dicts, in (program, input) order. With `coverage`, the programs are
+    built without the optimizer so that each instruction in a coverage
+    bitmap is an instruction in the source.
+    """
+    if coverage:
+        optimized = False
+    cache = None
+    if cache_dir is not None:
+        cache = ProgramCache(cache_dir)
+    programs = {}
+    for filename in program_filenames:
+        programs[filename] = build_program(read(filename), optimized, cache)
+    jobs = [(p, i) for p in program_filenames for i in input_filenames]
+    pool = multiprocessing.Pool(
+        processes, _init_worker,
+        (programs, (max_steps, max_seconds), coverage))
+    try:
+        return pool.map(_run_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_report(results, fp, format='json'):
+    if format == 'json':
+        json.dump(results, fp, indent=2, sort_keys=True)
+        fp.write("\n")
+    elif format == 'csv':
+        writer = csv.DictWriter(fp, REPORT_FIELDS)
+        writer.writeheader()
+        for result in results:
+            row = dict(result, output=" ".join(result['output']))
+            writer.writerow(row)
+    else:
+        raise ValueError("Unknown report format: %s" % (format,))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.batch")
+    parser.add_argument("programs", help="A .hrm file or directory.")
+    parser.add_argument("inputs", help="An input file or directory.")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None,
+        help="Number of worker processes. (Default: one per CPU.)")
+    parser.add_argument(
+        "--format", choices=['json', 'csv'], default='json')
+    parser.add_argument(
+        "--report", default=None, help="Report file. (Default: stdout.)")
+    parser.add_argument(
+        "--no-optimize", dest='optimize', action='store_false')
+    parser.add_argument(
+        "--cache-dir", default=None, help="Program cache directory.")
+    parser.add_argument(
+        "--max-steps", type=int, default=-1,
+        help="Stop each run after this many steps.")
+    parser.add_argument(
+        "--max-seconds", type=float, default=-1.0,
+        help="Stop each run after this many seconds.")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    results = run_batch(
+        find_files(args.programs, '.hrm'), find_files(args.inputs, '.txt'),
+        args.jobs, args.optimize, args.cache_dir, args.max_steps,
+        args.max_seconds)
+    if args.report is None:
+        write_report(results, sys.stdout, args.format)
+    else:
+        with open(args.report, 'wb') as fp:
+            write_report(results, fp, args.format)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
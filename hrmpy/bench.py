@@ -0,0 +1,209 @@
+"""
+Benchmark programs against input files and track regressions.
+
+  $ python -m hrmpy.bench [--target python|PATH] [--repeat N] \
+        [--workload PROGRAM:INPUT ...] [--save-baseline FILE] \
+        [--baseline FILE] [--threshold RATIO]
+
+Each workload runs in a fresh process with `--stats`, so parse, build and run
+times are measured separately and peak memory (max RSS) is per workload. The
+default target is this interpreter, untranslated. Pass the path to a
+translated binary (such as `./hrmpy-c`) to benchmark that instead.
+
+With `--baseline`, the run times are compared against a saved baseline and
+the exit status is 1 if any workload is slower than the baseline by more than
+the threshold ratio. A workload that fails (because the program raised an
+error or the child exited non-zero for any other reason) is reported, left
+out of the results and the saved baseline, and also makes the exit status 1.
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+DEFAULT_WORKLOADS = [
+    ('progs/selection-sort.hrm', 'inputs/rand100.txt'),
+    ('progs/selection-sort.hrm', 'inputs/rand1000.txt'),
+    ('progs/36-alphabetizer.hrm', 'inputs/alphabetwords.txt'),
+    ('progs/31-string-reverse.hrm', 'inputs/textstrs.txt'),
+    ('progs/19-countdown.hrm', 'inputs/rand100.txt'),
+    ('progs/04-scrambler-handler.hrm', 'inputs/rand10000.txt'),
+]
+
+DEFAULT_THRESHOLD = 1.2
+
+STATS_PREFIX = "hrmpy-stats "
+
+
+def target_command(target):
+    """
+    Return the command line prefix for running a target.
+    """
+    if target == 'python':
+        return [sys.executable, '-m', 'hrmpy']
+    return [os.path.abspath(target)]
+
+
+def parse_stats(stderr):
+    """
+    Find the stats line in a run's stderr and return a dict of its values.
+    Times are converted to seconds.
+    """
+    for line in stderr.splitlines():
+        if line.startswith(STATS_PREFIX):
+            stats = {}
+            for field in line[len(STATS_PREFIX):].split():
+                key, value = field.split('=', 1)
+                stats[key] = int(value)
+            for key in ['parse', 'build', 'run']:
+                stats[key] = stats[key] / 1000000.0
+            return stats
+    raise ValueError("No stats found in output.")
+
+
+def exit_code(status):
+    """
+    Convert a wait status into a return code like Popen's, which is
+    negative if the child was killed by a signal.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_once(command, program, input_filename, extra_args=()):
+    """
+    Run a workload once in a child process and return its stats, including
+    the peak memory of the child in kilobytes. Raises ValueError if the
+    child fails.
+    """
+    with open(os.devnull, 'wb') as devnull:
+        proc = subprocess.Popen(
+            command + ['--stats'] + list(extra_args) + [
+                program, input_filename],
+            stdout=devnull, stderr=subprocess.PIPE)
+        stderr = proc.stderr.read()
+        # We reap the child ourselves to get its resource usage.
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = exit_code(status)
+    if proc.returncode != 0:
+        lines = [line for line in stderr.splitlines()
+                 if line.strip() and not line.startswith(STATS_PREFIX)]
+        raise ValueError("Exited with status %d: %s" % (
+            proc.returncode, (lines or [""])[-1]))
+    stats = parse_stats(stderr)
+    stats['max_rss_kb'] = rusage.ru_maxrss
+    return stats
+
+
+def benchmark(command, program, input_filename, repeat=3, extra_args=()):
+    """
+    Run a workload several times and return the best time for each phase,
+    along with steps per second for the run phase.
+    """
+    runs = [run_once(command, program, input_filename, extra_args)
+            for _ in range(repeat)]
+    result = {
+        'steps': runs[0]['steps'],
+        'max_rss_kb': max(run['max_rss_kb'] for run in runs),
+    }
+    for key in ['parse', 'build', 'run']:
+        result[key] = min(run[key] for run in runs)
+    result['steps_per_second'] = result['steps'] / max(result['run'], 1e-6)
+    return result
+
+
+def workload_key(program, input_filename):
+    return "%s:%s" % (program, input_filename)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare run times against a baseline. Return a list of (key, ratio)
+    pairs for workloads that got slower by more than the threshold.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key]['run'] / max(baseline[key]['run'], 1e-6)
+        if ratio > threshold:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def format_result(key, result):
+    return "\n  ".join([
+        key,
+        "%d steps, %.0f steps/s, %d KB max RSS" % (
+            result['steps'], result['steps_per_second'],
+            result['max_rss_kb']),
+        "parse %.4fs, build %.4fs, run %.4fs" % (
+            result['parse'], result['build'], result['run']),
+    ])
+
+
+def parse_workload(text):
+    program, input_filename = text.split(':', 1)
+    return program, input_filename
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.bench")
+    parser.add_argument(
+        "--target", default='python',
+        help="'python' or the path to a translated binary.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--workload", action='append', type=parse_workload, default=None,
+        help="PROGRAM:INPUT pair to run. May be given more than once.")
+    parser.add_argument(
+        "--no-optimize", dest='optimize', action='store_false')
+    parser.add_argument("--save-baseline", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="Maximum allowed ratio of run time to baseline run time.")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    command = target_command(args.target)
+    extra_args = [] if args.optimize else ['--no-optimize']
+    results = {}
+    failed = False
+    for program, input_filename in args.workload or DEFAULT_WORKLOADS:
+        key = workload_key(program, input_filename)
+        try:
+            results[key] = benchmark(
+                command, program, input_filename, args.repeat, extra_args)
+        except ValueError as e:
+            print "FAILED %s: %s" % (key, e)
+            failed = True
+            continue
+        print format_result(key, results[key])
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'wb') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+            fp.write("\n")
+    if args.baseline is not None:
+        with open(args.baseline, 'rb') as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.threshold)
+        for key, ratio in regressions:
+            print "REGRESSION %s: %.2fx slower than baseline" % (key, ratio)
+        if regressions:
+            return 1
+    if failed:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,79 @@
+"""
+Limits on how long a program is allowed to run.
+
+A budget is only checked on backward jumps, since a program can't run for
+long without taking one, and the clock is only read every `check_every`
+steps. Without a time limit, the step limit is checked once, just after it
+has passed.
+"""
+
+import time
+
+
+# Steps between reads of the clock.
+CHECK_EVERY = 100000
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised when a program runs out of steps or time. It carries the step
+    count, the time taken and the instruction index it was stopped at.
+    """
+    def __init__(self, msg, steps, seconds, pc):
+        self.msg = msg
+        self.steps = steps
+        self.seconds = seconds
+        self.pc = pc
+
+    def __str__(self):
+        return self.msg
+
+
+class Budget(object):
+    """
+    A step limit and a time limit in seconds. Either may be negative for no
+    limit.
+    """
+    def __init__(self, max_steps=-1, max_seconds=-1.0,
+                 check_every=CHECK_EVERY):
+        assert check_every > 0
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.check_every = check_every
+        self.start = time.time()
+        self.next_check = 0
+
+    def start_from(self, steps):
+        """
+        Start the clock for a run that has already taken `steps` steps.
+        """
+        self.start = time.time()
+        self._schedule(steps)
+
+    def _schedule(self, steps):
+        if self.max_seconds >= 0:
+            next_check = steps + self.check_every
+        else:
+            next_check = -1
+        if self.max_steps >= 0 and (
+                next_check < 0 or self.max_steps < next_check):
+            next_check = self.max_steps + 1
+        self.next_check = next_check
+
+    def due(self, steps):
+        return 0 <= self.next_check <= steps
+
+    def check(self, steps, pc):
+        """
+        Raise BudgetExceeded if the budget has run out.
+        """
+        seconds = time.time() - self.start
+        if self.max_steps >= 0 and steps > self.max_steps:
+            raise BudgetExceeded(
+                "Step limit of %d exceeded." % (self.max_steps,),
+                steps, seconds, pc)
+        if self.max_seconds >= 0 and seconds > self.max_seconds:
+            raise BudgetExceeded(
+                "Time limit of %s seconds exceeded." % (self.max_seconds,),
+                steps, seconds, pc)
+        self._schedule(steps)
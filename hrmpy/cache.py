@@ -0,0 +1,223 @@
+"""
+An on-disk cache of built programs, keyed by a hash of the program text.
+
+Each entry is a compact binary encoding of a built program's operations,
+resolved jump labels, initial memory and source size. Loading an entry gives
+back a list of operations that `Program` can be built from directly, without
+parsing or optimizing anything.
+"""
+
+import os
+
+try:
+    from rpython.rlib.rsha import RSHA as sha1
+except ImportError:
+    from hashlib import sha1
+
+import hrmpy.operations as ops
+from hrmpy.encoding import (
+    DecodeError, Decoder, Encoder, read_file, write_file_atomically)
+
+
+MAGIC = "HRMC"
+# Bump this whenever the encoding changes, or the parser or optimizer
+# changes what gets built, so that stale entries are never loaded.
+FORMAT_VERSION = 4
+
+TAG_NULLARY = 0
+TAG_MEMORY = 1
+TAG_INDIRECT = 2
+TAG_JUMP = 3
+TAG_SUPER = 4
+TAG_COUNT_LOOP = 5
+
+
+class CacheError(DecodeError):
+    """
+    Raised when a cache entry can't be decoded.
+    """
+
+
+def program_key(text, optimized):
+    """
+    Return a hash of a program's text and everything else that affects how
+    it is built.
+    """
+    header = "%s:%d:%d:" % (MAGIC, FORMAT_VERSION, int(optimized))
+    return sha1(header + text).hexdigest()
+
+
+class _Encoder(Encoder):
+    def write_operation(self, op):
+        if isinstance(op, ops.CountingLoop):
+            self.write_uint(TAG_COUNT_LOOP)
+            self.write_string(op.name)
+            self.write_operation(op.bump)
+            self.write_operation(op.jump)
+            if op.back is None:
+                self.write_uint(0)
+            else:
+                self.write_uint(1)
+                self.write_operation(op.back)
+        elif isinstance(op, ops.SuperOperation):
+            self.write_uint(TAG_SUPER)
+            self.write_string(op.name)
+            self.write_operation(op.first)
+            self.write_operation(op.second)
+        elif isinstance(op, ops.MemoryOperation):
+            if op.indirect:
+                self.write_uint(TAG_INDIRECT)
+            else:
+                self.write_uint(TAG_MEMORY)
+            self.write_string(op.name)
+            self.write_int(op.addr)
+        elif isinstance(op, ops.JumpOperation):
+            self.write_uint(TAG_JUMP)
+            self.write_string(op.name)
+            self.write_string(op.label)
+            self.write_uint(op.hops)
+        else:
+            assert isinstance(op, ops.NullaryOperation)
+            self.write_uint(TAG_NULLARY)
+            self.write_string(op.name)
+
+
+class _Decoder(Decoder):
+    def error(self, msg):
+        raise CacheError(msg)
+
+    def read_operation(self):
+        tag = self.read_uint()
+        name = self.read_string()
+        if tag == TAG_NULLARY:
+            return ops.NullaryOperation(name)
+        elif tag == TAG_MEMORY:
+            return ops.MemoryOperation(name, self.read_int())
+        elif tag == TAG_INDIRECT:
+            return ops.IndirectMemoryOperation(name, self.read_int())
+        elif tag == TAG_JUMP:
+            label = self.read_string()
+            return ops.JumpOperation(name, label, self.read_uint())
+        elif tag == TAG_SUPER:
+            first = self.read_operation()
+            second = self.read_operation()
+            return ops.SuperOperation(name, first, second)
+        elif tag == TAG_COUNT_LOOP:
+            bump = self.read_operation()
+            jump = self.read_operation()
+            if not (isinstance(bump, ops.MemoryOperation) and
+                    not bump.indirect and
+                    isinstance(jump, ops.JumpOperation)):
+                raise CacheError("Bad counting loop in cache entry.")
+            back = None
+            if self.read_uint():
+                back = self.read_operation()
+                if not isinstance(back, ops.JumpOperation):
+                    raise CacheError("Bad counting loop in cache entry.")
+            return ops.CountingLoop(bump, jump, back)
+        raise CacheError("Unknown operation tag %d in cache entry." % (tag,))
+
+
+def dump_program(program):
+    """
+    Encode a built program as a string.
+    """
+    encoder = _Encoder()
+    encoder.write_string(MAGIC)
+    encoder.write_uint(FORMAT_VERSION)
+    encoder.write_uint(program.source_size)
+    initial_memory = program.initial_memory()
+    encoder.write_uint(len(initial_memory))
+    for addr, value in initial_memory.items():
+        encoder.write_int(addr)
+        encoder.write_uint(value.kind)
+        encoder.write_int(value.unboxed())
+    encoder.write_uint(len(program))
+    for pc in range(len(program)):
+        encoder.write_operation(program[pc])
+    jump_labels = program.jump_labels()
+    encoder.write_uint(len(jump_labels))
+    for label, pc in jump_labels.items():
+        encoder.write_string(label)
+        encoder.write_uint(pc)
+    return encoder.getvalue()
+
+
+def load_operations(data):
+    """
+    Decode a string from `dump_program()` into a list of operations that
+    builds the same program, and the program's source size. Raises
+    CacheError if the data is bad.
+    """
+    decoder = _Decoder(data)
+    if decoder.read_string() != MAGIC:
+        raise CacheError("Not a cache entry.")
+    if decoder.read_uint() != FORMAT_VERSION:
+        raise CacheError("Wrong cache format version.")
+    source_size = decoder.read_uint()
+    operations = []
+    for _ in range(decoder.read_uint()):
+        addr = decoder.read_int()
+        kind = decoder.read_uint()
+        integer = decoder.read_int()
+        if kind != ops.INTEGER and kind != ops.CHARACTER:
+            raise CacheError("Bad value kind %d in cache entry." % (kind,))
+        operations.append(ops.Memset(addr, ops.box(kind, integer)))
+    size = decoder.read_uint()
+    program_ops = []
+    for _ in range(size):
+        program_ops.append(decoder.read_operation())
+    labels = {}
+    for _ in range(decoder.read_uint()):
+        label = decoder.read_string()
+        pc = decoder.read_uint()
+        if pc > size:
+            raise CacheError("Bad jump label %s in cache entry." % (label,))
+        labels.setdefault(pc, []).append(label)
+    if not decoder.at_end():
+        raise CacheError("Trailing data in cache entry.")
+    for pc in range(size + 1):
+        for label in labels.get(pc, []):
+            operations.append(ops.JumpLabel(label))
+        if pc < size:
+            operations.append(program_ops[pc])
+    return operations, source_size
+
+
+class ProgramCache(object):
+    """
+    A directory of encoded programs. Entries that are missing or can't be
+    decoded are treated as cache misses.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return "%s/%s.hrmc" % (self.directory, key)
+
+    def get(self, key):
+        """
+        Return the list of operations and the source size cached under
+        `key`, or None.
+        """
+        try:
+            data = read_file(self._path(key))
+        except OSError:
+            return None
+        try:
+            return load_operations(data)
+        except CacheError:
+            return None
+
+    def put(self, key, program):
+        """
+        Store a built program under `key`. Concurrent readers never see a
+        partial entry.
+        """
+        try:
+            if not os.path.isdir(self.directory):
+                os.mkdir(self.directory)
+        except OSError:
+            # Someone else may have made it first.
+            pass
+        write_file_atomically(self._path(key), dump_program(program))
@@ -0,0 +1,437 @@
+"""
+Compile programs to Python source and run them as native Python functions.
+
+Each compiled program becomes a single function with the accumulator and
+memory in local variables. Instructions are grouped into basic blocks, and
+each block is an `if block == N:` section of one big loop. Falling through to
+the next block needs no dispatch, only jumps go back to the top of the loop.
+
+If a program doesn't use indirect addressing, each tile it uses gets its own
+pair of local variables. Otherwise memory is a pair of lists.
+
+Step counts are only updated at the end of each block. If an IllegalOperation
+is raised, the line it was raised on tells us how far into the block we got.
+
+This is a CPython backend and is not part of the RPython translation.
+"""
+
+import hashlib
+import sys
+
+import hrmpy.operations as ops
+from hrmpy.main import MEMORY_SIZE, UNDEFINED_LABEL
+
+
+# Compiled functions, keyed by a hash of the compiled program.
+_cache = {}
+
+
+def program_key(program):
+    """
+    Return a hash of everything in a compiled program that affects how it
+    runs.
+    """
+    initial_memory = program.initial_memory()
+    memory = [(addr, initial_memory[addr].kind,
+               initial_memory[addr].unboxed())
+              for addr in sorted(initial_memory)]
+    labels = [program[pc].label if program.targets[pc] < 0 and
+              program.opcodes[pc] in JUMPS else None
+              for pc in range(program.size)]
+    loops = [str(loop) for loop in program.loops if loop is not None]
+    return hashlib.sha1(repr((
+        program.opcodes, program.addrs, program.indirects, program.targets,
+        program.steps, program.hops, labels, loops, memory,
+        program.min_addr, program.max_addr))).hexdigest()
+
+
+JUMPS = set([
+    ops.OP_JUMP, ops.OP_JUMPZ, ops.OP_JUMPN, ops.OP_SUB_JUMPZ,
+    ops.OP_SUB_JUMPN, ops.OP_BUMPDN_JUMPZ, ops.OP_BUMPDN_JUMPN,
+    ops.OP_COUNT_LOOP])
+
+
+def _block_starts(program):
+    starts = set([0])
+    for pc in range(program.size):
+        if program.opcodes[pc] == ops.OP_COUNT_LOOP:
+            # Counting loops that never stop go around one at a time, by
+            # going back to the start of their own block.
+            starts.add(pc)
+        if program.opcodes[pc] in JUMPS:
+            starts.add(pc + 1)
+            if program.targets[pc] >= 0:
+                starts.add(program.targets[pc])
+    return sorted(start for start in starts if start < program.size)
+
+
+def _in_range(addr):
+    return 0 <= addr < MEMORY_SIZE
+
+
+class _SourceBuilder(object):
+    """
+    Builds the source of one compiled program.
+    """
+    def __init__(self, program):
+        self.program = program
+        self.lines = []
+        self.indent = 0
+        # Maps source line numbers to the number of steps completed in the
+        # current block when that line runs.
+        self.offsets = {}
+        self.offset = 0
+        self.use_locals = True
+        for pc in range(program.size):
+            if program.indirects[pc]:
+                self.use_locals = False
+        self.tiles = set(program.initial_memory())
+        for pc in range(program.size):
+            if (program.opcodes[pc] not in (ops.OP_INBOX, ops.OP_OUTBOX,
+                                            ops.OP_JUMP, ops.OP_JUMPZ,
+                                            ops.OP_JUMPN) and
+                    _in_range(program.addrs[pc])):
+                self.tiles.add(program.addrs[pc])
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+        self.offsets[len(self.lines)] = self.offset
+
+    def raise_illegal(self, condition, msg_expr):
+        self.emit("if %s:" % (condition,))
+        self.indent += 1
+        self.emit("raise IllegalOperation(%s)" % (msg_expr,))
+        self.indent -= 1
+
+    # Memory access.
+
+    def kind(self, addr):
+        if self.use_locals:
+            return "k%s" % (addr,)
+        return "kinds[%s]" % (addr,)
+
+    def integer(self, addr):
+        if self.use_locals:
+            return "v%s" % (addr,)
+        return "ints[%s]" % (addr,)
+
+    def operand(self, pc):
+        """
+        Emit code to resolve an instruction's operand and return an
+        expression for the address and one for its message text.
+        """
+        addr = self.program.addrs[pc]
+        if not _in_range(addr):
+            # Nothing after this runs, but it still has to compile, so it
+            # refers to tile 0.
+            self.emit("raise IllegalOperation(%r)" % (
+                "Address %d out of range." % (addr,),))
+            return "0", repr("0")
+        if not self.program.indirects[pc]:
+            return str(addr), repr(str(addr))
+        self.raise_illegal(
+            "%s == EMPTY" % (self.kind(addr),), repr("No value in %d." % addr))
+        self.raise_illegal(
+            "%s != INTEGER" % (self.kind(addr),),
+            repr("No integer in %d." % addr))
+        self.emit("p = %s" % (self.integer(addr),))
+        self.raise_illegal(
+            "not 0 <= p < MEMORY_SIZE",
+            "'Address %%s in %d out of range.' %% (p,)" % (addr,))
+        return "p", "str(p)"
+
+    def load(self, addr, name):
+        """
+        Emit code to check that a tile holds a value.
+        """
+        self.raise_illegal(
+            "%s == EMPTY" % (self.kind(addr),),
+            "'No value in %%s.' %% (%s,)" % (name,))
+
+    # Instructions.
+
+    def acc_not_empty(self):
+        self.raise_illegal("ak == EMPTY", repr("No value held."))
+
+    def inbox(self):
+        self.emit("if not advance():")
+        self.indent += 1
+        self.emit("return steps + %d" % (self.offset,))
+        self.indent -= 1
+        self.emit("ak = inputs.kind")
+        self.emit("av = inputs.integer")
+
+    def outbox_acc(self):
+        self.acc_not_empty()
+        self.emit("write(chr(av) if ak == CHARACTER else str(av))")
+        self.emit("ak = EMPTY")
+
+    def copyto(self, pc):
+        addr, name = self.operand(pc)
+        self.emit("%s = ak" % (self.kind(addr),))
+        self.emit("%s = av" % (self.integer(addr),))
+
+    def copyfrom(self, pc):
+        addr, name = self.operand(pc)
+        self.load(addr, name)
+        self.emit("ak = %s" % (self.kind(addr),))
+        self.emit("av = %s" % (self.integer(addr),))
+
+    def arithmetic(self, pc, op):
+        addr, name = self.operand(pc)
+        self.load(addr, name)
+        if op == '+':
+            self.raise_illegal(
+                "ak != INTEGER or %s != INTEGER" % (self.kind(addr),),
+                repr("Can't add these."))
+        else:
+            self.raise_illegal(
+                "ak != %s" % (self.kind(addr),), repr("Can't sub these."))
+        self.emit("av = av %s %s" % (op, self.integer(addr)))
+        self.emit("ak = INTEGER")
+
+    def bump(self, pc, op):
+        addr, name = self.operand(pc)
+        self.load(addr, name)
+        msg = "Can't add these." if op == '+' else "Can't sub these."
+        self.raise_illegal("%s != INTEGER" % (self.kind(addr),), repr(msg))
+        self.emit("av = %s %s 1" % (self.integer(addr), op))
+        self.emit("ak = INTEGER")
+        self.emit("%s = av" % (self.integer(addr),))
+
+    def raise_undefined(self, label, offset):
+        """
+        Emit code to raise the error for a jump to an undefined label, after
+        `offset` steps in the current block.
+        """
+        saved, self.offset = self.offset, offset
+        self.emit("raise IllegalOperation(%r)" % (
+            UNDEFINED_LABEL % (label,),))
+        self.offset = saved
+
+    def jump(self, pc, condition, block_steps):
+        """
+        Emit the end of a block that ends in a jump.
+        """
+        target = self.program.targets[pc]
+        hops = self.program.hops[pc]
+        if condition != "True":
+            self.emit("if %s:" % (condition,))
+            self.indent += 1
+        if target < 0:
+            self.raise_undefined(self.program[pc].label, block_steps)
+        else:
+            self.emit("steps += %d" % (block_steps + hops,))
+            self.emit("block = %d" % (target,))
+            self.emit("continue")
+        if condition != "True":
+            self.indent -= 1
+            self.emit("steps += %d" % (block_steps,))
+        else:
+            self.terminated = True
+
+    def count_loop(self, pc):
+        """
+        Emit the end of a block that ends in a counting loop.
+        """
+        loop = self.program.loops[pc]
+        addr = self.program.addrs[pc]
+        op = '+' if loop.delta > 0 else '-'
+        self.bump(pc, op)
+        if not _in_range(addr):
+            # The bump has already raised the error.
+            self.terminated = True
+            return
+        # Steps before the loop, which is the only thing in its block.
+        before = self.offset
+        start = "av + 1" if op == '-' else "av - 1"
+        self.emit("n = LOOPS[%d].iterations(%s)" % (pc, start))
+        self.emit("if n < 0:")
+        self.indent += 1
+        self.emit("steps += %d" % (before + loop.continue_steps,))
+        self.emit("block = %d" % (pc,))
+        self.emit("continue")
+        self.indent -= 1
+        self.emit("av %s= n - 1" % (op,))
+        self.emit("%s = av" % (self.integer(addr),))
+        self.emit("steps += %d + (n - 1) * %d" % (
+            before + loop.exit_steps, loop.continue_steps))
+        target = self.program.targets[pc]
+        if loop.label is None:
+            return
+        if target < 0:
+            # The steps for the whole loop have already been added.
+            self.raise_undefined(loop.label, 0)
+        else:
+            self.emit("block = %d" % (target,))
+            self.emit("continue")
+        self.terminated = True
+
+    def instruction(self, pc, block_steps):
+        """
+        Emit one instruction. Returns True if it ended the block.
+        """
+        opcode = self.program.opcodes[pc]
+        if opcode == ops.OP_INBOX:
+            self.inbox()
+        elif opcode == ops.OP_OUTBOX:
+            self.outbox_acc()
+        elif opcode == ops.OP_COPYTO:
+            self.acc_not_empty()
+            self.copyto(pc)
+        elif opcode == ops.OP_COPYFROM:
+            self.copyfrom(pc)
+        elif opcode == ops.OP_ADD:
+            self.acc_not_empty()
+            self.arithmetic(pc, '+')
+        elif opcode == ops.OP_SUB:
+            self.acc_not_empty()
+            self.arithmetic(pc, '-')
+        elif opcode == ops.OP_BUMPUP:
+            self.bump(pc, '+')
+        elif opcode == ops.OP_BUMPDN:
+            self.bump(pc, '-')
+        elif opcode == ops.OP_JUMP:
+            self.jump(pc, "True", block_steps)
+            return True
+        elif opcode == ops.OP_JUMPZ or opcode == ops.OP_JUMPN:
+            self.acc_not_empty()
+            test = "av == 0" if opcode == ops.OP_JUMPZ else "av < 0"
+            self.jump(pc, "ak == INTEGER and %s" % (test,), block_steps)
+            return True
+        elif opcode == ops.OP_COPYFROM_OUTBOX:
+            self.copyfrom(pc)
+            self.emit("write(chr(av) if ak == CHARACTER else str(av))")
+            self.emit("ak = EMPTY")
+        elif opcode == ops.OP_INBOX_COPYTO:
+            self.inbox()
+            self.copyto(pc)
+        elif opcode == ops.OP_SUB_JUMPZ or opcode == ops.OP_SUB_JUMPN:
+            self.acc_not_empty()
+            self.arithmetic(pc, '-')
+            test = "av == 0" if opcode == ops.OP_SUB_JUMPZ else "av < 0"
+            self.jump(pc, test, block_steps)
+            return True
+        elif (opcode == ops.OP_BUMPDN_JUMPZ or
+              opcode == ops.OP_BUMPDN_JUMPN):
+            self.bump(pc, '-')
+            test = "av == 0" if opcode == ops.OP_BUMPDN_JUMPZ else "av < 0"
+            self.jump(pc, test, block_steps)
+            return True
+        elif opcode == ops.OP_COUNT_LOOP:
+            self.count_loop(pc)
+            return True
+        else:
+            assert False, "Unknown opcode: %s" % (opcode,)
+        return False
+
+    def memory_init(self):
+        program = self.program
+        if self.use_locals:
+            for addr in sorted(self.tiles):
+                self.emit("%s = EMPTY" % (self.kind(addr),))
+                self.emit("%s = 0" % (self.integer(addr),))
+        else:
+            self.emit("kinds = [EMPTY] * MEMORY_SIZE")
+            self.emit("ints = [0] * MEMORY_SIZE")
+        initial_memory = program.initial_memory()
+        for addr in sorted(initial_memory):
+            value = initial_memory[addr]
+            self.emit("%s = %d" % (self.kind(addr), value.kind))
+            self.emit("%s = %d" % (self.integer(addr), value.unboxed()))
+
+    def build(self):
+        program = self.program
+        self.emit("def run(inputs, output):")
+        self.indent += 1
+        for addr in sorted(program.initial_memory()):
+            if not _in_range(addr):
+                # Out of range .memset addresses are an error before we
+                # start.
+                self.emit("raise IllegalOperation(%r)" % (
+                    "Address %d out of range." % (addr,),))
+                return "\n".join(self.lines) + "\n"
+        self.emit("write = output.write")
+        self.emit("advance = inputs.advance")
+        self.memory_init()
+        self.emit("ak = EMPTY")
+        self.emit("av = 0")
+        self.emit("steps = 0")
+        self.emit("block = 0")
+        self.emit("try:")
+        self.indent += 1
+        self.emit("while True:")
+        self.indent += 1
+        starts = _block_starts(program)
+        for i, start in enumerate(starts):
+            end = program.size
+            if i + 1 < len(starts):
+                end = starts[i + 1]
+            block_steps = sum(program.steps[start:end])
+            self.offset = 0
+            self.terminated = False
+            self.emit("if block == %d:" % (start,))
+            self.indent += 1
+            ended = False
+            for pc in range(start, end):
+                ended = self.instruction(pc, block_steps)
+                self.offset += program.steps[pc]
+            if not ended:
+                self.emit("steps += %d" % (block_steps,))
+            if not self.terminated:
+                self.emit("block = %d" % (end,))
+            self.indent -= 1
+        self.emit("return steps")
+        self.indent -= 2
+        self.emit("except IllegalOperation as e:")
+        self.indent += 1
+        self.emit("e.steps = steps + OFFSETS[sys.exc_info()[2].tb_lineno]")
+        self.emit("raise")
+        self.indent -= 2
+        return "\n".join(self.lines) + "\n"
+
+
+def generate_source(program):
+    """
+    Return the Python source of a compiled program, along with a dict that
+    maps each source line to its step offset within its block.
+    """
+    builder = _SourceBuilder(program)
+    source = builder.build()
+    return source, builder.offsets
+
+
+def compile_program(program):
+    """
+    Return a Python function that runs a compiled program. It takes an input
+    queue and an output sink and returns the number of steps taken, just like
+    `hrmpy.main.execute()`.
+    """
+    key = program_key(program)
+    if key not in _cache:
+        source, offsets = generate_source(program)
+        namespace = {
+            'EMPTY': ops.EMPTY,
+            'INTEGER': ops.INTEGER,
+            'CHARACTER': ops.CHARACTER,
+            'MEMORY_SIZE': MEMORY_SIZE,
+            'IllegalOperation': ops.IllegalOperation,
+            'OFFSETS': offsets,
+            'LOOPS': program.loops,
+            'sys': sys,
+        }
+        code = compile(source, "<hrmpy program %s>" % (key[:12],), 'exec')
+        exec code in namespace
+        _cache[key] = namespace['run']
+    return _cache[key]
+
+
+def execute_compiled(program, inputs, output):
+    """
+    Compile and run a program, flushing the output afterwards.
+    """
+    run = compile_program(program)
+    try:
+        return run(inputs, output)
+    finally:
+        output.flush()
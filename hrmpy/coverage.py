@@ -0,0 +1,217 @@
+"""
+Instruction and branch coverage of programs over a corpus of inputs.
+
+  $ python -m hrmpy.coverage [--jobs N] [--data FILE] [--listing DIR] \
+        [--minimize] PROGRAMS INPUTS
+
+Every program is run without the optimizer against every input file, in a
+process pool (see `hrmpy.batch`). Each run records a bitmap for every
+instruction: whether it ran, and for JUMPZ and JUMPN, whether the jump was
+taken and whether it fell through. The bitmaps from every run of a program
+are merged by ORing them together, and a summary line is printed for each
+program.
+
+With --data, coverage saved in FILE by earlier runs is merged in (unless the
+program has changed size since) and the result saved back. With --listing,
+an annotated copy of each program's source is written to DIR, or printed if
+DIR is `-`. With --minimize, the smallest set of inputs we can find that
+covers everything the whole corpus covers is printed, one per line.
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from hrmpy.batch import find_files, run_batch
+from hrmpy.main import build_program, read
+from hrmpy.parser import instruction_lines
+from hrmpy.profiler import (
+    COVERED, CONDITIONAL_OPCODES, JUMP_NOT_TAKEN, JUMP_TAKEN)
+
+
+BITS = [COVERED, JUMP_TAKEN, JUMP_NOT_TAKEN]
+
+
+def merge(bitmaps, other):
+    """
+    Return the coverage of two lists of bitmaps for the same program.
+    """
+    assert len(bitmaps) == len(other)
+    return [bits | other_bits for bits, other_bits in zip(bitmaps, other)]
+
+
+def possible(program):
+    """
+    Return the bitmaps a program would have if everything was covered.
+    """
+    bitmaps = []
+    for pc in range(program.size):
+        bits = COVERED
+        if program.opcodes[pc] in CONDITIONAL_OPCODES:
+            bits |= JUMP_TAKEN | JUMP_NOT_TAKEN
+        bitmaps.append(bits)
+    return bitmaps
+
+
+def summarize(program, bitmaps):
+    """
+    Return a line with the instructions and branch directions covered.
+    """
+    instructions = 0
+    branches = 0
+    all_branches = 0
+    for pc, bits in enumerate(possible(program)):
+        if bitmaps[pc] & COVERED:
+            instructions += 1
+        for bit in [JUMP_TAKEN, JUMP_NOT_TAKEN]:
+            if bits & bit:
+                all_branches += 1
+                if bitmaps[pc] & bit:
+                    branches += 1
+    return "instructions %s, branches %s" % (
+        _fraction(instructions, program.size),
+        _fraction(branches, all_branches))
+
+
+def _fraction(count, total):
+    if total == 0:
+        return "0/0"
+    return "%d/%d (%d%%)" % (count, total, 100 * count // total)
+
+
+def _mark(program, pc, bits):
+    if not bits & COVERED:
+        return "never"
+    if program.opcodes[pc] in CONDITIONAL_OPCODES:
+        if not bits & JUMP_TAKEN:
+            return "never jumps"
+        if not bits & JUMP_NOT_TAKEN:
+            return "always jumps"
+    return "ok"
+
+
+def annotate(text, program, bitmaps):
+    """
+    Return a program's source with each instruction marked with its
+    coverage. `program` must have been built from `text` without the
+    optimizer.
+    """
+    marks = {}
+    for pc, number in enumerate(instruction_lines(text)):
+        marks[number] = _mark(program, pc, bitmaps[pc])
+    lines = []
+    for number, line in enumerate(text.splitlines(), 1):
+        lines.append("%12s | %s" % (marks.get(number, ""), line))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def minimize(results):
+    """
+    Pick inputs from a list of batch results with coverage, so that the
+    picked inputs cover everything all of them do. Inputs that add the most
+    are picked first, which doesn't always find the smallest set, but comes
+    close.
+    """
+    covers = {}
+    for result in results:
+        units = covers.setdefault(result['input'], set())
+        for pc, bits in enumerate(result['coverage']):
+            for bit in BITS:
+                if bits & bit:
+                    units.add((result['program'], pc, bit))
+    needed = set()
+    for units in covers.values():
+        needed |= units
+    picked = []
+    inputs = sorted(covers)
+    while needed:
+        best = max(inputs, key=lambda name: len(covers[name] & needed))
+        picked.append(best)
+        needed -= covers[best]
+    return picked
+
+
+def collect(program_filenames, input_filenames, processes=None):
+    """
+    Run every program against every input and return the batch results and
+    a dict mapping each program to its merged coverage.
+    """
+    results = run_batch(
+        program_filenames, input_filenames, processes, coverage=True)
+    coverage = {}
+    for result in results:
+        bitmaps = coverage.get(result['program'])
+        if bitmaps is None:
+            coverage[result['program']] = result['coverage']
+        else:
+            coverage[result['program']] = merge(bitmaps, result['coverage'])
+    return results, coverage
+
+
+def load_data(filename, coverage):
+    """
+    Merge coverage saved in a file into a dict of coverage, dropping it for
+    any program whose size has changed.
+    """
+    with open(filename, 'rb') as fp:
+        saved = json.load(fp)
+    for program, bitmaps in saved.items():
+        if program not in coverage:
+            coverage[program] = bitmaps
+        elif len(bitmaps) == len(coverage[program]):
+            coverage[program] = merge(coverage[program], bitmaps)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.coverage")
+    parser.add_argument("programs", help="A .hrm file or directory.")
+    parser.add_argument("inputs", help="An input file or directory.")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None,
+        help="Number of worker processes. (Default: one per CPU.)")
+    parser.add_argument(
+        "--data", default=None,
+        help="A file to merge saved coverage from and save it to.")
+    parser.add_argument(
+        "--listing", default=None,
+        help="A directory for annotated listings, or - for stdout.")
+    parser.add_argument(
+        "--minimize", action='store_true',
+        help="Print the inputs needed for the same coverage.")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    program_filenames = find_files(args.programs, '.hrm')
+    results, coverage = collect(
+        program_filenames, find_files(args.inputs, '.txt'), args.jobs)
+    if args.data is not None:
+        if os.path.exists(args.data):
+            load_data(args.data, coverage)
+        with open(args.data, 'wb') as fp:
+            json.dump(coverage, fp, sort_keys=True)
+    for filename in program_filenames:
+        text = read(filename)
+        program = build_program(text, optimized=False)
+        bitmaps = coverage.get(filename, [0] * program.size)
+        print "%s: %s" % (filename, summarize(program, bitmaps))
+        if args.listing == '-':
+            sys.stdout.write(annotate(text, program, bitmaps))
+        elif args.listing is not None:
+            path = os.path.join(
+                args.listing, os.path.basename(filename) + ".cov")
+            with open(path, 'wb') as fp:
+                fp.write(annotate(text, program, bitmaps))
+    if args.minimize:
+        for filename in minimize(results):
+            print filename
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,304 @@
+"""
+Run programs through several execution engines and check that they agree.
+
+  $ python -m hrmpy.differential [--engines plain,optimized,compiled] \
+        [--interval N] PROGRAMS INPUTS
+
+The engines are:
+
+  plain       the interpreter, without the optimizer
+  optimized   the interpreter, with the optimizer
+  compiled    the optimized program compiled to Python source
+  PATH        a translated binary (such as `./hrmpy-c`), run with `--stats`
+
+The first engine is the reference. While it runs, it records its state (pc,
+accumulator, step count, output count and every tile) on the first backward
+jump after every `--interval` steps. The interpreter engines compare their
+state against the reference at every backward jump that lands on one of
+those step counts, and stop at the first one that differs. Step counts are
+the common clock, because fused and collapsed instructions count the steps
+of the instructions they replace. The other engines are only compared on
+their output, step count and whether they failed.
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from hrmpy.batch import find_files
+from hrmpy.bench import parse_stats, target_command
+from hrmpy.codegen import execute_compiled
+from hrmpy.main import build_program, execute, read
+from hrmpy.operations import EMPTY, IllegalOperation
+from hrmpy.parser import InputTokenizer
+from hrmpy.snapshot import Checkpointer
+from hrmpy.streams import ListOutputSink
+
+
+INTERPRETER_ENGINES = ['plain', 'optimized']
+DEFAULT_ENGINES = ['plain', 'optimized', 'compiled']
+DEFAULT_INTERVAL = 1000
+
+
+class State(object):
+    """
+    The state of an engine at a backward jump.
+    """
+    def __init__(self, snapshot):
+        self.pc = snapshot.pc
+        self.acc = (snapshot.acc_kind, snapshot.acc)
+        if snapshot.acc_kind == EMPTY:
+            # The integer is left over from whatever was there before.
+            self.acc = (EMPTY, 0)
+        self.steps = snapshot.steps
+        self.output_count = snapshot.output_count
+        self.tiles = dict(zip(snapshot.addrs, zip(
+            snapshot.kinds, snapshot.integers)))
+
+    def differences(self, other):
+        """
+        Return a list of descriptions of how another state differs.
+        """
+        differences = []
+        if self.acc != other.acc:
+            differences.append("accumulator %r != %r" % (self.acc, other.acc))
+        if self.output_count != other.output_count:
+            differences.append("output count %d != %d" % (
+                self.output_count, other.output_count))
+        for addr in sorted(set(self.tiles) | set(other.tiles)):
+            if self.tiles.get(addr) != other.tiles.get(addr):
+                differences.append("tile %d %r != %r" % (
+                    addr, self.tiles.get(addr), other.tiles.get(addr)))
+                break
+        return differences
+
+
+class _Recorder(Checkpointer):
+    """
+    Keeps the reference engine's states, keyed by step count.
+    """
+    def __init__(self, interval):
+        Checkpointer.__init__(self, None, None, interval)
+        self.states = {}
+
+    def save(self, snapshot):
+        self.states[snapshot.steps] = State(snapshot)
+        self.next_steps = snapshot.steps + self.interval
+
+
+class _Diverged(Exception):
+    def __init__(self, divergence):
+        self.divergence = divergence
+
+
+class _Comparer(Checkpointer):
+    """
+    Compares an engine's state against the reference whenever it is at a
+    step count the reference recorded.
+    """
+    def __init__(self, engine, reference, states):
+        Checkpointer.__init__(self, None, None, 1)
+        self.engine = engine
+        self.reference = reference
+        self.states = states
+        self.compared = 0
+
+    def start_from(self, steps):
+        pass
+
+    def due(self, steps):
+        return steps in self.states
+
+    def save(self, snapshot):
+        expected = self.states[snapshot.steps]
+        state = State(snapshot)
+        self.compared += 1
+        differences = expected.differences(state)
+        if differences:
+            raise _Diverged(Divergence(
+                self.reference, self.engine, snapshot.steps, expected.pc,
+                state.pc, differences))
+
+
+class Divergence(object):
+    """
+    The first place two engines disagree. `steps` is the step count it was
+    found at, or None if it was only found at the end of the run. The pcs
+    are each engine's own instruction index, or None if it isn't known.
+    """
+    def __init__(self, reference, engine, steps, reference_pc, engine_pc,
+                 differences):
+        self.reference = reference
+        self.engine = engine
+        self.steps = steps
+        self.reference_pc = reference_pc
+        self.engine_pc = engine_pc
+        self.differences = differences
+
+    def __str__(self):
+        if self.steps is None:
+            where = "at the end of the run"
+        else:
+            where = "at step %d (pc %s in %s, pc %s in %s)" % (
+                self.steps, self.reference_pc, self.reference, self.engine_pc,
+                self.engine)
+        return "%s and %s diverge %s: %s" % (
+            self.reference, self.engine, where, "; ".join(self.differences))
+
+
+class Run(object):
+    """
+    The outcome of running a program with one engine.
+    """
+    def __init__(self, output, steps, error):
+        self.output = output
+        self.steps = steps
+        self.error = error
+
+
+def run_engine(engine, text, input_text, checkpointer=None):
+    """
+    Run a program's text against some input text with one engine and return
+    a Run. The checkpointer is only used by the interpreter engines.
+    """
+    if _is_target(engine):
+        return _run_target(engine, text, input_text)
+    program = build_program(text, engine != 'plain')
+    output = ListOutputSink()
+    inputs = InputTokenizer(input_text)
+    try:
+        if engine == 'compiled':
+            steps = execute_compiled(program, inputs, output)
+        else:
+            steps = execute(
+                program, inputs, output, checkpointer=checkpointer)
+    except IllegalOperation as e:
+        return Run(output.output, e.steps, str(e))
+    return Run(output.output, steps, None)
+
+
+def _run_target(engine, text, input_text):
+    """
+    Run a program in a child process. Only the fact that it failed is kept
+    as the error, since the message depends on the build.
+    """
+    directory = tempfile.mkdtemp(prefix="hrmpy-")
+    try:
+        program_filename = os.path.join(directory, "program.hrm")
+        input_filename = os.path.join(directory, "input.txt")
+        with open(program_filename, 'wb') as fp:
+            fp.write(text)
+        with open(input_filename, 'wb') as fp:
+            fp.write(input_text)
+        proc = subprocess.Popen(
+            target_command(engine) + [
+                '--stats', program_filename, input_filename],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+    finally:
+        shutil.rmtree(directory)
+    error = None
+    if proc.returncode != 0:
+        error = "exit status %d" % (proc.returncode,)
+    return Run(stdout.split(), parse_stats(stderr)['steps'], error)
+
+
+def compare_runs(reference, engine, expected, run):
+    """
+    Return a Divergence if two runs didn't end the same way, or None.
+    """
+    for i in range(min(len(expected.output), len(run.output))):
+        if expected.output[i] != run.output[i]:
+            return Divergence(reference, engine, None, None, None, [
+                "output %d %s != %s" % (
+                    i, expected.output[i], run.output[i])])
+    differences = []
+    if len(expected.output) != len(run.output):
+        differences.append("%d outputs != %d" % (
+            len(expected.output), len(run.output)))
+    if expected.steps != run.steps:
+        differences.append("steps %d != %d" % (expected.steps, run.steps))
+    if _is_target(reference) or _is_target(engine):
+        if (expected.error is None) != (run.error is None):
+            differences.append("error %s != %s" % (expected.error, run.error))
+    elif expected.error != run.error:
+        differences.append("error %s != %s" % (expected.error, run.error))
+    if differences:
+        return Divergence(reference, engine, None, None, None, differences)
+    return None
+
+
+def _is_target(engine):
+    return engine not in INTERPRETER_ENGINES + ['compiled']
+
+
+def diff_program(text, input_text, engines=DEFAULT_ENGINES,
+                 interval=DEFAULT_INTERVAL):
+    """
+    Run a program with each engine and compare them all against the first.
+    Return a list of Divergences, with at most one for each engine.
+    """
+    reference = engines[0]
+    checkpointer = None
+    if reference in INTERPRETER_ENGINES:
+        checkpointer = _Recorder(interval)
+    expected = run_engine(reference, text, input_text, checkpointer)
+    states = {}
+    if checkpointer is not None:
+        states = checkpointer.states
+    divergences = []
+    for engine in engines[1:]:
+        try:
+            run = run_engine(
+                engine, text, input_text, _Comparer(engine, reference, states))
+        except _Diverged as e:
+            divergences.append(e.divergence)
+            continue
+        divergence = compare_runs(reference, engine, expected, run)
+        if divergence is not None:
+            divergences.append(divergence)
+    return divergences
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.differential")
+    parser.add_argument("programs", help="A .hrm file or directory.")
+    parser.add_argument("inputs", help="An input file or directory.")
+    parser.add_argument(
+        "--engines", default=",".join(DEFAULT_ENGINES),
+        help="Comma-separated engines. The first is the reference.")
+    parser.add_argument(
+        "--interval", type=int, default=DEFAULT_INTERVAL,
+        help="Steps between the reference engine's checkpoints.")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    engines = args.engines.split(",")
+    runs = 0
+    failed = 0
+    for program_filename in find_files(args.programs, '.hrm'):
+        text = read(program_filename)
+        for input_filename in find_files(args.inputs, '.txt'):
+            runs += 1
+            divergences = diff_program(
+                text, read(input_filename), engines, args.interval)
+            for divergence in divergences:
+                print "%s %s: %s" % (
+                    program_filename, input_filename, divergence)
+            if divergences:
+                failed += 1
+    print "%d runs, %d with divergences" % (runs, failed)
+    if failed:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
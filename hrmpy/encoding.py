@@ -0,0 +1,135 @@
+"""
+A compact binary encoding shared by the program cache and snapshots.
+
+All integers are encoded as little-endian base-128 varints. Signed integers
+have their sign in the lowest bit. Strings are a length followed by bytes.
+"""
+
+import os
+
+
+class DecodeError(Exception):
+    """
+    Raised when encoded data can't be decoded.
+    """
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class Encoder(object):
+    def __init__(self):
+        self._chunks = []
+
+    def write_uint(self, n):
+        assert n >= 0
+        while n >= 0x80:
+            self._chunks.append(chr((n & 0x7f) | 0x80))
+            n >>= 7
+        self._chunks.append(chr(n))
+
+    def write_int(self, n):
+        if n < 0:
+            self.write_uint(((-n) << 1) | 1)
+        else:
+            self.write_uint(n << 1)
+
+    def write_string(self, s):
+        self.write_uint(len(s))
+        self._chunks.append(s)
+
+    def getvalue(self):
+        return "".join(self._chunks)
+
+
+class Decoder(object):
+    def __init__(self, data, pos=0):
+        self._data = data
+        self._pos = pos
+
+    def error(self, msg):
+        """
+        Raise the exception for bad data. Subclasses can raise something
+        more specific.
+        """
+        raise DecodeError(msg)
+
+    def read_bytes(self, length):
+        start = self._pos
+        end = start + length
+        if length < 0 or end > len(self._data):
+            self.error("Truncated data.")
+        assert start >= 0
+        self._pos = end
+        return self._data[start:end]
+
+    def skip(self, length):
+        """
+        Skip over some bytes without copying them, and return the offset
+        they start at.
+        """
+        start = self._pos
+        if length < 0 or start + length > len(self._data):
+            self.error("Truncated data.")
+        self._pos = start + length
+        return start
+
+    def read_uint(self):
+        n = 0
+        shift = 0
+        while True:
+            byte = ord(self.read_bytes(1)[0])
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+            if shift > 63:
+                self.error("Bad varint.")
+
+    def read_int(self):
+        n = self.read_uint()
+        if n & 1:
+            return -(n >> 1)
+        return n >> 1
+
+    def read_string(self):
+        return self.read_bytes(self.read_uint())
+
+    def at_end(self):
+        return self._pos == len(self._data)
+
+
+def read_file(path):
+    """
+    Return the contents of a file. Raises OSError if it can't be read.
+    """
+    fd = os.open(path, os.O_RDONLY, 0777)
+    chunks = []
+    try:
+        while True:
+            data = os.read(fd, 65536)
+            if len(data) == 0:
+                break
+            chunks.append(data)
+    finally:
+        os.close(fd)
+    return "".join(chunks)
+
+
+def write_file_atomically(path, data):
+    """
+    Write data to a temporary file and rename it into place, so readers
+    never see a partial file.
+    """
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+    try:
+        while data:
+            written = os.write(fd, data)
+            assert written >= 0
+            data = data[written:]
+    finally:
+        os.close(fd)
+    os.rename(tmp_path, path)
@@ -0,0 +1,83 @@
+"""
+Observers for events in a running program.
+
+An observer subclasses `Observer` and overrides the methods for the events
+it wants, listing them in `events`. `Hooks` sorts a list of observers by
+event, and is passed to the interpreter. An event with no observers has None
+in place of its list, so the interpreter skips it with a single check. When
+translated with the JIT, the hooks are green, so the check is folded away and
+an event nobody observes costs nothing at all.
+
+The events are:
+
+  INBOX   a value was taken from the input
+  OUTBOX  a value was sent to the output
+  WRITE   a value was written to a tile
+  JUMP    a jump was taken
+
+In an optimized program, a collapsed counting loop only reports its last
+write and the jump out of the loop.
+"""
+
+
+INBOX = 1
+OUTBOX = 2
+WRITE = 4
+JUMP = 8
+
+
+class Observer(object):
+    """
+    Something that wants to know about events. `events` is the bitwise OR
+    of the events it observes.
+    """
+    events = 0
+
+    def on_inbox(self, pc, kind, integer):
+        pass
+
+    def on_outbox(self, pc, kind, integer):
+        pass
+
+    def on_write(self, pc, addr, kind, integer):
+        pass
+
+    def on_jump(self, pc, target):
+        pass
+
+
+class Hooks(object):
+    """
+    The observers for each event, or None for events nobody observes.
+    """
+    _immutable_fields_ = ['inbox[*]', 'outbox[*]', 'writes[*]', 'jumps[*]']
+
+    def __init__(self, observers):
+        self.inbox = _observing(observers, INBOX)
+        self.outbox = _observing(observers, OUTBOX)
+        self.writes = _observing(observers, WRITE)
+        self.jumps = _observing(observers, JUMP)
+
+    def on_inbox(self, pc, kind, integer):
+        for observer in self.inbox:
+            observer.on_inbox(pc, kind, integer)
+
+    def on_outbox(self, pc, kind, integer):
+        for observer in self.outbox:
+            observer.on_outbox(pc, kind, integer)
+
+    def on_write(self, pc, addr, kind, integer):
+        for observer in self.writes:
+            observer.on_write(pc, addr, kind, integer)
+
+    def on_jump(self, pc, target):
+        for observer in self.jumps:
+            observer.on_jump(pc, target)
+
+
+def _observing(observers, event):
+    observing = [observer for observer in observers
+                 if observer.events & event]
+    if not observing:
+        return None
+    return observing
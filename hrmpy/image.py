@@ -0,0 +1,131 @@
+"""
+Memory images: a compact binary form of a floor full of tiles.
+
+An image holds the pages of `Memory` that have anything in them, each as a
+length-prefixed block of tiles. Loading an image only reads the page index,
+and each page is decoded the first time the program touches it, so startup
+doesn't get slower as the image gets bigger.
+
+To convert a text floor file to an image:
+
+  $ python -m hrmpy.image floor.txt floor.hrmi
+"""
+
+import sys
+
+import hrmpy.operations as ops
+from hrmpy.encoding import (
+    DecodeError, Decoder, Encoder, read_file, write_file_atomically)
+
+
+MAGIC = "HRMI"
+FORMAT_VERSION = 1
+
+
+class ImageError(DecodeError):
+    """
+    Raised when a memory image can't be decoded.
+    """
+
+
+class _Decoder(Decoder):
+    def error(self, msg):
+        raise ImageError(msg)
+
+
+def is_image(data):
+    """
+    Return True if some data looks like a memory image.
+    """
+    return data.startswith(chr(len(MAGIC)) + MAGIC)
+
+
+def dump_image(size, page_bits, addrs, kinds, integers):
+    """
+    Encode the tiles of a memory as an image. The tiles are given as
+    parallel lists in address order, like `Memory.tiles()` returns them.
+    """
+    page_size = 1 << page_bits
+    encoder = Encoder()
+    encoder.write_string(MAGIC)
+    encoder.write_uint(FORMAT_VERSION)
+    encoder.write_uint(size)
+    encoder.write_uint(page_bits)
+    pages = []
+    i = 0
+    while i < len(addrs):
+        index = addrs[i] >> page_bits
+        page = Encoder()
+        for offset in range(page_size):
+            addr = (index << page_bits) + offset
+            if i < len(addrs) and addrs[i] == addr:
+                page.write_uint(kinds[i])
+                page.write_int(integers[i])
+                i += 1
+            else:
+                page.write_uint(ops.EMPTY)
+                page.write_int(0)
+        pages.append((index, page.getvalue()))
+    encoder.write_uint(len(pages))
+    for index, data in pages:
+        encoder.write_uint(index)
+        encoder.write_string(data)
+    return encoder.getvalue()
+
+
+class MemoryImage(object):
+    """
+    A decoded image index. Pages are only decoded by `fill_page()`.
+    """
+    def __init__(self, data):
+        self._data = data
+        decoder = _Decoder(data)
+        if decoder.read_string() != MAGIC:
+            raise ImageError("Not a memory image.")
+        if decoder.read_uint() != FORMAT_VERSION:
+            raise ImageError("Wrong memory image format version.")
+        self.size = decoder.read_uint()
+        self.page_bits = decoder.read_uint()
+        if self.page_bits > 16:
+            raise ImageError("Bad page size in memory image.")
+        page_count = (self.size + (1 << self.page_bits) - 1) >> self.page_bits
+        # The offset of each page's tiles in the data, or -1 if the page is
+        # empty.
+        self._offsets = [-1] * page_count
+        for _ in range(decoder.read_uint()):
+            index = decoder.read_uint()
+            if index >= page_count:
+                raise ImageError("Bad page %d in memory image." % (index,))
+            self._offsets[index] = decoder.skip(decoder.read_uint())
+        if not decoder.at_end():
+            raise ImageError("Trailing data in memory image.")
+
+    def has_page(self, index):
+        return self._offsets[index] >= 0
+
+    def fill_page(self, index, kinds, integers):
+        """
+        Decode a page into the kinds and integers lists of a memory page.
+        """
+        decoder = _Decoder(self._data, self._offsets[index])
+        for offset in range(len(kinds)):
+            kind = decoder.read_uint()
+            if not (kind == ops.EMPTY or kind == ops.INTEGER or
+                    kind == ops.CHARACTER):
+                raise ImageError(
+                    "Bad value kind %d in memory image." % (kind,))
+            kinds[offset] = kind
+            integers[offset] = decoder.read_int()
+
+
+def main(argv):
+    from hrmpy.main import load_floor
+    if len(argv) != 3:
+        print "usage: python -m hrmpy.image FLOOR_FILE IMAGE_FILE"
+        return 1
+    write_file_atomically(argv[2], load_floor(read_file(argv[1])).image())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,363 @@
+"""
+Run one program against many input sets side by side, one lane per set.
+
+  $ python -m hrmpy.lanes [--max-steps N] [--no-numpy] PROGRAM INPUTS
+
+Each line of INPUTS is a separate input set, like the lines of
+`inputs/alphabetwords.txt`. A JSON list is written with the output, step
+count and error for each line, the same as running the program against that
+line on its own.
+
+With NumPy installed, every lane's pc, accumulator, step count, input
+position and tiles are held in arrays, and each instruction is run for all
+the lanes that are at it in one go. The lanes at the lowest pc always go
+next, so after their control flow diverges, lanes that have fallen behind
+catch up and run together again. Without NumPy (or with --no-numpy), the
+lanes are run one after another on a single Machine.
+
+Only the plain instructions are run across lanes, so programs are built
+without the optimizer. Step counts are the same either way.
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import json
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import hrmpy.operations as ops
+from hrmpy.budget import Budget, BudgetExceeded
+from hrmpy.main import (
+    MEMORY_SIZE, UNDEFINED_LABEL, Machine, Memory, build_program, read)
+from hrmpy.parser import parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+PLAIN_OPCODES = [
+    ops.OP_INBOX, ops.OP_OUTBOX, ops.OP_COPYTO, ops.OP_COPYFROM, ops.OP_ADD,
+    ops.OP_SUB, ops.OP_BUMPUP, ops.OP_BUMPDN, ops.OP_JUMP, ops.OP_JUMPZ,
+    ops.OP_JUMPN]
+
+STEP_LIMIT = "Step limit of %d exceeded."
+
+
+def read_input_sets(text):
+    """
+    Parse each line of some text as a separate list of input values.
+    """
+    return [parse_input_data(line) for line in text.splitlines()]
+
+
+def run_lanes(program, input_sets, max_steps=-1, vectorized=None):
+    """
+    Run an unoptimized program against each list of input values and return
+    a list of result dicts, in the same order.
+
+    Each result has the output, the step count and the error message (or
+    None). A run that takes a backward jump after more than `max_steps`
+    steps is stopped with an error, the same way a Budget stops it. The
+    lanes are run with NumPy if `vectorized` is set, or if it is None and
+    NumPy is installed.
+    """
+    for pc in range(program.size):
+        if program.opcodes[pc] not in PLAIN_OPCODES:
+            raise ValueError("Lanes can only run unoptimized programs.")
+    if vectorized is None:
+        vectorized = numpy is not None
+    if vectorized:
+        if numpy is None:
+            raise ValueError("Running lanes side by side needs NumPy.")
+        lanes = Lanes(program, input_sets, max_steps)
+        lanes.run()
+        return lanes.results()
+    return _run_machine(program, input_sets, max_steps)
+
+
+def _run_machine(program, input_sets, max_steps):
+    machine = Machine(program, None, None)
+    results = []
+    for values in input_sets:
+        output = ListOutputSink()
+        budget = None
+        if max_steps >= 0:
+            budget = Budget(max_steps)
+        result = {'output': output.output, 'steps': None, 'error': None}
+        try:
+            machine.reset(ListInputQueue(values), output)
+            result['steps'] = machine.run(budget=budget)
+        except (ops.IllegalOperation, BudgetExceeded) as e:
+            result['steps'] = e.steps
+            result['error'] = str(e)
+        results.append(result)
+    return results
+
+
+class Lanes(object):
+    """
+    The state of many runs of one program, as NumPy arrays indexed by lane.
+
+    `kinds` and `integers` hold every lane's tiles, one row per lane. There
+    are only as many columns as the highest direct address needs, and more
+    are added when a pointer goes past them.
+    """
+    def __init__(self, program, input_sets, max_steps=-1):
+        # Bad .memset addresses fail before anything runs, as in Machine.
+        program.check_initial_memory(Memory())
+        count = len(input_sets)
+        self.program = program
+        self.max_steps = max_steps
+        self.pc = numpy.zeros(count, numpy.int64)
+        self.acc_kind = numpy.zeros(count, numpy.int8)
+        self.acc = numpy.zeros(count, numpy.int64)
+        self.steps = numpy.zeros(count, numpy.int64)
+        self.running = numpy.ones(count, numpy.bool_)
+        if program.size == 0:
+            self.running[:] = False
+        self.outputs = [[] for _ in range(count)]
+        self.errors = [None] * count
+        length = max([len(values) for values in input_sets] + [1])
+        self.input_kinds = numpy.zeros((count, length), numpy.int8)
+        self.input_integers = numpy.zeros((count, length), numpy.int64)
+        self.input_lengths = numpy.zeros(count, numpy.int64)
+        self.input_positions = numpy.zeros(count, numpy.int64)
+        for lane, values in enumerate(input_sets):
+            self.input_lengths[lane] = len(values)
+            for i, value in enumerate(values):
+                self.input_kinds[lane, i] = value.kind
+                self.input_integers[lane, i] = value.unboxed()
+        width = min(program.max_addr, MEMORY_SIZE - 1) + 1
+        self.kinds = numpy.zeros((count, width), numpy.int8)
+        self.integers = numpy.zeros((count, width), numpy.int64)
+        for addr, value in program.initial_memory().items():
+            self.kinds[:, addr] = value.kind
+            self.integers[:, addr] = value.unboxed()
+
+    def run(self):
+        """
+        Run every lane until it finishes.
+        """
+        while True:
+            lanes = numpy.flatnonzero(self.running)
+            if len(lanes) == 0:
+                break
+            pcs = self.pc[lanes]
+            pc = int(pcs.min())
+            self.step(pc, lanes[pcs == pc])
+
+    def results(self):
+        return [{
+            'output': self.outputs[lane],
+            'steps': int(self.steps[lane]),
+            'error': self.errors[lane],
+        } for lane in range(len(self.outputs))]
+
+    def _fail(self, lanes, bad, msg, *args):
+        """
+        Stop the lanes where `bad` is set with an error message, formatted
+        with each lane's items from `args`. Returns the mask of lanes that
+        carry on.
+        """
+        failed = lanes[bad]
+        if len(failed):
+            columns = [arg[bad].tolist() for arg in args]
+            for i, lane in enumerate(failed.tolist()):
+                self.errors[lane] = msg % tuple(
+                    column[i] for column in columns)
+            self.running[failed] = False
+        return ~bad
+
+    def _held(self, lanes):
+        """
+        Return the lanes holding a value, stopping the rest.
+        """
+        return lanes[self._fail(
+            lanes, self.acc_kind[lanes] == ops.EMPTY, "No value held.")]
+
+    def _grow(self, width):
+        old_width = self.kinds.shape[1]
+        if width <= old_width:
+            return
+        width = min(max(width, 2 * old_width), MEMORY_SIZE)
+        kinds = numpy.zeros((len(self.kinds), width), numpy.int8)
+        integers = numpy.zeros((len(self.kinds), width), numpy.int64)
+        kinds[:, :old_width] = self.kinds
+        integers[:, :old_width] = self.integers
+        self.kinds = kinds
+        self.integers = integers
+
+    def _operand(self, pc, lanes):
+        """
+        Resolve the memory operand of the instruction at `pc` for each lane,
+        stopping the lanes with a bad pointer. Returns the lanes that carry
+        on and their addresses.
+        """
+        addr = self.program.addrs[pc]
+        addrs = numpy.zeros(len(lanes), numpy.int64) + addr
+        if not 0 <= addr < MEMORY_SIZE:
+            keep = self._fail(
+                lanes, numpy.ones(len(lanes), numpy.bool_),
+                "Address %s out of range.", addrs)
+            return lanes[keep], addrs[keep]
+        if not self.program.indirects[pc]:
+            return lanes, addrs
+        kinds = self.kinds[lanes, addr]
+        keep = self._fail(lanes, kinds == ops.EMPTY, "No value in %s.", addrs)
+        lanes, addrs, kinds = lanes[keep], addrs[keep], kinds[keep]
+        keep = self._fail(
+            lanes, kinds != ops.INTEGER, "No integer in %s.", addrs)
+        lanes, addrs = lanes[keep], addrs[keep]
+        ptrs = self.integers[lanes, addr]
+        keep = self._fail(
+            lanes, (ptrs < 0) | (ptrs >= MEMORY_SIZE),
+            "Address %s in %s out of range.", ptrs, addrs)
+        lanes, ptrs = lanes[keep], ptrs[keep]
+        if len(ptrs):
+            self._grow(int(ptrs.max()) + 1)
+        return lanes, ptrs
+
+    def _tile(self, pc, lanes):
+        """
+        Resolve the memory operand and read the tile it refers to, stopping
+        the lanes where it is empty. Returns the lanes that carry on and
+        their addresses, kinds and integers.
+        """
+        lanes, addrs = self._operand(pc, lanes)
+        kinds = self.kinds[lanes, addrs]
+        keep = self._fail(lanes, kinds == ops.EMPTY, "No value in %s.", addrs)
+        lanes, addrs, kinds = lanes[keep], addrs[keep], kinds[keep]
+        return lanes, addrs, kinds, self.integers[lanes, addrs]
+
+    def step(self, pc, lanes):
+        """
+        Run the instruction at `pc` for some lanes.
+        """
+        program = self.program
+        opcode = program.opcodes[pc]
+        jumped = None
+        if opcode == ops.OP_INBOX:
+            positions = self.input_positions[lanes]
+            empty = positions >= self.input_lengths[lanes]
+            # Running out of input finishes the run.
+            self.running[lanes[empty]] = False
+            lanes, positions = lanes[~empty], positions[~empty]
+            self.acc_kind[lanes] = self.input_kinds[lanes, positions]
+            self.acc[lanes] = self.input_integers[lanes, positions]
+            self.input_positions[lanes] = positions + 1
+        elif opcode == ops.OP_OUTBOX:
+            lanes = self._held(lanes)
+            for lane, kind, integer in zip(
+                    lanes.tolist(), self.acc_kind[lanes].tolist(),
+                    self.acc[lanes].tolist()):
+                self.outputs[lane].append(ops.tostr(kind, integer))
+            self.acc_kind[lanes] = ops.EMPTY
+        elif opcode == ops.OP_COPYTO:
+            lanes, addrs = self._operand(pc, self._held(lanes))
+            self.kinds[lanes, addrs] = self.acc_kind[lanes]
+            self.integers[lanes, addrs] = self.acc[lanes]
+        elif opcode == ops.OP_COPYFROM:
+            lanes, addrs, kinds, integers = self._tile(pc, lanes)
+            self.acc_kind[lanes] = kinds
+            self.acc[lanes] = integers
+        elif opcode == ops.OP_ADD or opcode == ops.OP_SUB:
+            lanes, addrs, kinds, integers = self._tile(pc, self._held(lanes))
+            acc_kinds = self.acc_kind[lanes]
+            if opcode == ops.OP_ADD:
+                keep = self._fail(
+                    lanes, (acc_kinds != ops.INTEGER) | (kinds != ops.INTEGER),
+                    "Can't add these.")
+            else:
+                keep = self._fail(
+                    lanes, acc_kinds != kinds, "Can't sub these.")
+            lanes, integers = lanes[keep], integers[keep]
+            if opcode == ops.OP_ADD:
+                self.acc[lanes] += integers
+            else:
+                self.acc[lanes] -= integers
+            self.acc_kind[lanes] = ops.INTEGER
+        elif opcode == ops.OP_BUMPUP or opcode == ops.OP_BUMPDN:
+            lanes, addrs, kinds, integers = self._tile(pc, lanes)
+            if opcode == ops.OP_BUMPUP:
+                keep = self._fail(
+                    lanes, kinds != ops.INTEGER, "Can't add these.")
+                integers = integers + 1
+            else:
+                keep = self._fail(
+                    lanes, kinds != ops.INTEGER, "Can't sub these.")
+                integers = integers - 1
+            lanes, addrs, integers = lanes[keep], addrs[keep], integers[keep]
+            self.acc_kind[lanes] = ops.INTEGER
+            self.acc[lanes] = integers
+            self.kinds[lanes, addrs] = ops.INTEGER
+            self.integers[lanes, addrs] = integers
+        elif opcode == ops.OP_JUMP:
+            jumped = numpy.ones(len(lanes), numpy.bool_)
+        elif opcode == ops.OP_JUMPZ or opcode == ops.OP_JUMPN:
+            lanes = self._held(lanes)
+            integers = self.acc[lanes]
+            if opcode == ops.OP_JUMPZ:
+                jumped = integers == 0
+            else:
+                jumped = integers < 0
+            jumped &= self.acc_kind[lanes] == ops.INTEGER
+        else:
+            assert False, "Unknown opcode: %s" % (opcode,)
+        self._advance(pc, lanes, jumped)
+
+    def _advance(self, pc, lanes, jumped):
+        """
+        Count the steps for some lanes that have run the instruction at
+        `pc`, and move them on to the next one.
+        """
+        program = self.program
+        self.steps[lanes] += program.steps[pc]
+        next_pcs = numpy.zeros(len(lanes), numpy.int64) + (pc + 1)
+        if jumped is not None and jumped.any():
+            target = program.targets[pc]
+            if target < 0:
+                keep = self._fail(lanes, jumped, UNDEFINED_LABEL % (
+                    program[pc].label,))
+                lanes, next_pcs = lanes[keep], next_pcs[keep]
+            else:
+                next_pcs[jumped] = target
+                self.steps[lanes[jumped]] += program.hops[pc]
+        self.pc[lanes] = next_pcs
+        self.running[lanes[next_pcs >= program.size]] = False
+        if self.max_steps >= 0:
+            # Only backward jumps are checked, as with a Budget.
+            self._fail(
+                lanes, (next_pcs <= pc) & (self.steps[lanes] > self.max_steps),
+                STEP_LIMIT % (self.max_steps,))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.lanes")
+    parser.add_argument("program", help="A .hrm file.")
+    parser.add_argument(
+        "inputs", help="An input file with an input set on each line.")
+    parser.add_argument(
+        "--max-steps", type=int, default=-1,
+        help="Stop each run after this many steps.")
+    parser.add_argument(
+        "--no-numpy", dest='vectorized', action='store_const', const=False,
+        default=None, help="Run the lanes one at a time.")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    program = build_program(read(args.program), optimized=False)
+    results = run_lanes(
+        program, read_input_sets(read(args.inputs)), args.max_steps,
+        args.vectorized)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,13 @@
 import os
+import time
 
 try:
     from rpython.rlib.jit import JitDriver
+    from rpython.rlib.objectmodel import we_are_translated
 except ImportError:
+    def we_are_translated():
+        return False
+
     class JitDriver(object):
         """
         Fake JitDriver to avoid a hard dependency on RPython.
@@ -17,38 +22,206 @@ except ImportError:
             pass
 
 import hrmpy.operations as ops
-from hrmpy.parser import parse_program, parse_input_data
+from hrmpy.analysis import analyze
+from hrmpy.budget import Budget, BudgetExceeded
+from hrmpy.cache import ProgramCache, program_key
+from hrmpy.image import ImageError, MemoryImage, dump_image, is_image
+from hrmpy.memprofile import MemoryProfiler, write_memory_report
+from hrmpy.optimizer import optimize
+from hrmpy.profiler import Profiler, write_report
+from hrmpy.parser import (
+    parse_floor, parse_program, FileInputTokenizer, CHUNK_SIZE)
+from hrmpy.trace import TRACE_SIZE, Tracer, write_trace
+from hrmpy.snapshot import (
+    Checkpointer, Snapshot, SnapshotError, SNAPSHOT_INTERVAL, is_snapshot,
+    load_snapshot)
+from hrmpy.streams import ListInputQueue, FileOutputSink, PrintOutputSink
 
 
-class Memory(object):
+MEMORY_SIZE = ops.MEMORY_SIZE
+PAGE_BITS = 8
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+UNDEFINED_LABEL = "Jump to undefined label %s."
+
+
+class MemoryPage(object):
+    """
+    A fixed-size block of memory tiles. Empty tiles have the EMPTY kind.
+    """
     def __init__(self):
-        self._cells = {}
+        self.kinds = [ops.EMPTY] * PAGE_SIZE
+        self.integers = [0] * PAGE_SIZE
+
+
+class Memory(object):
+    """
+    Memory tiles holding unboxed values, stored as a kind tag and an integer.
 
-    def get_addr(self, addr):
-        ops.check_legal(addr in self._cells, "No value in %s." % (addr,))
-        return self._cells[addr]
+    Tiles live in pages that are only allocated when something is written to
+    them, so sparse high addresses are cheap. If the memory was loaded from
+    an image, each page is read from the image the first time it is used.
+    """
+    def __init__(self, size=MEMORY_SIZE):
+        self.size = size
+        self._pages = [None] * ((size + PAGE_MASK) >> PAGE_BITS)
+        self._image = None
 
-    def set_addr(self, addr, value):
-        self._cells[addr] = value
+    def _page(self, addr):
+        """
+        Return the page holding an address, allocating it if necessary.
+        """
+        page = self._pages[addr >> PAGE_BITS]
+        if page is None:
+            page = self._new_page(addr >> PAGE_BITS)
+        return page
+
+    def _new_page(self, index):
+        page = MemoryPage()
+        if self._image is not None and self._image.has_page(index):
+            self._image.fill_page(index, page.kinds, page.integers)
+        self._pages[index] = page
+        return page
+
+    def _kind(self, addr):
+        page = self._pages[addr >> PAGE_BITS]
+        if page is None:
+            if self._image is None:
+                return ops.EMPTY
+            page = self._new_page(addr >> PAGE_BITS)
+        return page.kinds[addr & PAGE_MASK]
 
-    def _op_addr(self, op):
-        addr = op.addr
-        if op.indirect:
-            ptr = self.get_addr(addr)
+    def load_image(self, image):
+        """
+        Use a MemoryImage for the initial contents of every page that hasn't
+        been used yet.
+        """
+        if image.size != self.size or image.page_bits != PAGE_BITS:
+            raise ImageError("The memory image has the wrong layout.")
+        self._image = image
+
+    def image(self):
+        """
+        Return the contents of memory encoded as an image.
+        """
+        addrs, kinds, integers = self.tiles()
+        return dump_image(self.size, PAGE_BITS, addrs, kinds, integers)
+
+    def tile_kind(self, addr):
+        """
+        Return the kind of value in a tile, which is EMPTY if there isn't
+        one.
+        """
+        return self._kind(addr)
+
+    def get_kind(self, addr):
+        kind = self._kind(addr)
+        ops.check_legal(kind != ops.EMPTY, "No value in %s." % (addr,))
+        return kind
+
+    def get_integer(self, addr):
+        return self._pages[addr >> PAGE_BITS].integers[addr & PAGE_MASK]
+
+    def set_addr(self, addr, kind, integer):
+        page = self._page(addr)
+        page.kinds[addr & PAGE_MASK] = kind
+        page.integers[addr & PAGE_MASK] = integer
+
+    def get_value(self, addr):
+        """
+        Return the boxed value in a tile, or None if it is empty.
+        """
+        kind = self._kind(addr)
+        if kind == ops.EMPTY:
+            return None
+        return ops.box(kind, self.get_integer(addr))
+
+    def check_addr(self, addr):
+        ops.check_legal(
+            0 <= addr < self.size, "Address %s out of range." % (addr,))
+
+    def resolve(self, addr, indirect):
+        """
+        Return the address an operand refers to, following the pointer if the
+        operand is indirect.
+        """
+        if not 0 <= addr < self.size:
+            raise ops.IllegalOperation("Address %s out of range." % (addr,))
+        if indirect:
+            kind = self.get_kind(addr)
+            ops.check_legal(
+                kind == ops.INTEGER, "No integer in %s." % (addr,))
+            ptr = self.get_integer(addr)
             ops.check_legal(
-                isinstance(ptr, ops.Integer), "No integer in %s." % (addr,))
-            addr = ptr.integer
+                0 <= ptr < self.size,
+                "Address %s in %s out of range." % (ptr, addr))
+            addr = ptr
         return addr
 
-    def get_op(self, op):
-        return self.get_addr(self._op_addr(op))
+    def clear(self):
+        """
+        Empty every tile, keeping the pages that have been allocated. Pages
+        from an image are dropped so they are loaded again when used.
+        """
+        for index in range(len(self._pages)):
+            page = self._pages[index]
+            if page is None:
+                continue
+            if self._image is not None and self._image.has_page(index):
+                self._pages[index] = None
+                continue
+            for offset in range(PAGE_SIZE):
+                page.kinds[offset] = ops.EMPTY
 
-    def set_op(self, op, value):
-        self.set_addr(self._op_addr(op), value)
+    def tiles(self):
+        """
+        Return the address, kind and integer of every tile holding a value,
+        as three parallel lists in address order.
+        """
+        addrs = []
+        kinds = []
+        integers = []
+        for index in range(len(self._pages)):
+            page = self._pages[index]
+            if page is None:
+                if self._image is None or not self._image.has_page(index):
+                    continue
+                page = self._new_page(index)
+            for offset in range(PAGE_SIZE):
+                if page.kinds[offset] != ops.EMPTY:
+                    addrs.append((index << PAGE_BITS) + offset)
+                    kinds.append(page.kinds[offset])
+                    integers.append(page.integers[offset])
+        return addrs, kinds, integers
 
 
 class Program(object):
-    def __init__(self, operations):
+    """
+    A program compiled to parallel arrays of opcodes and operands.
+
+    For each instruction at index `pc`, `opcodes[pc]` is its integer opcode,
+    `addrs[pc]` and `indirects[pc]` describe the memory operand (if any), and
+    `targets[pc]` is the absolute index a jump goes to (or -1 if the label is
+    undefined or the instruction is not a jump). `steps[pc]` is the number of
+    steps the instruction counts as, and `hops[pc]` is the number of extra
+    steps a taken jump counts as. `loops[pc]` is the CountingLoop for a
+    collapsed counting loop, and None for everything else.
+
+    `source_size` is the number of instructions in the program as written,
+    before the optimizer fused or dropped any of them, which is how HRM
+    measures a program's size. If it isn't given, it is worked out from the
+    operations.
+    """
+    _immutable_fields_ = [
+        'opcodes[*]', 'addrs[*]', 'indirects[*]', 'targets[*]', 'steps[*]',
+        'hops[*]', 'loops[*]', 'size', 'source_size', 'min_addr',
+        'max_addr']
+
+    def __init__(self, operations, source_size=-1):
+        if source_size < 0:
+            source_size = count_instructions(operations)
+        self.source_size = source_size
         self._jump_labels = {}
         self._comments = {}
         self._comment_values = {}
@@ -80,10 +253,84 @@ class Program(object):
             else:
                 assert not isinstance(op, ops.PseudoOperation)
                 self._operations.append(op)
+        self._compile()
+
+    def _compile(self):
+        self.min_addr = 0
+        self.max_addr = -1
+        for addr in self._initial_memory:
+            self.min_addr = min(self.min_addr, addr)
+            self.max_addr = max(self.max_addr, addr)
+        self.size = len(self._operations)
+        self.opcodes = [0] * self.size
+        self.addrs = [0] * self.size
+        self.indirects = [False] * self.size
+        self.targets = [-1] * self.size
+        self.steps = [1] * self.size
+        self.hops = [0] * self.size
+        self.loops = [None] * self.size
+        for pc, op in enumerate(self._operations):
+            opname = op.name
+            self.steps[pc] = op.steps
+            if isinstance(op, ops.MemoryOperation):
+                self._compile_operand(pc, op.addr, op.indirect)
+            elif isinstance(op, ops.JumpOperation):
+                self.targets[pc] = self._jump_labels.get(op.label, -1)
+                self.hops[pc] = op.hops
+            elif isinstance(op, ops.SuperOperation):
+                self._compile_operand(pc, op.addr, op.indirect)
+                if op.label is not None:
+                    self.targets[pc] = self._jump_labels.get(op.label, -1)
+                    self.hops[pc] = op.hops
+            elif isinstance(op, ops.CountingLoop):
+                self._compile_operand(pc, op.addr, False)
+                self.steps[pc] = op.size
+                self.loops[pc] = op
+                if op.label is not None:
+                    self.targets[pc] = self._jump_labels.get(op.label, -1)
+            assert opname in ops.OPCODES, "Unknown op: %s" % (op,)
+            self.opcodes[pc] = ops.OPCODES[opname]
+
+    def _compile_operand(self, pc, addr, indirect):
+        self.addrs[pc] = addr
+        self.indirects[pc] = indirect
+        self.min_addr = min(self.min_addr, addr)
+        self.max_addr = max(self.max_addr, addr)
+
+    def jump_target(self, pc):
+        target = self.targets[pc]
+        if target < 0:
+            raise ops.IllegalOperation(
+                UNDEFINED_LABEL % (self._operations[pc].label,))
+        return target
+
+    def check_initial_memory(self, memory):
+        """
+        Check the addresses set by `.memset`, lowest first. Operands are
+        checked when the instruction runs.
+        """
+        addrs = self._initial_memory.keys()
+        addrs.sort()
+        for addr in addrs:
+            memory.check_addr(addr)
 
     def set_initial_memory(self, memory):
+        self.check_initial_memory(memory)
         for addr in self._initial_memory:
-            memory.set_addr(addr, self._initial_memory[addr])
+            value = self._initial_memory[addr]
+            memory.set_addr(addr, value.kind, value.unboxed())
+
+    def initial_memory(self):
+        """
+        Return a dict mapping addresses to the values set by `.memset`.
+        """
+        return self._initial_memory
+
+    def jump_labels(self):
+        """
+        Return a dict mapping each jump label to its instruction index.
+        """
+        return self._jump_labels
 
     def __getitem__(self, index):
         return self._operations[index]
@@ -92,89 +339,681 @@ class Program(object):
         return len(self._operations)
 
 
-def not_none(value):
-    ops.check_legal(value is not None, "No value held.")
-    return value
+def count_instructions(operations):
+    """
+    Return the number of instructions in a list of operations, counting
+    each fused operation as the instructions it was built from.
+    """
+    count = 0
+    for op in operations:
+        if isinstance(op, ops.CountingLoop):
+            count += op.size
+        elif not isinstance(op, ops.PseudoOperation):
+            count += op.steps
+    return count
+
+
+def not_empty(kind):
+    ops.check_legal(kind != ops.EMPTY, "No value held.")
 
 
+# The profilers, tracer, checkpointer, budget and hooks are green so that the
+# JIT can remove their code entirely when they are None.
 jitdriver = JitDriver(
-    greens=['pc', 'program'], reds=['memory', 'acc', 'input_data'])
+    greens=['pc', 'program', 'profiler', 'tracer', 'checkpointer', 'budget',
+            'hooks', 'memory_profiler'],
+    reds=['memory', 'acc_kind', 'acc', 'steps', 'stop_steps', 'inputs',
+          'output'])
 
 
-def mainloop(program, input_data):
+def mainloop(program, input_data, output=None, optimized=False):
+    if output is None:
+        output = PrintOutputSink()
+    source_size = count_instructions(program)
+    if optimized:
+        program = optimize(program)
+    machine = Machine(Program(program, source_size),
+                      ListInputQueue(input_data), output)
+    try:
+        return machine.run()
+    finally:
+        output.flush()
+
+
+def execute(program, inputs, output, profiler=None, memory=None,
+            snapshot=None, checkpointer=None, budget=None, tracer=None,
+            hooks=None, memory_profiler=None):
+    """
+    Run a program and return the number of steps it took.
+
+    If the program raises IllegalOperation, the number of steps completed
+    before the error is stored on the exception. If a profiler is given, it
+    records every instruction executed.
+
+    `memory` is the floor to start with, if it isn't empty. If a snapshot is
+    given, the run carries on from where the snapshot was taken, and the
+    steps returned include the steps before it. If a checkpointer is given,
+    it is offered a snapshot on backward jumps. If a budget is given and the
+    program runs out of it, BudgetExceeded is raised. If a tracer is given,
+    it records every instruction executed. If hooks are given, their
+    observers are told about the events they observe. If a memory profiler
+    is given, it counts every tile accessed.
+    """
+    machine = Machine(
+        program, inputs, output, memory, profiler, tracer, hooks,
+        memory_profiler)
+    if snapshot is not None:
+        machine.restore(snapshot)
+    try:
+        return machine.run(checkpointer, budget)
+    finally:
+        output.flush()
+
+
+class Machine(object):
+    """
+    A program with an input queue, an output sink, memory and the state of
+    a run: the instruction index, the accumulator and the step count.
+
+    `run()` runs the program until it finishes, and `step()` runs it a few
+    steps at a time. `reset()` starts again from the beginning, reusing the
+    memory pages that have already been allocated, so one machine can run a
+    program against many inputs. Output is never flushed by the machine.
+    """
+    def __init__(self, program, inputs, output, memory=None, profiler=None,
+                 tracer=None, hooks=None, memory_profiler=None):
+        if memory is None:
+            memory = Memory()
+        self.program = program
+        self.inputs = inputs
+        self.output = output
+        self.memory = memory
+        self.profiler = profiler
+        self.tracer = tracer
+        self.hooks = hooks
+        self.memory_profiler = memory_profiler
+        self.pc = 0
+        # The accumulator is unboxed into a kind tag and an integer.
+        self.acc_kind = ops.EMPTY
+        self.acc = 0
+        # Steps are only counted once an instruction has completed.
+        self.steps = 0
+        self.finished = False
+        program.set_initial_memory(memory)
+
+    def reset(self, inputs=None, output=None):
+        """
+        Empty memory and go back to the start, optionally with new input and
+        output.
+        """
+        if inputs is not None:
+            self.inputs = inputs
+        if output is not None:
+            self.output = output
+        self.memory.clear()
+        self.pc = 0
+        self.acc_kind = ops.EMPTY
+        self.acc = 0
+        self.steps = 0
+        self.finished = False
+        self.program.set_initial_memory(self.memory)
+
+    def restore(self, snapshot):
+        """
+        Carry on from where a snapshot was taken.
+        """
+        self.memory.clear()
+        for i in range(len(snapshot.addrs)):
+            self.memory.check_addr(snapshot.addrs[i])
+            self.memory.set_addr(
+                snapshot.addrs[i], snapshot.kinds[i], snapshot.integers[i])
+        self.pc = snapshot.pc
+        self.acc_kind = snapshot.acc_kind
+        self.acc = snapshot.acc
+        self.steps = snapshot.steps
+        self.finished = False
+        self.inputs.seek(snapshot.input_position)
+        self.output.count = snapshot.output_count
+
+    def run(self, checkpointer=None, budget=None):
+        """
+        Run until the program finishes and return the total step count.
+        """
+        if checkpointer is not None:
+            checkpointer.start_from(self.steps)
+        if budget is not None:
+            budget.start_from(self.steps)
+        _run(self, -1, checkpointer, budget)
+        return self.steps
+
+    def step(self, steps=1):
+        """
+        Run until at least `steps` more steps have been taken or the program
+        finishes, and return True if it hasn't finished. A fused instruction
+        is never split, so this can go a little further.
+        """
+        _run(self, self.steps + steps, None, None)
+        return not self.finished
+
+
+def _run(machine, stop_steps, checkpointer, budget):
+    """
+    The interpreter loop. The machine's state is kept in locals while it
+    runs and written back when it stops, even if it stops with an error.
+    `stop_steps` is negative to run until the program finishes.
+    """
+    if machine.finished:
+        return
+    program = machine.program
+    inputs = machine.inputs
+    output = machine.output
+    memory = machine.memory
+    profiler = machine.profiler
+    tracer = machine.tracer
+    hooks = machine.hooks
+    memory_profiler = machine.memory_profiler
+    pc = machine.pc
+    acc_kind = machine.acc_kind
+    acc = machine.acc
+    steps = machine.steps
+    try:
+        while 0 <= pc < program.size and not 0 <= stop_steps <= steps:
+            jitdriver.jit_merge_point(
+                program=program, profiler=profiler, tracer=tracer,
+                checkpointer=checkpointer, budget=budget, hooks=hooks,
+                memory_profiler=memory_profiler, pc=pc, memory=memory,
+                acc_kind=acc_kind, acc=acc, steps=steps, stop_steps=stop_steps,
+                inputs=inputs, output=output)
+            if tracer is not None:
+                tracer.record(pc, steps, acc_kind, acc, memory)
+            if memory_profiler is not None:
+                memory_profiler.record(pc, memory)
+            opcode = program.opcodes[pc]
+            next_pc = pc + 1
+            jumped = False
+            if opcode == ops.OP_INBOX:
+                if not inputs.advance():
+                    break
+                acc_kind = inputs.kind
+                acc = inputs.integer
+                if hooks is not None and hooks.inbox is not None:
+                    hooks.on_inbox(pc, acc_kind, acc)
+            elif opcode == ops.OP_OUTBOX:
+                not_empty(acc_kind)
+                output.write(ops.tostr(acc_kind, acc))
+                if hooks is not None and hooks.outbox is not None:
+                    hooks.on_outbox(pc, acc_kind, acc)
+                acc_kind = ops.EMPTY
+            elif opcode == ops.OP_COPYTO:
+                not_empty(acc_kind)
+                addr = _operand(program, pc, memory)
+                memory.set_addr(addr, acc_kind, acc)
+                if hooks is not None and hooks.writes is not None:
+                    hooks.on_write(pc, addr, acc_kind, acc)
+            elif opcode == ops.OP_COPYFROM:
+                addr = _operand(program, pc, memory)
+                acc_kind = memory.get_kind(addr)
+                acc = memory.get_integer(addr)
+            elif opcode == ops.OP_ADD:
+                not_empty(acc_kind)
+                addr = _operand(program, pc, memory)
+                acc = ops.add(acc_kind, acc, memory.get_kind(addr),
+                              memory.get_integer(addr))
+                acc_kind = ops.INTEGER
+            elif opcode == ops.OP_SUB:
+                not_empty(acc_kind)
+                addr = _operand(program, pc, memory)
+                acc = ops.sub(acc_kind, acc, memory.get_kind(addr),
+                              memory.get_integer(addr))
+                acc_kind = ops.INTEGER
+            elif opcode == ops.OP_BUMPUP:
+                addr = _operand(program, pc, memory)
+                acc = ops.add(memory.get_kind(addr), memory.get_integer(addr),
+                              ops.INTEGER, 1)
+                acc_kind = ops.INTEGER
+                memory.set_addr(addr, acc_kind, acc)
+                if hooks is not None and hooks.writes is not None:
+                    hooks.on_write(pc, addr, acc_kind, acc)
+            elif opcode == ops.OP_BUMPDN:
+                addr = _operand(program, pc, memory)
+                acc = ops.sub(memory.get_kind(addr), memory.get_integer(addr),
+                              ops.INTEGER, 1)
+                acc_kind = ops.INTEGER
+                memory.set_addr(addr, acc_kind, acc)
+                if hooks is not None and hooks.writes is not None:
+                    hooks.on_write(pc, addr, acc_kind, acc)
+            elif opcode == ops.OP_JUMP:
+                jumped = True
+            elif opcode == ops.OP_JUMPZ:
+                jumped = _is_zero(acc_kind, acc)
+            elif opcode == ops.OP_JUMPN:
+                jumped = _is_negative(acc_kind, acc)
+            elif opcode == ops.OP_COPYFROM_OUTBOX:
+                addr = _operand(program, pc, memory)
+                output.write(ops.tostr(
+                    memory.get_kind(addr), memory.get_integer(addr)))
+                if hooks is not None and hooks.outbox is not None:
+                    hooks.on_outbox(
+                        pc, memory.get_kind(addr), memory.get_integer(addr))
+                acc_kind = ops.EMPTY
+            elif opcode == ops.OP_INBOX_COPYTO:
+                if not inputs.advance():
+                    break
+                acc_kind = inputs.kind
+                acc = inputs.integer
+                if hooks is not None and hooks.inbox is not None:
+                    hooks.on_inbox(pc, acc_kind, acc)
+                addr = _operand(program, pc, memory)
+                memory.set_addr(addr, acc_kind, acc)
+                if hooks is not None and hooks.writes is not None:
+                    hooks.on_write(pc, addr, acc_kind, acc)
+            elif opcode == ops.OP_SUB_JUMPZ or opcode == ops.OP_SUB_JUMPN:
+                not_empty(acc_kind)
+                addr = _operand(program, pc, memory)
+                acc = ops.sub(acc_kind, acc, memory.get_kind(addr),
+                              memory.get_integer(addr))
+                acc_kind = ops.INTEGER
+                jumped = _jump_taken(opcode == ops.OP_SUB_JUMPZ, acc)
+            elif (opcode == ops.OP_BUMPDN_JUMPZ or
+                  opcode == ops.OP_BUMPDN_JUMPN):
+                addr = _operand(program, pc, memory)
+                acc = ops.sub(memory.get_kind(addr), memory.get_integer(addr),
+                              ops.INTEGER, 1)
+                acc_kind = ops.INTEGER
+                memory.set_addr(addr, acc_kind, acc)
+                if hooks is not None and hooks.writes is not None:
+                    hooks.on_write(pc, addr, acc_kind, acc)
+                jumped = _jump_taken(opcode == ops.OP_BUMPDN_JUMPZ, acc)
+            elif opcode == ops.OP_COUNT_LOOP:
+                loop = program.loops[pc]
+                addr = _operand(program, pc, memory)
+                # The first bump fails the same way the loop would.
+                if loop.delta > 0:
+                    acc = ops.add(memory.get_kind(addr),
+                                  memory.get_integer(addr), ops.INTEGER, 1)
+                else:
+                    acc = ops.sub(memory.get_kind(addr),
+                                  memory.get_integer(addr), ops.INTEGER, 1)
+                acc_kind = ops.INTEGER
+                iterations = loop.iterations(acc - loop.delta)
+                if iterations < 0:
+                    # It never stops, so go around once at a time.
+                    steps += loop.continue_steps - program.steps[pc]
+                    next_pc = pc
+                    exits = 0
+                    iterations = 1
+                else:
+                    acc += (iterations - 1) * loop.delta
+                    steps += loop.exit_steps - program.steps[pc]
+                    steps += (iterations - 1) * loop.continue_steps
+                    jumped = loop.label is not None
+                    exits = 1
+                memory.set_addr(addr, acc_kind, acc)
+                if hooks is not None and hooks.writes is not None:
+                    hooks.on_write(pc, addr, acc_kind, acc)
+                if profiler is not None:
+                    profiler.record_loop(pc, iterations, exits)
+            else:
+                assert False, "Unknown opcode: %s" % (opcode,)
+            steps += program.steps[pc]
+            if jumped:
+                next_pc = program.jump_target(pc)
+                if hooks is not None and hooks.jumps is not None:
+                    hooks.on_jump(pc, next_pc)
+                steps += program.hops[pc]
+            if profiler is not None:
+                profiler.record(pc, jumped)
+            if next_pc <= pc:
+                if checkpointer is not None and checkpointer.due(steps):
+                    _checkpoint(checkpointer, next_pc, memory, acc_kind, acc,
+                                steps, inputs, output)
+                if budget is not None and budget.due(steps):
+                    # The jump has completed, so a machine stopped here
+                    # carries on from its target.
+                    pc = next_pc
+                    budget.check(steps, pc)
+                jitdriver.can_enter_jit(
+                    program=program, profiler=profiler, tracer=tracer,
+                    checkpointer=checkpointer, budget=budget, hooks=hooks,
+                    memory_profiler=memory_profiler, pc=next_pc,
+                    memory=memory, acc_kind=acc_kind, acc=acc, steps=steps,
+                    stop_steps=stop_steps, inputs=inputs, output=output)
+            pc = next_pc
+    except ops.IllegalOperation as e:
+        e.steps = steps
+        raise
+    finally:
+        machine.pc = pc
+        machine.acc_kind = acc_kind
+        machine.acc = acc
+        machine.steps = steps
+        # Running out of input or hitting an error also finishes the run.
+        machine.finished = not (
+            0 <= pc < program.size and 0 <= stop_steps <= steps)
+        if tracer is not None and machine.finished:
+            tracer.finish(pc, steps, acc_kind, acc, memory)
+
+
+def _checkpoint(checkpointer, pc, memory, acc_kind, acc, steps, inputs,
+                output):
+    """
+    Save a snapshot of the state before the instruction at `pc`. Output is
+    flushed first, so everything the snapshot has counted is written.
+    """
+    output.flush()
+    addrs, kinds, integers = memory.tiles()
+    checkpointer.save(Snapshot(
+        checkpointer.program_key, pc, acc_kind, acc, steps, inputs.position(),
+        output.count, addrs, kinds, integers))
+
+
+def load_floor(text):
+    """
+    Return a Memory holding the tiles set in a floor file.
+    """
     memory = Memory()
-    program = Program(program)
-    program.set_initial_memory(memory)
-    acc = None
-    pc = 0
-    while 0 <= pc < len(program):
-        jitdriver.jit_merge_point(
-            program=program, pc=pc, memory=memory, acc=acc,
-            input_data=input_data)
-        op = program[pc]
-        if op.name == 'INBOX':
-            if not input_data:
-                return
-            acc = input_data.pop(0)
-        elif op.name == 'OUTBOX':
-            print not_none(acc).tostr()
-            acc = None
-        elif op.name == 'JUMP':
-            pc = program._jump_labels[op.label] - 1
-        elif op.name == 'JUMPZ':
-            if not_none(acc).zero():
-                pc = program._jump_labels[op.label] - 1
-        elif op.name == 'JUMPN':
-            if not_none(acc).negative():
-                pc = program._jump_labels[op.label] - 1
-        elif op.name == 'COPYTO':
-            memory.set_op(op, not_none(acc))
-        elif op.name == 'COPYFROM':
-            acc = memory.get_op(op)
-        elif op.name == 'ADD':
-            acc = not_none(acc).add(memory.get_op(op))
-        elif op.name == 'SUB':
-            acc = not_none(acc).sub(memory.get_op(op))
-        elif op.name == 'BUMPUP':
-            acc = memory.get_op(op).add(ops.Integer(1))
-            memory.set_op(op, acc)
-        elif op.name == 'BUMPDN':
-            acc = memory.get_op(op).sub(ops.Integer(1))
-            memory.set_op(op, acc)
-        else:
-            assert False, "Unknown op: %s" % (op,)
-        pc += 1
+    for memset in parse_floor(text):
+        memory.check_addr(memset.addr)
+        memory.set_addr(memset.addr, memset.value.kind,
+                        memset.value.unboxed())
+    return memory
+
+
+def _operand(program, pc, memory):
+    return memory.resolve(program.addrs[pc], program.indirects[pc])
+
+
+def _jump_taken(zero, acc):
+    """
+    Decide whether a fused JUMPZ (if `zero` is set) or JUMPN is taken. The
+    accumulator always holds an integer here.
+    """
+    if zero:
+        return acc == 0
+    return acc < 0
+
+
+def _is_zero(acc_kind, acc):
+    not_empty(acc_kind)
+    return acc_kind == ops.INTEGER and acc == 0
+
+
+def _is_negative(acc_kind, acc):
+    not_empty(acc_kind)
+    return acc_kind == ops.INTEGER and acc < 0
+
+
+def build_program(text, optimized=True, cache=None):
+    """
+    Parse, optimize and compile a program. If a ProgramCache is given, a
+    program built from the same text before is loaded from it instead.
+    """
+    operations, source_size, cached = _parse_or_load(text, optimized, cache)
+    return _build(text, operations, source_size, cached, optimized, cache)
+
+
+def _parse_or_load(text, optimized, cache):
+    """
+    The first half of `build_program()`. Returns the operations, the source
+    size and whether they came from the cache, in which case they are
+    already optimized.
+    """
+    if cache is not None:
+        entry = cache.get(program_key(text, optimized))
+        if entry is not None:
+            operations, source_size = entry
+            return operations, source_size, True
+    operations = parse_program(text)
+    return operations, count_instructions(operations), False
+
+
+def _build(text, operations, source_size, cached, optimized, cache):
+    """
+    The second half of `build_program()`.
+    """
+    if optimized and not cached:
+        operations = optimize(operations)
+    program = Program(operations, source_size)
+    if cache is not None and not cached:
+        cache.put(program_key(text, optimized), program)
+    return program
 
 
 def read(filename):
     fp = os.open(filename, os.O_RDONLY, 0777)
-    program_contents = ""
+    chunks = []
     while True:
-        data = os.read(fp, 4096)
+        data = os.read(fp, CHUNK_SIZE)
         if len(data) == 0:
             break
-        program_contents += data
+        chunks.append(data)
     os.close(fp)
-    return program_contents
+    return "".join(chunks)
+
+
+class UsageError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class Options(object):
+    """
+    Command line options.
+    """
+    def __init__(self):
+        self.optimize = True
+        self.profile = None
+        self.memory_profile = None
+        self.stats = False
+        self.compile = False
+        self.cache_dir = None
+        self.check = False
+        self.snapshot = None
+        self.snapshot_every = SNAPSHOT_INTERVAL
+        self.max_steps = -1
+        self.max_seconds = -1
+        self.trace = None
+        self.trace_size = TRACE_SIZE
+        self.program_filename = None
+        self.input_filename = None
+        self.memory_filename = None
+
+
+def parse_options(argv):
+    options = Options()
+    args = []
+    for arg in argv[1:]:
+        if arg == '--no-optimize':
+            options.optimize = False
+        elif arg == '--compile':
+            options.compile = True
+        elif arg == '--check':
+            options.check = True
+        elif arg == '--stats':
+            options.stats = True
+        elif arg == '--profile':
+            options.profile = '-'
+        elif arg.startswith('--profile='):
+            options.profile = arg[len('--profile='):]
+        elif arg == '--memory-profile':
+            options.memory_profile = '-'
+        elif arg.startswith('--memory-profile='):
+            options.memory_profile = arg[len('--memory-profile='):]
+        elif arg.startswith('--cache-dir='):
+            options.cache_dir = arg[len('--cache-dir='):]
+        elif arg.startswith('--snapshot='):
+            options.snapshot = arg[len('--snapshot='):]
+        elif arg.startswith('--snapshot-every='):
+            options.snapshot_every = _positive_int(
+                arg[len('--snapshot-every='):], arg)
+        elif arg.startswith('--trace='):
+            options.trace = arg[len('--trace='):]
+        elif arg.startswith('--trace-size='):
+            options.trace_size = _positive_int(
+                arg[len('--trace-size='):], arg)
+        elif arg.startswith('--max-steps='):
+            options.max_steps = _positive_int(arg[len('--max-steps='):], arg)
+        elif arg.startswith('--max-seconds='):
+            options.max_seconds = _positive_int(
+                arg[len('--max-seconds='):], arg)
+        elif arg.startswith('--'):
+            raise UsageError("Unknown option: %s" % (arg,))
+        else:
+            args.append(arg)
+    if len(args) < 1:
+        raise UsageError("I can't run a program if you don't give me one.")
+    if len(args) < 2 and not options.check:
+        raise UsageError("I can't run a program if you don't give me input.")
+    if len(args) > 3:
+        raise UsageError("Too many arguments.")
+    options.program_filename = args[0]
+    if len(args) > 1:
+        options.input_filename = args[1]
+    if len(args) > 2:
+        options.memory_filename = args[2]
+    return options
+
+
+def _positive_int(text, arg):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise UsageError("Bad option value: %s" % (arg,))
+    return value
 
 
 def entry_point(argv):
     try:
-        program_filename = argv[1]
-    except IndexError:
-        print "I can't run a program if you don't give me one."
+        options = parse_options(argv)
+    except UsageError as e:
+        print e.msg
         return 1
-    try:
-        input_filename = argv[2]
-    except IndexError:
-        print "I can't run a program if you don't give me input."
+    if options.check:
+        return check_program(options.program_filename)
+    start = time.time()
+    text = read(options.program_filename)
+    cache = None
+    if options.cache_dir is not None:
+        cache = ProgramCache(options.cache_dir)
+    operations, source_size, cached = _parse_or_load(
+        text, options.optimize, cache)
+    parsed = time.time()
+    program = _build(
+        text, operations, source_size, cached, options.optimize, cache)
+    built = time.time()
+    if options.compile and (we_are_translated() or
+                            options.profile is not None or
+                            options.memory_profile is not None or
+                            options.snapshot is not None or
+                            options.trace is not None or
+                            options.memory_filename is not None or
+                            options.max_steps >= 0 or
+                            options.max_seconds >= 0):
+        print ("--compile only works untranslated and without profiling,"
+               " --snapshot, --trace, limits or a memory file.")
         return 1
+    key = program_key(text, options.optimize)
+    memory = None
+    snapshot = None
+    if options.memory_filename is not None:
+        data = read(options.memory_filename)
+        if is_snapshot(data):
+            try:
+                snapshot = load_snapshot(data)
+            except SnapshotError as e:
+                print "Bad snapshot: %s" % (e.msg,)
+                return 1
+            if snapshot.program_key != key or snapshot.pc >= program.size:
+                print "The snapshot was taken from a different program."
+                return 1
+        elif is_image(data):
+            memory = Memory()
+            try:
+                memory.load_image(MemoryImage(data))
+            except ImageError as e:
+                print "Bad memory image: %s" % (e.msg,)
+                return 1
+        else:
+            memory = load_floor(data)
+    checkpointer = None
+    if options.snapshot is not None:
+        checkpointer = Checkpointer(
+            options.snapshot, key, options.snapshot_every)
+    budget = None
+    if options.max_steps >= 0 or options.max_seconds >= 0:
+        budget = Budget(options.max_steps, float(options.max_seconds))
+    profiler = None
+    if options.profile is not None:
+        profiler = Profiler(program)
+    memory_profiler = None
+    if options.memory_profile is not None:
+        memory_profiler = MemoryProfiler(program, MEMORY_SIZE, PAGE_SIZE)
+    tracer = None
+    if options.trace is not None:
+        tracer = Tracer(program, options.trace_size)
+    steps = -1
+    input_fp = os.open(options.input_filename, os.O_RDONLY, 0777)
     try:
-        memory_filename = argv[3]
-    except IndexError:
-        memory_filename = None
-    program = parse_program(read(program_filename))
-    input_data = parse_input_data(read(input_filename))
-    assert memory_filename is None, "Not implemented yet."
-    mainloop(program, input_data)
+        output = FileOutputSink(1, line_buffered=os.isatty(1))
+        inputs = FileInputTokenizer(input_fp)
+        if not we_are_translated() and options.compile:
+            from hrmpy.codegen import execute_compiled
+            steps = execute_compiled(program, inputs, output)
+        else:
+            steps = execute(program, inputs, output, profiler, memory,
+                            snapshot, checkpointer, budget, tracer,
+                            memory_profiler=memory_profiler)
+    except ops.IllegalOperation as e:
+        steps = e.steps
+        if tracer is not None:
+            tracer.error = e.msg
+        raise
+    except BudgetExceeded as e:
+        steps = e.steps
+        if tracer is not None:
+            tracer.error = e.msg
+        os.write(2, "%s\n" % (e.msg,))
+        return 2
+    finally:
+        os.close(input_fp)
+        if tracer is not None:
+            write_trace(tracer, options.trace)
+        if profiler is not None:
+            write_report(profiler, options.profile)
+        if memory_profiler is not None:
+            write_memory_report(memory_profiler, options.memory_profile)
+        if options.stats:
+            _write_stats(steps, start, parsed, built, time.time())
     return 0
+
+
+def check_program(filename):
+    """
+    Print the problems static analysis finds in the unoptimized program, so
+    that instruction indexes match the source. Returns 1 if any of them
+    would stop the program.
+    """
+    program = Program(parse_program(read(filename)))
+    errors = 0
+    for diagnostic in analyze(program):
+        print "%s:%s" % (filename, diagnostic)
+        if diagnostic.error:
+            errors += 1
+    if errors > 0:
+        return 1
+    return 0
+
+
+def _write_stats(steps, start, parsed, built, finished):
+    """
+    Write a line of execution stats to stderr. Times are in microseconds.
+    """
+    os.write(2, "hrmpy-stats steps=%d parse=%d build=%d run=%d\n" % (
+        steps, _micros(parsed - start), _micros(built - parsed),
+        _micros(finished - built)))
+
+
+def _micros(seconds):
+    return int(seconds * 1000000)
@@ -0,0 +1,246 @@
+"""
+Memory access profiling for HRM programs.
+
+The memory profiler counts the reads and writes of every tile, split into
+direct accesses and accesses through a pointer. Reading the pointer itself
+is a direct read. An instruction's accesses are counted as it starts, the
+same way the tracer records it, so one that fails part way still counts. A
+collapsed counting loop counts as one read and write of its counter however
+often it goes round, so use --no-optimize for exact counts.
+
+Tiles that are less than a page apart are grouped into clusters. Packing the
+clusters next to each other gives the recommended dense range, which is as
+small as the program's memory can be without changing how it is used.
+"""
+
+import hrmpy.operations as ops
+from hrmpy.profiler import write_text
+
+
+READ = 1
+WRITE = 2
+
+READ_OPCODES = [
+    ops.OP_COPYFROM, ops.OP_ADD, ops.OP_SUB, ops.OP_COPYFROM_OUTBOX,
+    ops.OP_SUB_JUMPZ, ops.OP_SUB_JUMPN]
+WRITE_OPCODES = [ops.OP_COPYTO, ops.OP_INBOX_COPYTO]
+READ_WRITE_OPCODES = [
+    ops.OP_BUMPUP, ops.OP_BUMPDN, ops.OP_BUMPDN_JUMPZ, ops.OP_BUMPDN_JUMPN,
+    ops.OP_COUNT_LOOP]
+
+# Heat map characters, from untouched to most accessed.
+HEAT = " .:-=+*#%@"
+ROW_SIZE = 16
+
+
+class MemoryProfiler(object):
+    """
+    Collects per-tile access counts for a compiled program.
+    """
+    def __init__(self, program, size, page_size):
+        self.program = program
+        self.size = size
+        self.page_size = page_size
+        self.accesses = [0] * program.size
+        for pc in range(program.size):
+            opcode = program.opcodes[pc]
+            if opcode in READ_OPCODES:
+                self.accesses[pc] = READ
+            elif opcode in WRITE_OPCODES:
+                self.accesses[pc] = WRITE
+            elif opcode in READ_WRITE_OPCODES:
+                self.accesses[pc] = READ | WRITE
+        self.direct_reads = [0] * size
+        self.indirect_reads = [0] * size
+        self.direct_writes = [0] * size
+        self.indirect_writes = [0] * size
+        self.max_addr = -1
+
+    def record(self, pc, memory):
+        """
+        Count the tiles the instruction at `pc` is about to access.
+        """
+        access = self.accesses[pc]
+        if access == 0:
+            return
+        addr = self.program.addrs[pc]
+        if not 0 <= addr < self.size:
+            return
+        if not self.program.indirects[pc]:
+            self._count(addr, access, False)
+            return
+        self._count(addr, READ, False)
+        if memory.tile_kind(addr) != ops.INTEGER:
+            return
+        ptr = memory.get_integer(addr)
+        if 0 <= ptr < self.size:
+            self._count(ptr, access, True)
+
+    def _count(self, addr, access, indirect):
+        if access & READ:
+            if indirect:
+                self.indirect_reads[addr] += 1
+            else:
+                self.direct_reads[addr] += 1
+        if access & WRITE:
+            if indirect:
+                self.indirect_writes[addr] += 1
+            else:
+                self.direct_writes[addr] += 1
+        if addr > self.max_addr:
+            self.max_addr = addr
+
+    def total(self, addr):
+        return (self.direct_reads[addr] + self.indirect_reads[addr] +
+                self.direct_writes[addr] + self.indirect_writes[addr])
+
+    def touched(self):
+        """
+        Return the addresses of every tile accessed, in order.
+        """
+        return [addr for addr in range(self.max_addr + 1)
+                if self.total(addr) > 0]
+
+    def clusters(self):
+        """
+        Return a (first, last) pair of addresses for each run of tiles
+        accessed with less than a page of untouched tiles between them.
+        """
+        clusters = []
+        first = -1
+        last = -1
+        for addr in self.touched():
+            if first >= 0 and addr - last > self.page_size:
+                clusters.append((first, last))
+                first = -1
+            if first < 0:
+                first = addr
+            last = addr
+        if first >= 0:
+            clusters.append((first, last))
+        return clusters
+
+    def dense_moves(self):
+        """
+        Return a (first, last, new_first) triple for each cluster, with the
+        clusters packed together from address 0.
+        """
+        moves = []
+        new_first = 0
+        for first, last in self.clusters():
+            moves.append((first, last, new_first))
+            new_first += last - first + 1
+        return moves
+
+    def report(self):
+        """
+        Return a human-readable report with a heat map.
+        """
+        touched = self.touched()
+        pages = 0
+        page = -1
+        for addr in touched:
+            if addr // self.page_size != page:
+                page = addr // self.page_size
+                pages += 1
+        lines = [
+            "Tiles touched: %d" % (len(touched),),
+            "Highest address: %d" % (self.max_addr,),
+            "Pages touched: %d" % (pages,),
+            "Reads: %d direct, %d indirect" % (
+                _sum(self.direct_reads), _sum(self.indirect_reads)),
+            "Writes: %d direct, %d indirect" % (
+                _sum(self.direct_writes), _sum(self.indirect_writes)),
+            "",
+            "Clusters:",
+        ]
+        for first, last in self.clusters():
+            accesses = 0
+            for addr in range(first, last + 1):
+                accesses += self.total(addr)
+            lines.append("  %s-%s %s accesses" % (
+                ops.rjust(str(first), 5), ops.ljust(str(last), 5),
+                ops.rjust(str(accesses), 12)))
+        moves = self.dense_moves()
+        if moves:
+            first, last, new_first = moves[-1]
+            lines.append("")
+            lines.append("Recommended dense range: 0-%d" % (
+                new_first + last - first,))
+            for first, last, new_first in moves:
+                if first != new_first:
+                    lines.append("  Move %d-%d to %d-%d" % (
+                        first, last, new_first, new_first + last - first))
+        lines.extend(["", "Heat map (%d tiles per row):" % (ROW_SIZE,)])
+        lines.extend(self._heat_map())
+        lines.append("")
+        return "\n".join(lines)
+
+    def _heat_map(self):
+        most = 0
+        for addr in range(self.max_addr + 1):
+            most = max(most, self.total(addr))
+        scale = max(_bits(most) - 1, 1)
+        rows = []
+        skipped = False
+        for start in range(0, self.max_addr + 1, ROW_SIZE):
+            chars = []
+            for addr in range(start, min(start + ROW_SIZE, self.size)):
+                total = self.total(addr)
+                if total == 0:
+                    chars.append(HEAT[0])
+                else:
+                    level = 1 + (_bits(total) - 1) * (len(HEAT) - 2) // scale
+                    chars.append(HEAT[level])
+            row = "".join(chars)
+            if not row.strip():
+                skipped = True
+                continue
+            if skipped and rows:
+                rows.append("  ...")
+            skipped = False
+            rows.append("  %s |%s|" % (ops.rjust(str(start), 5), row))
+        return rows
+
+    def to_csv(self):
+        """
+        Return the access counts of every tile accessed as CSV.
+        """
+        lines = ["addr,direct_reads,indirect_reads,direct_writes,"
+                 "indirect_writes"]
+        for addr in self.touched():
+            lines.append("%d,%d,%d,%d,%d" % (
+                addr, self.direct_reads[addr], self.indirect_reads[addr],
+                self.direct_writes[addr], self.indirect_writes[addr]))
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _sum(counts):
+    total = 0
+    for count in counts:
+        total += count
+    return total
+
+
+def _bits(n):
+    """
+    Return the number of bits needed to hold a positive integer.
+    """
+    bits = 0
+    while n > 0:
+        bits += 1
+        n >>= 1
+    return bits
+
+
+def write_memory_report(profiler, filename):
+    """
+    Write a memory profile. A filename ending in `.csv` gets CSV, `-`
+    writes a text report to stderr, and anything else gets a text report.
+    """
+    if filename.endswith('.csv'):
+        data = profiler.to_csv()
+    else:
+        data = profiler.report()
+    write_text(filename, data)
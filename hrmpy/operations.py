@@ -23,6 +23,79 @@ JUMP_OPERATIONS = [
     'JUMPN',
 ]
 
+# The number of memory tiles. Addresses outside them are an error.
+MEMORY_SIZE = 1 << 16
+
+# Integer opcodes for the compiled form of a program.
+OP_INBOX = 0
+OP_OUTBOX = 1
+OP_COPYTO = 2
+OP_COPYFROM = 3
+OP_ADD = 4
+OP_SUB = 5
+OP_BUMPUP = 6
+OP_BUMPDN = 7
+OP_JUMP = 8
+OP_JUMPZ = 9
+OP_JUMPN = 10
+# Superinstructions, built by the optimizer from pairs of operations.
+OP_COPYFROM_OUTBOX = 11
+OP_INBOX_COPYTO = 12
+OP_SUB_JUMPZ = 13
+OP_SUB_JUMPN = 14
+OP_BUMPDN_JUMPZ = 15
+OP_BUMPDN_JUMPN = 16
+# Counting loops, collapsed into one instruction by the optimizer.
+OP_COUNT_LOOP = 17
+
+OPCODES = {
+    'INBOX': OP_INBOX,
+    'OUTBOX': OP_OUTBOX,
+    'COPYTO': OP_COPYTO,
+    'COPYFROM': OP_COPYFROM,
+    'ADD': OP_ADD,
+    'SUB': OP_SUB,
+    'BUMPUP': OP_BUMPUP,
+    'BUMPDN': OP_BUMPDN,
+    'JUMP': OP_JUMP,
+    'JUMPZ': OP_JUMPZ,
+    'JUMPN': OP_JUMPN,
+    'COPYFROM_OUTBOX': OP_COPYFROM_OUTBOX,
+    'INBOX_COPYTO': OP_INBOX_COPYTO,
+    'SUB_JUMPZ': OP_SUB_JUMPZ,
+    'SUB_JUMPN': OP_SUB_JUMPN,
+    'BUMPDN_JUMPZ': OP_BUMPDN_JUMPZ,
+    'BUMPDN_JUMPN': OP_BUMPDN_JUMPN,
+    'COUNT_LOOP': OP_COUNT_LOOP,
+}
+
+OPCODE_NAMES = [None] * len(OPCODES)
+for _name, _opcode in OPCODES.items():
+    OPCODE_NAMES[_opcode] = _name
+del _name, _opcode
+
+SUPER_OPERATIONS = {
+    ('COPYFROM', 'OUTBOX'): 'COPYFROM_OUTBOX',
+    ('INBOX', 'COPYTO'): 'INBOX_COPYTO',
+    ('SUB', 'JUMPZ'): 'SUB_JUMPZ',
+    ('SUB', 'JUMPN'): 'SUB_JUMPN',
+    ('BUMPDN', 'JUMPZ'): 'BUMPDN_JUMPZ',
+    ('BUMPDN', 'JUMPN'): 'BUMPDN_JUMPN',
+}
+
+# The names of the operations each superinstruction was built from.
+SUPER_OPERATION_PARTS = {}
+for _parts, _name in SUPER_OPERATIONS.items():
+    SUPER_OPERATION_PARTS[_name] = list(_parts)
+del _parts, _name
+
+
+# Kind tags for unboxed values. An unboxed value is a kind tag and a machine
+# integer, with characters stored as their code points.
+EMPTY = 0
+INTEGER = 1
+CHARACTER = 2
+
 
 def check_legal(is_legal, msg):
     if not is_legal:
@@ -30,17 +103,49 @@ def check_legal(is_legal, msg):
 
 
 class IllegalOperation(Exception):
-    pass
+    # The number of steps completed before this was raised, if known.
+    steps = -1
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def ljust(text, width):
+    """
+    Pad a string with spaces on the right to at least `width` characters.
+    RPython's string formatting doesn't support field widths.
+    """
+    if len(text) < width:
+        text += " " * (width - len(text))
+    return text
+
+
+def rjust(text, width):
+    """
+    Pad a string with spaces on the left to at least `width` characters.
+    """
+    if len(text) < width:
+        text = " " * (width - len(text)) + text
+    return text
 
 
 class Operation(object):
     """
     An operation the program can execute.
     """
+    # The number of steps the operation counts as.
+    steps = 1
+
     def __init__(self, name):
         self.name = name
 
     def __str__(self):
+        return self.tostr()
+
+    def tostr(self):
         return self.name
 
 
@@ -61,8 +166,8 @@ class MemoryOperation(Operation):
         Operation.__init__(self, name)
         self.addr = addr
 
-    def __str__(self):
-        return "% -8s %s" % (self.name, self.addr)
+    def tostr(self):
+        return "%s %d" % (ljust(self.name, 8), self.addr)
 
 
 class IndirectMemoryOperation(MemoryOperation):
@@ -71,20 +176,152 @@ class IndirectMemoryOperation(MemoryOperation):
     """
     indirect = True
 
-    def __str__(self):
-        return "% -8s [%s]" % (self.name, self.addr)
+    def tostr(self):
+        return "%s [%d]" % (ljust(self.name, 8), self.addr)
 
 
 class JumpOperation(Operation):
     """
     An operation that modifies the program counter.
+
+    If the optimizer has threaded this jump through a chain of unconditional
+    jumps, `hops` is the number of extra steps that taking it counts as.
     """
-    def __init__(self, name, label):
+    def __init__(self, name, label, hops=0):
         Operation.__init__(self, name)
         self.label = label
+        self.hops = hops
 
-    def __str__(self):
-        return "% -8s %s" % (self.name, self.label)
+    def tostr(self):
+        return "%s %s" % (ljust(self.name, 8), self.label)
+
+
+class SuperOperation(Operation):
+    """
+    Two adjacent operations fused into one. Exactly one of them is a memory
+    operation, and the other may be a jump.
+    """
+    steps = 2
+
+    def __init__(self, name, first, second):
+        Operation.__init__(self, name)
+        self.first = first
+        self.second = second
+        mem_op = first
+        if not isinstance(mem_op, MemoryOperation):
+            mem_op = second
+        assert isinstance(mem_op, MemoryOperation)
+        self.addr = mem_op.addr
+        self.indirect = mem_op.indirect
+        self.label = None
+        self.hops = 0
+        if isinstance(second, JumpOperation):
+            self.label = second.label
+            self.hops = second.hops
+
+    def tostr(self):
+        return "%s; %s" % (self.first.tostr(), self.second.tostr())
+
+
+class CountingLoop(Operation):
+    """
+    A loop that only bumps one tile until a condition on it holds, run in
+    one go.
+
+    With a `back` jump, the loop is `BUMP t; JUMPZ/JUMPN exit; JUMP back` and
+    leaves through the conditional jump. Without one, it is `BUMP t;
+    JUMPZ/JUMPN back` and leaves by falling through.
+    """
+    _immutable_fields_ = ['delta', 'zero', 'size', 'continue_steps',
+                          'exit_steps']
+
+    def __init__(self, bump, jump, back=None):
+        Operation.__init__(self, 'COUNT_LOOP')
+        assert isinstance(bump, MemoryOperation) and not bump.indirect
+        assert isinstance(jump, JumpOperation)
+        self.bump = bump
+        self.jump = jump
+        self.back = back
+        self.addr = bump.addr
+        self.indirect = False
+        self.delta = 1
+        if bump.name == 'BUMPDN':
+            self.delta = -1
+        self.zero = jump.name == 'JUMPZ'
+        if back is None:
+            self.label = None
+            self.size = 2
+            self.continue_steps = 2 + jump.hops
+            self.exit_steps = 2
+        else:
+            assert isinstance(back, JumpOperation)
+            self.label = jump.label
+            self.size = 3
+            self.continue_steps = 3 + back.hops
+            self.exit_steps = 2 + jump.hops
+
+    def _condition(self, integer):
+        if self.zero:
+            return integer == 0
+        return integer < 0
+
+    def iterations(self, integer):
+        """
+        Return the number of times the loop bumps a tile that starts out
+        holding `integer`, or -1 if it never stops.
+        """
+        delta = self.delta
+        first = integer + delta
+        if self.back is None:
+            # Loop while the condition holds.
+            if not self._condition(first):
+                return 1
+            if self.zero:
+                # Bumping never gives zero twice in a row.
+                return 2
+            if delta < 0:
+                return -1
+            return -integer
+        # Loop until the condition holds.
+        if self._condition(first):
+            return 1
+        if self.zero:
+            if integer * delta < 0:
+                return -integer * delta
+            return -1
+        if delta < 0:
+            return integer + 1
+        return -1
+
+    def total_steps(self, iterations, exits):
+        """
+        Return the number of steps taken by running the loop body
+        `iterations` times and leaving the loop `exits` times.
+        """
+        return ((iterations - exits) * self.continue_steps +
+                exits * self.exit_steps)
+
+    def add_opcode_counts(self, counts, iterations, exits):
+        """
+        Add the instructions this loop stands in for to a dict of opcode
+        counts.
+        """
+        counts[self.bump.name] = counts.get(self.bump.name, 0) + iterations
+        counts[self.jump.name] = counts.get(self.jump.name, 0) + iterations
+        if self.back is not None:
+            jumps = ((iterations - exits) * (1 + self.back.hops) +
+                     exits * self.jump.hops)
+        elif self.jump.hops > 0:
+            jumps = (iterations - exits) * self.jump.hops
+        else:
+            return
+        counts['JUMP'] = counts.get('JUMP', 0) + jumps
+
+    def tostr(self):
+        if self.back is None:
+            return "%s; %s" % (self.bump.tostr(), self.jump.tostr())
+        return "%s; %s; %s" % (
+            self.bump.tostr(), self.jump.tostr(), self.back.tostr())
 
 
 class PseudoOperation(Operation):
@@ -117,14 +354,53 @@ class Memset(PseudoOperation):
         self.addr = addr
         self.value = value
 
-    def __str__(self):
-        return "%s %s %s" % (self.name, self.addr, self.value.tostr())
+    def tostr(self):
+        return "%s %d %s" % (self.name, self.addr, self.value.tostr())
+
+
+def add(kind, integer, other_kind, other_integer):
+    """
+    Add two unboxed values, returning the integer part of the result. The
+    result is always an integer.
+    """
+    check_legal(
+        kind == INTEGER and other_kind == INTEGER, "Can't add these.")
+    return integer + other_integer
+
+
+def sub(kind, integer, other_kind, other_integer):
+    """
+    Subtract two unboxed values, returning the integer part of the result.
+    The result is always an integer.
+    """
+    check_legal(kind != EMPTY and kind == other_kind, "Can't sub these.")
+    return integer - other_integer
+
+
+def tostr(kind, integer):
+    """
+    Return the string representation of an unboxed value.
+    """
+    if kind == CHARACTER:
+        return chr(integer)
+    return str(integer)
+
+
+def box(kind, integer):
+    """
+    Build a Value object from an unboxed value.
+    """
+    if kind == CHARACTER:
+        return Character(chr(integer))
+    assert kind == INTEGER
+    return Integer(integer)
 
 
 class Value(object):
     """
     A value.
     """
+    kind = EMPTY
 
     def __eq__(self, other):
         return NotImplemented
@@ -153,11 +429,19 @@ class Value(object):
     def negative(self):
         return False
 
+    def unboxed(self):
+        """
+        Return the integer part of this value's unboxed representation.
+        """
+        assert False, "Not implemented"
+
 
 class Integer(Value):
     """
     An integer.
     """
+    kind = INTEGER
+
     def __init__(self, integer):
         self.integer = integer
 
@@ -183,11 +467,16 @@ class Integer(Value):
     def negative(self):
         return self.integer < 0
 
+    def unboxed(self):
+        return self.integer
+
 
 class Character(Value):
     """
     A character.
     """
+    kind = CHARACTER
+
     def __init__(self, character):
         # RPython requires proof that this is a character and not a string.
         assert len(character) == 1
@@ -204,3 +493,6 @@ class Character(Value):
     def sub(self, other):
         check_legal(isinstance(other, Character), "Can't sub these.")
         return Integer(ord(self.character) - ord(other.character))
+
+    def unboxed(self):
+        return ord(self.character)
@@ -0,0 +1,175 @@
+"""
+Peephole optimizations over parsed operations.
+
+These passes rewrite the operation list between `parse_program()` and
+`Program`. They never change which output is produced or which
+IllegalOperation is raised, but they do change the instruction indexes.
+"""
+
+import hrmpy.operations as ops
+from hrmpy.analysis import ControlFlowGraph, split_operations
+
+
+def optimize(operations):
+    operations = eliminate_dead_code(thread_jumps(operations))
+    return fuse_operations(collapse_counting_loops(operations))
+
+
+def _label_targets(operations):
+    """
+    Map each jump label to the first real operation after it, or None if the
+    label is at the end of the program.
+    """
+    targets = {}
+    pending = []
+    for op in operations:
+        if isinstance(op, ops.JumpLabel):
+            pending.append(op.label)
+        elif not isinstance(op, ops.PseudoOperation):
+            for label in pending:
+                targets[label] = op
+            pending = []
+    for label in pending:
+        targets[label] = None
+    return targets
+
+
+def thread_jumps(operations):
+    """
+    Point jumps that land on an unconditional JUMP at that JUMP's destination
+    instead, following chains as far as they go. A JUMP to an undefined label
+    is never threaded through, so the error it raises comes after the same
+    number of steps.
+    """
+    targets = _label_targets(operations)
+    threaded = []
+    for op in operations:
+        if isinstance(op, ops.JumpOperation):
+            label = op.label
+            hops = op.hops
+            seen = {label: None}
+            while True:
+                target = targets.get(label, None)
+                if not (isinstance(target, ops.JumpOperation) and
+                        target.name == 'JUMP'):
+                    break
+                if target.label in seen:
+                    # An infinite loop of JUMPs. Leave it alone.
+                    break
+                if target.label not in targets:
+                    break
+                label = target.label
+                hops += 1 + target.hops
+                seen[label] = None
+            if label != op.label:
+                op = ops.JumpOperation(op.name, label, hops)
+        threaded.append(op)
+    return threaded
+
+
+def eliminate_dead_code(operations):
+    """
+    Drop operations that can never run. Jump labels and other pseudo
+    operations are kept, so labels on dropped code move to the next
+    operation that survives.
+    """
+    real_ops, jump_labels = split_operations(operations)
+    cfg = ControlFlowGraph(real_ops, jump_labels)
+    live = []
+    pc = 0
+    for op in operations:
+        if not isinstance(op, ops.PseudoOperation):
+            pc += 1
+            if not cfg.reachable[pc - 1]:
+                continue
+        live.append(op)
+    return live
+
+
+def collapse_counting_loops(operations):
+    """
+    Replace loops that do nothing but bump one tile until it hits zero or
+    goes negative with a CountingLoop, which runs them in one go.
+
+    The loop must start at a jump label and have no other labels inside it,
+    so nothing can jump into the middle of it.
+    """
+    targets = _label_targets(operations)
+    collapsed = []
+    i = 0
+    while i < len(operations):
+        op = operations[i]
+        loop = None
+        if i > 0 and isinstance(operations[i - 1], ops.JumpLabel):
+            loop = _counting_loop(operations, i, targets)
+        if loop is None:
+            collapsed.append(op)
+            i += 1
+        else:
+            collapsed.append(loop)
+            i += loop.size
+    return collapsed
+
+
+def _counting_loop(operations, i, targets):
+    """
+    Return a CountingLoop for the loop starting at `operations[i]`, or None
+    if there isn't one there.
+    """
+    bump = operations[i]
+    if not (isinstance(bump, ops.MemoryOperation) and not bump.indirect and
+            bump.name in ['BUMPUP', 'BUMPDN']):
+        return None
+    if i + 1 >= len(operations):
+        return None
+    jump = operations[i + 1]
+    if not (isinstance(jump, ops.JumpOperation) and
+            jump.name in ['JUMPZ', 'JUMPN']):
+        return None
+    if targets.get(jump.label, None) is bump:
+        return ops.CountingLoop(bump, jump)
+    if i + 2 >= len(operations):
+        return None
+    back = operations[i + 2]
+    if (isinstance(back, ops.JumpOperation) and back.name == 'JUMP' and
+            targets.get(back.label, None) is bump):
+        return ops.CountingLoop(bump, jump, back)
+    return None
+
+
+def fuse_operations(operations):
+    """
+    Replace pairs of adjacent operations with superinstructions where
+    possible. Operations with a jump label between them are never fused.
+
+    The second operation of a pair must not be able to fail once the first
+    has succeeded, so that step counts stay exact when errors are raised.
+    """
+    fused = []
+    prev = -1
+    for op in operations:
+        if isinstance(op, ops.JumpLabel):
+            prev = -1
+        elif not isinstance(op, ops.PseudoOperation):
+            if prev >= 0:
+                name = _super_operation(fused[prev], op)
+                if name is not None:
+                    fused[prev] = ops.SuperOperation(name, fused[prev], op)
+                    prev = -1
+                    continue
+            prev = len(fused)
+        fused.append(op)
+    return fused
+
+
+def _super_operation(first, second):
+    """
+    Return the name of the superinstruction for a pair of operations, or
+    None if they can't be fused.
+    """
+    if isinstance(second, ops.MemoryOperation) and (
+            second.indirect or not 0 <= second.addr < ops.MEMORY_SIZE):
+        # Indirect addresses and addresses outside memory can fail after
+        # the first operation succeeds.
+        return None
+    return ops.SUPER_OPERATIONS.get((first.name, second.name), None)
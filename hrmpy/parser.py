@@ -1,10 +1,37 @@
+import os
+
 import hrmpy.operations as ops
+from hrmpy.streams import InputQueue
+
+
+class _Lines(object):
+    """
+    A cursor over the lines of a program, so we don't have to pop lines off
+    the front of a list (which makes parsing quadratic).
+    """
+    def __init__(self, lines):
+        self._lines = lines
+        self._pos = 0
+
+    def has_more(self):
+        return self._pos < len(self._lines)
+
+    def line_number(self):
+        """
+        Return the number (counting from 1) of the next line.
+        """
+        return self._pos + 1
+
+    def next(self):
+        line = self._lines[self._pos]
+        self._pos += 1
+        return line.strip()
 
 
 def _parse_instructions(instructions):
     operations = []
     _parse_header(instructions)
-    while instructions:
+    while instructions.has_more():
         op = _parse_instruction(instructions)
         if op is not None:
             operations.append(op)
@@ -12,15 +39,15 @@ def _parse_instructions(instructions):
 
 
 def _parse_header(instructions):
-    while instructions:
-        instruction = instructions.pop(0).strip()
+    while instructions.has_more():
+        instruction = instructions.next()
         if instruction == '-- HUMAN RESOURCE MACHINE PROGRAM --':
             return
     raise RuntimeError("No program found.")
 
 
 def _parse_instruction(instructions):
-    instruction = instructions.pop(0).strip()
+    instruction = instructions.next()
     if not instruction:
         return
     # Non-operation things.
@@ -61,29 +88,187 @@ def _parse_define(instruction, instructions):
     # Ignore for now.
     while instruction:
         define_bits.append(instruction)
-        instruction = instructions.pop(0).strip()
+        instruction = instructions.next()
     return ops.Definition(define_bits)
 
 
 def parse_program(text):
-    return _parse_instructions(text.splitlines())
+    return _parse_instructions(_Lines(text.splitlines()))
+
+
+def instruction_lines(text):
+    """
+    Return the line number (counting from 1) of each instruction in a
+    program, in the order they run in an unoptimized `Program`.
+    """
+    lines = _Lines(text.splitlines())
+    _parse_header(lines)
+    numbers = []
+    while lines.has_more():
+        number = lines.line_number()
+        op = _parse_instruction(lines)
+        if op is not None and not isinstance(op, ops.PseudoOperation):
+            numbers.append(number)
+    return numbers
+
+
+def parse_floor(text):
+    """
+    Parse a floor file into a list of Memsets. Each line holds an address
+    and a value, and anything after a `#` is ignored.
+    """
+    memsets = []
+    for line in text.splitlines():
+        comment = line.find('#')
+        if comment >= 0:
+            line = line[:comment]
+        line = line.strip()
+        if not line:
+            continue
+        addr, value = _splitop(line)
+        memsets.append(ops.Memset(int(addr), _parse_input_datum(value)))
+    return memsets
 
 
 def parse_input_data(text):
     input_data = []
-    datum = ""
-    for char in text:
-        if char in " \t\r\n":
-            if datum:
-                input_data.append(_parse_input_datum(datum))
-                datum = ""
-        else:
-            datum += char
-    if datum:
-        input_data.append(_parse_input_datum(datum))
+    tokenizer = InputTokenizer(text)
+    while True:
+        value = tokenizer.pop()
+        if value is None:
+            break
+        input_data.append(value)
     return input_data
 
 
+WHITESPACE = " \t\r\n"
+CHUNK_SIZE = 65536
+
+
+class InputTokenizer(InputQueue):
+    """
+    An input queue that parses values from text as they are needed.
+
+    Text is consumed one chunk at a time, so subclasses can stream it from
+    somewhere else by overriding `_read_chunk()`. Values may span chunks.
+    """
+    def __init__(self, text=""):
+        self._buf = text
+        self._pos = 0
+        # The offset of the current chunk in the whole input.
+        self._base = 0
+
+    def _read_chunk(self):
+        """
+        Return the next chunk of input text, or an empty string if there is
+        no more input.
+        """
+        return ""
+
+    def _next_chunk(self):
+        self._base += len(self._buf)
+        self._buf = self._read_chunk()
+        self._pos = 0
+
+    def position(self):
+        """
+        Return the offset in the input text just after the last value.
+        """
+        return self._base + self._pos
+
+    def seek(self, position):
+        offset = position - self._base
+        assert 0 <= offset <= len(self._buf), "Can't seek outside the buffer."
+        self._pos = offset
+
+    def _skip_whitespace(self):
+        """
+        Move to the start of the next value, reading more chunks as necessary.
+        Returns False if we run out of input first.
+        """
+        while True:
+            buf = self._buf
+            pos = self._pos
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return True
+            self._next_chunk()
+            if not self._buf:
+                return False
+
+    def _scan_datum(self):
+        """
+        Return the end of the value starting at the current position in the
+        current chunk.
+        """
+        buf = self._buf
+        pos = self._pos
+        while pos < len(buf) and buf[pos] not in WHITESPACE:
+            pos += 1
+        return pos
+
+    def advance(self):
+        if not self._skip_whitespace():
+            return False
+        start = self._pos
+        end = self._scan_datum()
+        assert start >= 0
+        datum = self._buf[start:end]
+        self._pos = end
+        if end == len(self._buf):
+            # This value may continue in the next chunk.
+            pieces = [datum]
+            while True:
+                self._next_chunk()
+                if not self._buf:
+                    break
+                end = self._scan_datum()
+                pieces.append(self._buf[:end])
+                self._pos = end
+                if end < len(self._buf):
+                    break
+            datum = "".join(pieces)
+        if len(datum) == 1 and datum in characters:
+            self.kind = ops.CHARACTER
+            self.integer = ord(datum[0])
+        else:
+            self.kind = ops.INTEGER
+            self.integer = int(datum)
+        return True
+
+
+class FileInputTokenizer(InputTokenizer):
+    """
+    An input tokenizer that reads chunks from a file descriptor as they are
+    needed, so the whole file is never held in memory.
+    """
+    def __init__(self, fd, chunk_size=CHUNK_SIZE):
+        InputTokenizer.__init__(self)
+        self._fd = fd
+        self._chunk_size = chunk_size
+
+    def _read_chunk(self):
+        if self._fd < 0:
+            return ""
+        chunk = os.read(self._fd, self._chunk_size)
+        if not chunk:
+            # Don't read past EOF, it may block on a terminal.
+            self._fd = -1
+        return chunk
+
+    def seek(self, position):
+        """
+        Move to an offset in the file. The file must be seekable.
+        """
+        assert self._fd >= 0
+        os.lseek(self._fd, position, 0)
+        self._buf = ""
+        self._pos = 0
+        self._base = position
+
+
 characters = ''.join(chr(c) for c in range(ord('a'), ord('z') + 1))
 
 
@@ -0,0 +1,221 @@
+"""
+Execution profiling for HRM programs.
+
+The profiler only counts how often each instruction runs and how often each
+jump is taken. Everything else in the report is derived from those counts and
+the compiled program after the run.
+"""
+
+import os
+
+import hrmpy.operations as ops
+
+
+# Bits in a coverage bitmap, one bitmap per instruction.
+COVERED = 1
+JUMP_TAKEN = 2
+JUMP_NOT_TAKEN = 4
+
+# Opcodes that may or may not jump.
+CONDITIONAL_OPCODES = [
+    ops.OP_JUMPZ, ops.OP_JUMPN, ops.OP_SUB_JUMPZ, ops.OP_SUB_JUMPN,
+    ops.OP_BUMPDN_JUMPZ, ops.OP_BUMPDN_JUMPN]
+
+
+class Profiler(object):
+    """
+    Collects per-instruction execution counts for a compiled program.
+    """
+    def __init__(self, program):
+        self.program = program
+        self.hits = [0] * program.size
+        self.jumps = [0] * program.size
+        # For collapsed counting loops, how often the loop body ran and how
+        # often the loop was left.
+        self.loop_iterations = [0] * program.size
+        self.loop_exits = [0] * program.size
+
+    def record(self, pc, jumped):
+        self.hits[pc] += 1
+        if jumped:
+            self.jumps[pc] += 1
+
+    def record_loop(self, pc, iterations, exits):
+        self.loop_iterations[pc] += iterations
+        self.loop_exits[pc] += exits
+
+    def coverage(self, stop_pc=-1):
+        """
+        Return a list with a coverage bitmap for each instruction. An
+        instruction that ran is COVERED, and a conditional jump also has
+        JUMP_TAKEN and JUMP_NOT_TAKEN set for the ways it went. `stop_pc` is
+        an instruction the run stopped at, after it failed or ran out of
+        input, which counts as having run.
+        """
+        bitmaps = [0] * self.program.size
+        for pc in range(self.program.size):
+            hits = self.hits[pc]
+            if hits == 0 and pc != stop_pc:
+                continue
+            bits = COVERED
+            if self.program.opcodes[pc] in CONDITIONAL_OPCODES:
+                if self.jumps[pc] > 0:
+                    bits |= JUMP_TAKEN
+                if hits > self.jumps[pc]:
+                    bits |= JUMP_NOT_TAKEN
+            bitmaps[pc] = bits
+        return bitmaps
+
+    def total_steps(self):
+        steps = 0
+        for pc in range(self.program.size):
+            loop = self.program.loops[pc]
+            if loop is not None:
+                steps += loop.total_steps(
+                    self.loop_iterations[pc], self.loop_exits[pc])
+                continue
+            steps += self.hits[pc] * self.program.steps[pc]
+            steps += self.jumps[pc] * self.program.hops[pc]
+        return steps
+
+    def size(self):
+        """
+        Return the number of instructions in the program as written, before
+        any were fused or dropped by the optimizer.
+        """
+        return self.program.source_size
+
+    def opcode_counts(self):
+        """
+        Return a dict mapping opcode names to execution counts.
+        Superinstructions and threaded jumps are counted as the instructions
+        they replaced.
+        """
+        counts = {}
+        for pc in range(self.program.size):
+            loop = self.program.loops[pc]
+            if loop is not None:
+                loop.add_opcode_counts(
+                    counts, self.loop_iterations[pc], self.loop_exits[pc])
+                continue
+            name = ops.OPCODE_NAMES[self.program.opcodes[pc]]
+            parts = ops.SUPER_OPERATION_PARTS.get(name, [name])
+            for part in parts:
+                counts[part] = counts.get(part, 0) + self.hits[pc]
+            if self.program.hops[pc] > 0:
+                hops = self.jumps[pc] * self.program.hops[pc]
+                counts['JUMP'] = counts.get('JUMP', 0) + hops
+        return counts
+
+    def label_iterations(self):
+        """
+        Return a dict mapping each jump label to the number of times a jump
+        to it was taken.
+        """
+        labels = self.program.jump_labels()
+        iterations = {}
+        for label in labels:
+            iterations[label] = 0
+            for pc in range(self.program.size):
+                if self.program.targets[pc] == labels[label]:
+                    iterations[label] += self.jumps[pc]
+                if (self.program.loops[pc] is not None and
+                        pc == labels[label]):
+                    # Going around a counting loop jumps back to its start.
+                    iterations[label] += (
+                        self.loop_iterations[pc] - self.loop_exits[pc])
+        return iterations
+
+    def report(self):
+        """
+        Return a human-readable profile report.
+        """
+        lines = [
+            "Steps: %d" % (self.total_steps(),),
+            "Size: %d" % (self.size(),),
+            "",
+            "Opcode counts:",
+        ]
+        counts = self.opcode_counts()
+        for name in _sorted_keys(counts):
+            lines.append(_count_line(name, counts[name]))
+        lines.extend(["", "Label iterations:"])
+        iterations = self.label_iterations()
+        for label in _sorted_keys(iterations):
+            lines.append(_count_line(label, iterations[label]))
+        lines.extend(["", "Instruction hits:"])
+        for pc in range(self.program.size):
+            lines.append("  %s %s  %s" % (
+                ops.rjust(str(pc), 5), ops.rjust(str(self.hits[pc]), 12),
+                self.program[pc].tostr()))
+        lines.append("")
+        return "\n".join(lines)
+
+    def to_json(self):
+        """
+        Return the profile as a JSON document.
+        """
+        hits = [str(hit) for hit in self.hits]
+        jumps = [str(jump) for jump in self.jumps]
+        return "\n".join([
+            "{",
+            '  "steps": %d,' % (self.total_steps(),),
+            '  "size": %d,' % (self.size(),),
+            '  "opcodes": %s,' % (_json_counts(self.opcode_counts()),),
+            '  "labels": %s,' % (_json_counts(self.label_iterations()),),
+            '  "pc_hits": [%s],' % (", ".join(hits),),
+            '  "pc_jumps": [%s]' % (", ".join(jumps),),
+            "}",
+            "",
+        ])
+
+
+def _count_line(name, count):
+    return "  %s %s" % (ops.ljust(name, 10), ops.rjust(str(count), 12))
+
+
+def _sorted_keys(counts):
+    keys = counts.keys()
+    keys.sort()
+    return keys
+
+
+def _json_string(text):
+    return '"%s"' % (text.replace('\\', '\\\\').replace('"', '\\"'),)
+
+
+def _json_counts(counts):
+    items = []
+    for key in _sorted_keys(counts):
+        items.append("%s: %d" % (_json_string(key), counts[key]))
+    return "{%s}" % (", ".join(items),)
+
+
+def write_report(profiler, filename):
+    """
+    Write a profile report. A filename ending in `.json` gets a JSON report,
+    `-` writes a text report to stderr, and anything else gets a text report.
+    """
+    if filename.endswith('.json'):
+        data = profiler.to_json()
+    else:
+        data = profiler.report()
+    write_text(filename, data)
+
+
+def write_text(filename, data):
+    """
+    Write a report to a file, or to stderr if the filename is `-`.
+    """
+    if filename == '-':
+        fd = 2
+    else:
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        while data:
+            written = os.write(fd, data)
+            assert written >= 0
+            data = data[written:]
+    finally:
+        if fd != 2:
+            os.close(fd)
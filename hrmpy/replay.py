@@ -0,0 +1,169 @@
+"""
+Step forwards and backwards through a trace written with --trace.
+
+  $ python -m hrmpy.replay [--at STEP] TRACE
+
+With --at, the state before the instruction running at that step is
+printed. Otherwise, commands are read from stdin, starting at the end of
+the run:
+
+  n [N]     go forwards N instructions (default 1)
+  b [N]     go backwards N instructions (default 1)
+  g STEP    go to the instruction running at a step
+  start     go to the oldest instruction in the trace
+  end       go to the end of the run
+  p         print the state again
+  q         quit
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import sys
+
+import hrmpy.operations as ops
+from hrmpy.trace import read_trace
+
+
+def format_value(kind, integer):
+    if kind == ops.EMPTY:
+        return "empty"
+    return ops.tostr(kind, integer)
+
+
+class Replay(object):
+    """
+    The state of a traced run at some point in its trace. `position` is the
+    index of the next entry to run, or the number of entries at the end.
+    """
+    def __init__(self, trace):
+        self.trace = trace
+        self.position = len(trace.entries)
+        self.tiles = dict(trace.tiles)
+
+    def _state(self, position):
+        if position == len(self.trace.entries):
+            return self.trace.final
+        return self.trace.entries[position]
+
+    def state(self):
+        """
+        Return the entry for the current position, with pc, steps and the
+        accumulator.
+        """
+        return self._state(self.position)
+
+    def forward(self, count=1):
+        for _ in range(count):
+            if self.position >= len(self.trace.entries):
+                break
+            entry = self.trace.entries[self.position]
+            if entry.write_addr >= 0:
+                after = self._state(self.position + 1)
+                self.tiles[entry.write_addr] = (after.acc_kind, after.acc)
+            self.position += 1
+
+    def backward(self, count=1):
+        for _ in range(count):
+            if self.position <= 0:
+                break
+            self.position -= 1
+            entry = self.trace.entries[self.position]
+            if entry.write_addr >= 0:
+                if entry.old_kind == ops.EMPTY:
+                    self.tiles.pop(entry.write_addr, None)
+                else:
+                    self.tiles[entry.write_addr] = (
+                        entry.old_kind, entry.old_integer)
+
+    def goto(self, steps):
+        """
+        Go to the last position at or before a step count.
+        """
+        while self.position > 0 and self.state().steps > steps:
+            self.backward()
+        while (self.position < len(self.trace.entries) and
+               self._state(self.position + 1).steps <= steps):
+            self.forward()
+
+    def describe(self):
+        """
+        Return the current state as lines of text.
+        """
+        state = self.state()
+        if 0 <= state.pc < len(self.trace.instructions):
+            instruction = " ".join(self.trace.instructions[state.pc].split())
+        else:
+            instruction = "(end of program)"
+        lines = []
+        if self.position == len(self.trace.entries):
+            end = "end of run"
+            if self.trace.error:
+                end = "stopped with: %s" % (self.trace.error,)
+            lines.append("%s, after %d steps" % (end, state.steps))
+        lines.append("step %d, pc %d: %s" % (
+            state.steps, state.pc, instruction))
+        lines.append("  acc: %s" % (
+            format_value(state.acc_kind, state.acc),))
+        for addr in sorted(self.tiles):
+            lines.append("  [%d] %s" % (
+                addr, format_value(*self.tiles[addr])))
+        return lines
+
+
+def _count(args):
+    if args:
+        return int(args[0])
+    return 1
+
+
+def interact(replay, lines, write):
+    for line in lines:
+        words = line.split()
+        if not words:
+            continue
+        command, args = words[0], words[1:]
+        if command == 'q':
+            break
+        elif command == 'n':
+            replay.forward(_count(args))
+        elif command == 'b':
+            replay.backward(_count(args))
+        elif command == 'g' and args:
+            replay.goto(int(args[0]))
+        elif command == 'start':
+            replay.backward(replay.position)
+        elif command == 'end':
+            replay.forward(len(replay.trace.entries))
+        elif command != 'p':
+            write("Unknown command: %s\n" % (line.strip(),))
+            continue
+        write("\n".join(replay.describe()) + "\n")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.replay")
+    parser.add_argument("trace", help="A trace file written with --trace.")
+    parser.add_argument(
+        "--at", type=int, default=None,
+        help="Print the state at this step and exit.")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    replay = Replay(read_trace(args.trace))
+    if replay.trace.dropped:
+        sys.stdout.write("%d older instructions were not kept.\n" % (
+            replay.trace.dropped,))
+    if args.at is not None:
+        replay.goto(args.at)
+        sys.stdout.write("\n".join(replay.describe()) + "\n")
+        return 0
+    sys.stdout.write("\n".join(replay.describe()) + "\n")
+    interact(replay, iter(sys.stdin.readline, ""), sys.stdout.write)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,270 @@
+"""
+Run programs for clients connecting over a local socket.
+
+  $ python -m hrmpy.service [--socket PATH | --port N] [--jobs N] \
+        [--cache-dir DIR] [--max-steps N] [--max-seconds N]
+
+Clients send one JSON request per line:
+
+  {"id": 1, "program": "...", "input": "1 2 3", "optimize": true,
+   "max_steps": 1000000, "max_seconds": 5}
+
+Only "program" is required, and the limits can't be raised above the
+server's. Each request is run on a pool of worker processes, and a JSON
+response is sent back on its own line as soon as it finishes, so responses
+may come back in a different order to their requests:
+
+  {"id": 1, "output": ["1", "2", "3"], "steps": 9, "error": null}
+
+Each worker keeps a machine for each program it has built, keyed by a hash
+of the program's text, and resets it for each run. With --cache-dir, built
+programs are shared through the program cache as well.
+Every run writes to its own output sink, so concurrent runs never share an
+output stream.
+
+This is a CPython tool and is not part of the RPython translation.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+
+from hrmpy.budget import Budget, BudgetExceeded
+from hrmpy.cache import ProgramCache, program_key
+from hrmpy.main import Machine, build_program
+from hrmpy.operations import IllegalOperation
+from hrmpy.parser import parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+DEFAULT_MAX_STEPS = 100000000
+DEFAULT_MAX_SECONDS = 10.0
+
+# The most programs each worker keeps built.
+PROGRAMS_KEPT = 256
+
+# Worker process state, set by `_init_worker()`.
+_cache = None
+_limits = (DEFAULT_MAX_STEPS, DEFAULT_MAX_SECONDS)
+# A machine for each program, reused for every request that runs it.
+_machines = {}
+
+
+def _init_worker(cache_dir, limits):
+    global _cache, _limits
+    if cache_dir is not None:
+        _cache = ProgramCache(cache_dir)
+    _limits = limits
+
+
+def _get_machine(text, optimized):
+    key = program_key(text, optimized)
+    machine = _machines.get(key)
+    if machine is None:
+        if len(_machines) >= PROGRAMS_KEPT:
+            _machines.clear()
+        machine = Machine(build_program(text, optimized, _cache), None, None)
+        _machines[key] = machine
+    return machine
+
+
+def _limit(requested, server):
+    """
+    Return the smaller of two limits, where negative means no limit.
+    """
+    if requested is None or requested < 0:
+        return server
+    if server < 0:
+        return requested
+    return min(requested, server)
+
+
+def _text(value):
+    """
+    JSON strings are decoded as unicode, but programs and input are bytes.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def run_request(request):
+    """
+    Run one request and return its response. This never raises.
+    """
+    response = {'id': request.get('id'), 'output': [], 'steps': None,
+                'error': None}
+    try:
+        machine = _get_machine(
+            _text(request['program']), request.get('optimize', True))
+        input_data = parse_input_data(_text(request.get('input', "")))
+    except Exception as e:
+        response['error'] = "Bad request: %s: %s" % (type(e).__name__, e)
+        return response
+    budget = Budget(_limit(request.get('max_steps'), _limits[0]),
+                    _limit(request.get('max_seconds'), _limits[1]))
+    output = ListOutputSink()
+    machine.reset(ListInputQueue(input_data), output)
+    try:
+        response['steps'] = machine.run(budget=budget)
+    except (IllegalOperation, BudgetExceeded) as e:
+        response['steps'] = e.steps
+        response['error'] = str(e)
+    except Exception as e:
+        response['error'] = "%s: %s" % (type(e).__name__, e)
+    response['output'] = output.output
+    return response
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """
+    Reads requests from a connection and sends each response back as soon
+    as it is ready. The connection is closed once the client has stopped
+    sending and every response has been sent.
+    """
+    def handle(self):
+        self._lock = threading.Condition()
+        self._pending = 0
+        for line in iter(self.rfile.readline, ""):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Requests must be objects.")
+            except ValueError as e:
+                self._send({'id': None, 'output': [], 'steps': None,
+                            'error': "Bad request: %s" % (e,)})
+                continue
+            with self._lock:
+                self._pending += 1
+            self.server.pool.apply_async(
+                run_request, (request,), callback=self._finished)
+        with self._lock:
+            while self._pending > 0:
+                self._lock.wait()
+
+    def _send(self, response):
+        with self._lock:
+            try:
+                self.wfile.write(json.dumps(response, sort_keys=True) + "\n")
+                self.wfile.flush()
+            except socket.error:
+                # The client has gone away, but we still need to count the
+                # rest of its responses.
+                pass
+
+    def _finished(self, response):
+        self._send(response)
+        with self._lock:
+            self._pending -= 1
+            self._lock.notify_all()
+
+
+class _ServiceMixIn(SocketServer.ThreadingMixIn):
+    daemon_threads = True
+
+
+class UnixService(_ServiceMixIn, SocketServer.UnixStreamServer):
+    pass
+
+
+class TCPService(_ServiceMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+
+
+def make_server(address, processes=None, cache_dir=None,
+                max_steps=DEFAULT_MAX_STEPS, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Create a server with its own worker pool. A string address is a Unix
+    socket path and a tuple is a TCP (host, port). Call `close_server()`
+    when done with it.
+    """
+    # The pool is started first so the workers don't inherit the socket.
+    pool = multiprocessing.Pool(
+        processes, _init_worker, (cache_dir, (max_steps, max_seconds)))
+    if isinstance(address, str):
+        server = UnixService(address, _Handler)
+    else:
+        server = TCPService(address, _Handler)
+    server.pool = pool
+    return server
+
+
+def close_server(server):
+    server.server_close()
+    server.pool.terminate()
+    server.pool.join()
+    if isinstance(server, UnixService) and os.path.exists(
+            server.server_address):
+        os.unlink(server.server_address)
+
+
+def submit(address, requests):
+    """
+    Send some requests to a server and return their responses, in the order
+    they came back.
+    """
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    try:
+        for request in requests:
+            sock.sendall(json.dumps(request) + "\n")
+        sock.shutdown(socket.SHUT_WR)
+        return [json.loads(line) for line in sock.makefile('rb')]
+    finally:
+        sock.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m hrmpy.service")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", help="Unix socket path to listen on.")
+    where.add_argument(
+        "--port", type=int, help="Localhost TCP port to listen on.")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None,
+        help="Number of worker processes. (Default: one per CPU.)")
+    parser.add_argument(
+        "--cache-dir", default=None, help="Program cache directory.")
+    parser.add_argument(
+        "--max-steps", type=int, default=DEFAULT_MAX_STEPS,
+        help="Most steps a run may take. (Negative for no limit.)")
+    parser.add_argument(
+        "--max-seconds", type=float, default=DEFAULT_MAX_SECONDS,
+        help="Most seconds a run may take. (Negative for no limit.)")
+    return parser.parse_args(argv)
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def main(argv):
+    args = parse_args(argv)
+    address = args.socket
+    if address is None:
+        address = ('127.0.0.1', args.port)
+    server = make_server(address, args.jobs, args.cache_dir, args.max_steps,
+                         args.max_seconds)
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_server(server)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,148 @@
+"""
+Snapshots of a running program, so that long runs can be resumed.
+
+A snapshot holds everything the interpreter needs to carry on where it left
+off: the instruction index, the accumulator, the step count, every tile that
+holds a value, how far into the input we are and how many values have been
+output. The key of the program it was taken from is stored too, so it can't
+be resumed with a different program.
+"""
+
+from hrmpy.encoding import (
+    DecodeError, Decoder, Encoder, read_file, write_file_atomically)
+
+
+MAGIC = "HRMS"
+FORMAT_VERSION = 1
+
+# Steps between snapshots, unless told otherwise.
+SNAPSHOT_INTERVAL = 10000000
+
+
+class SnapshotError(DecodeError):
+    """
+    Raised when a snapshot can't be decoded.
+    """
+
+
+class Snapshot(object):
+    """
+    The state of a program between two instructions. Tiles are stored as
+    parallel lists of addresses, kind tags and integers.
+    """
+    def __init__(self, program_key, pc, acc_kind, acc, steps, input_position,
+                 output_count, addrs, kinds, integers):
+        self.program_key = program_key
+        self.pc = pc
+        self.acc_kind = acc_kind
+        self.acc = acc
+        self.steps = steps
+        self.input_position = input_position
+        self.output_count = output_count
+        self.addrs = addrs
+        self.kinds = kinds
+        self.integers = integers
+
+
+class _Decoder(Decoder):
+    def error(self, msg):
+        raise SnapshotError(msg)
+
+
+def is_snapshot(data):
+    """
+    Return True if some data looks like a snapshot.
+    """
+    return data.startswith(chr(len(MAGIC)) + MAGIC)
+
+
+def dump_snapshot(snapshot):
+    """
+    Encode a snapshot as a string. Tile addresses are stored as the gap from
+    the previous one, so runs of tiles cost about three bytes each.
+    """
+    encoder = Encoder()
+    encoder.write_string(MAGIC)
+    encoder.write_uint(FORMAT_VERSION)
+    encoder.write_string(snapshot.program_key)
+    encoder.write_uint(snapshot.pc)
+    encoder.write_uint(snapshot.acc_kind)
+    encoder.write_int(snapshot.acc)
+    encoder.write_uint(snapshot.steps)
+    encoder.write_uint(snapshot.input_position)
+    encoder.write_uint(snapshot.output_count)
+    encoder.write_uint(len(snapshot.addrs))
+    prev = 0
+    for i in range(len(snapshot.addrs)):
+        addr = snapshot.addrs[i]
+        assert addr >= prev
+        encoder.write_uint(addr - prev)
+        encoder.write_uint(snapshot.kinds[i])
+        encoder.write_int(snapshot.integers[i])
+        prev = addr
+    return encoder.getvalue()
+
+
+def load_snapshot(data):
+    """
+    Decode a string from `dump_snapshot()`. Raises SnapshotError if the data
+    is bad.
+    """
+    decoder = _Decoder(data)
+    if decoder.read_string() != MAGIC:
+        raise SnapshotError("Not a snapshot.")
+    if decoder.read_uint() != FORMAT_VERSION:
+        raise SnapshotError("Wrong snapshot format version.")
+    program_key = decoder.read_string()
+    pc = decoder.read_uint()
+    acc_kind = decoder.read_uint()
+    acc = decoder.read_int()
+    steps = decoder.read_uint()
+    input_position = decoder.read_uint()
+    output_count = decoder.read_uint()
+    addrs = []
+    kinds = []
+    integers = []
+    addr = 0
+    for _ in range(decoder.read_uint()):
+        addr += decoder.read_uint()
+        addrs.append(addr)
+        kinds.append(decoder.read_uint())
+        integers.append(decoder.read_int())
+    if not decoder.at_end():
+        raise SnapshotError("Trailing data in snapshot.")
+    return Snapshot(program_key, pc, acc_kind, acc, steps, input_position,
+                    output_count, addrs, kinds, integers)
+
+
+def read_snapshot(filename):
+    return load_snapshot(read_file(filename))
+
+
+class Checkpointer(object):
+    """
+    Writes a snapshot to a file every `interval` steps or so. The
+    interpreter only checks on backward jumps, so snapshots are taken at
+    the first one after each interval is up.
+    """
+    def __init__(self, filename, program_key, interval=SNAPSHOT_INTERVAL):
+        assert interval > 0
+        self.filename = filename
+        self.program_key = program_key
+        self.interval = interval
+        self.next_steps = interval
+        self.saved = 0
+
+    def start_from(self, steps):
+        """
+        Take the next snapshot an interval after `steps`.
+        """
+        self.next_steps = steps + self.interval
+
+    def due(self, steps):
+        return steps >= self.next_steps
+
+    def save(self, snapshot):
+        write_file_atomically(self.filename, dump_snapshot(snapshot))
+        self.next_steps = snapshot.steps + self.interval
+        self.saved += 1
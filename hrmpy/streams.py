@@ -0,0 +1,182 @@
+"""
+Input sources and output sinks for the interpreter.
+"""
+
+import os
+
+import hrmpy.operations as ops
+
+
+OUTPUT_BUFFER_SIZE = 65536
+
+
+class InputQueue(object):
+    """
+    A queue of input values that are consumed in order.
+
+    The interpreter reads unboxed values: `advance()` moves to the next value
+    and leaves its kind tag and integer part in `kind` and `integer`.
+    """
+    kind = ops.EMPTY
+    integer = 0
+
+    def advance(self):
+        """
+        Move to the next input value, returning False if there is no more
+        input.
+        """
+        raise NotImplementedError("Subclasses must implement advance().")
+
+    def pop(self):
+        """
+        Remove and return the next input value, or None if there is no more
+        input.
+        """
+        if not self.advance():
+            return None
+        return ops.box(self.kind, self.integer)
+
+    def position(self):
+        """
+        Return how far into the input we are, in whatever units `seek()`
+        understands.
+        """
+        raise NotImplementedError("Subclasses must implement position().")
+
+    def seek(self, position):
+        """
+        Go back to a position returned by `position()`, usually in a
+        previous run over the same input.
+        """
+        raise NotImplementedError("Subclasses must implement seek().")
+
+
+class ListInputQueue(InputQueue):
+    """
+    An input queue over an already-parsed list of values.
+
+    The values are unboxed up front and we just move a cursor along them.
+    """
+    def __init__(self, values):
+        self._kinds = [value.kind for value in values]
+        self._integers = [value.unboxed() for value in values]
+        self._cursor = 0
+
+    def advance(self):
+        if self._cursor >= len(self._kinds):
+            return False
+        self.kind = self._kinds[self._cursor]
+        self.integer = self._integers[self._cursor]
+        self._cursor += 1
+        return True
+
+    def position(self):
+        return self._cursor
+
+    def seek(self, position):
+        assert 0 <= position <= len(self._kinds)
+        self._cursor = position
+
+
+class OutputSink(object):
+    """
+    A destination for output values.
+
+    `count` is the number of values written so far, so a run can be resumed
+    from the right place in its output.
+    """
+    count = 0
+
+    def write(self, text):
+        """
+        Write the string representation of an output value.
+        """
+        raise NotImplementedError("Subclasses must implement write().")
+
+    def flush(self):
+        """
+        Make sure everything written so far has reached its destination.
+        """
+        pass
+
+
+class BufferedOutputSink(OutputSink):
+    """
+    An output sink that collects lines in a buffer and hands them on in
+    blocks.
+
+    If `line_buffered` is set, every line is handed on as soon as it is
+    written.
+    """
+    def __init__(self, buffer_size=OUTPUT_BUFFER_SIZE, line_buffered=False):
+        self._buffer_size = buffer_size
+        self._line_buffered = line_buffered
+        self._lines = []
+        self._buffered = 0
+
+    def write(self, text):
+        self.count += 1
+        self._lines.append(text)
+        self._buffered += len(text) + 1
+        if self._line_buffered or self._buffered >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._lines.append("")
+            data = "\n".join(self._lines)
+            self._lines = []
+            self._buffered = 0
+            self._write_block(data)
+
+    def _write_block(self, data):
+        raise NotImplementedError("Subclasses must implement _write_block().")
+
+
+class FileOutputSink(BufferedOutputSink):
+    """
+    A buffered output sink that writes to a file descriptor.
+    """
+    def __init__(self, fd, buffer_size=OUTPUT_BUFFER_SIZE,
+                 line_buffered=False):
+        BufferedOutputSink.__init__(self, buffer_size, line_buffered)
+        self._fd = fd
+
+    def _write_block(self, data):
+        while data:
+            written = os.write(self._fd, data)
+            assert written >= 0
+            data = data[written:]
+
+
+class PrintOutputSink(BufferedOutputSink):
+    """
+    A buffered output sink that writes with `print`, so it goes wherever
+    Python's stdout currently goes.
+    """
+    def _write_block(self, data):
+        print data,
+
+
+class ListOutputSink(OutputSink):
+    """
+    An output sink that collects output in a list. Mostly useful for tests.
+    """
+    def __init__(self):
+        self.output = []
+
+    def write(self, text):
+        self.count += 1
+        self.output.append(text)
+
+
+class CallbackOutputSink(OutputSink):
+    """
+    An output sink that calls a function for each output value.
+    """
+    def __init__(self, callback):
+        self._callback = callback
+
+    def write(self, text):
+        self.count += 1
+        self._callback(text)
@@ -0,0 +1,95 @@
+from hrmpy.analysis import ControlFlowGraph, analyze, program_cfg
+from hrmpy.main import Program, entry_point
+from hrmpy.parser import parse_program
+
+
+def program(*lines):
+    instructions = ["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines)
+    return Program(parse_program("\n".join(instructions)))
+
+
+def messages(prog):
+    return [str(diagnostic) for diagnostic in analyze(prog)]
+
+
+class TestControlFlowGraph(object):
+
+    def test_successors(self):
+        cfg = program_cfg(program(
+            "a:", "INBOX", "JUMPZ b", "OUTBOX", "JUMP a", "b:", "JUMP x"))
+        assert cfg.successors == [[1], [2, 4], [3], [0], []]
+        assert cfg.undefined == [4]
+        assert cfg.reachable == [True] * 5
+
+    def test_blocks(self):
+        cfg = program_cfg(program(
+            "a:", "INBOX", "COPYTO 0", "JUMPZ b", "OUTBOX", "JUMP a", "b:",
+            "COPYFROM 0", "OUTBOX", "JUMP a"))
+        assert [(b.start, b.end, b.successors) for b in cfg.blocks] == [
+            (0, 3, [3, 5]), (3, 5, [0]), (5, 8, [0])]
+
+    def test_unreachable(self):
+        cfg = program_cfg(program(
+            "a:", "INBOX", "JUMP a", "OUTBOX", "OUTBOX", "b:", "INBOX"))
+        assert cfg.reachable == [True, True, False, False, False]
+        assert cfg.unreachable_ranges() == [(2, 5)]
+
+    def test_empty(self):
+        cfg = ControlFlowGraph([], {})
+        assert cfg.reachable == []
+        assert cfg.blocks == []
+
+
+class TestAnalyze(object):
+
+    def test_clean_program(self):
+        assert messages(program(
+            "a:", "INBOX", "COPYTO 0", "ADD 0", "OUTBOX", "JUMP a")) == []
+
+    def test_undefined_labels(self):
+        """
+        A reachable jump to an undefined label is an error, an unreachable
+        one is just a warning.
+        """
+        assert messages(program("INBOX", "JUMPZ x", "JUMP y", "JUMP z")) == [
+            "1: error: Jump to undefined label x.",
+            "2: error: Jump to undefined label y.",
+            "3: warning: Jump to undefined label z.",
+            "3: warning: Instruction 3 is unreachable.",
+        ]
+
+    def test_uninitialized_reads(self):
+        assert messages(program(
+            ".memset 2 5", "INBOX", "COPYTO 0", "ADD 0", "ADD 1", "ADD 2",
+            "BUMPUP 3", "COPYFROM [4]", "OUTBOX")) == [
+            "3: warning: Reads tile 1, which is never initialised.",
+            "5: warning: Reads tile 3, which is never initialised.",
+            "6: warning: Reads tile 4, which is never initialised.",
+        ]
+
+    def test_indirect_writes(self):
+        """
+        A write through a pointer might initialise any tile.
+        """
+        assert messages(program(
+            "INBOX", "COPYTO 0", "COPYTO [0]", "ADD 1", "OUTBOX")) == []
+
+
+class TestCheck(object):
+
+    def test_check(self, tmpdir, capfd):
+        """
+        With --check, problems are printed instead of running the program,
+        which doesn't need input.
+        """
+        prog = tmpdir.join("prog.hrm")
+        prog.write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "ADD 0", "JUMP b"]))
+        assert entry_point(["hrmpy", "--check", str(prog)]) == 1
+        out, err = capfd.readouterr()
+        assert out.splitlines() == [
+            "%s:1: warning: Reads tile 0, which is never initialised." % (
+                prog,),
+            "%s:2: error: Jump to undefined label b." % (prog,),
+        ]
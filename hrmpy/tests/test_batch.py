@@ -0,0 +1,118 @@
+import json
+from StringIO import StringIO
+
+from hrmpy import batch
+from hrmpy.main import build_program
+
+
+COPIER = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --",
+    "a:", "INBOX", "OUTBOX", "JUMP a",
+])
+
+ADDER = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --",
+    "a:", "INBOX", "COPYTO 0", "INBOX", "ADD 0", "OUTBOX", "JUMP a",
+])
+
+
+def write_files(tmpdir, files):
+    for name, content in files.items():
+        tmpdir.join(name).write(content)
+    return str(tmpdir)
+
+
+class TestBatch(object):
+
+    def test_find_files(self, tmpdir):
+        """
+        Directories are expanded to the files in them with the right
+        extension, and files are returned as is.
+        """
+        path = write_files(tmpdir, {'b.hrm': "", 'a.hrm': "", 'c.txt': ""})
+        assert batch.find_files(path, '.hrm') == [
+            str(tmpdir.join('a.hrm')), str(tmpdir.join('b.hrm'))]
+        assert batch.find_files(str(tmpdir.join('c.txt')), '.hrm') == [
+            str(tmpdir.join('c.txt'))]
+
+    def test_run_program(self, tmpdir):
+        """
+        A program's output and step count are collected.
+        """
+        write_files(tmpdir, {'in.txt': "1 a"})
+        result = batch.run_program(
+            build_program(COPIER), str(tmpdir.join('in.txt')))
+        assert result['output'] == ["1", "a"]
+        assert result['steps'] == 6
+        assert result['error'] is None
+
+    def test_run_program_error(self, tmpdir):
+        """
+        Errors are reported along with any output produced before them.
+        """
+        write_files(tmpdir, {'in.txt': "1 2 a 3"})
+        result = batch.run_program(
+            build_program(ADDER), str(tmpdir.join('in.txt')))
+        assert result['output'] == ["3"]
+        assert result['steps'] == 9
+        assert result['error'] == "Can't add these."
+
+    def test_run_program_limit(self, tmpdir):
+        """
+        A program that never stops is stopped by a step limit.
+        """
+        write_files(tmpdir, {'in.txt': ""})
+        forever = "-- HUMAN RESOURCE MACHINE PROGRAM --\na:\nJUMP a"
+        result = batch.run_program(
+            build_program(forever), str(tmpdir.join('in.txt')),
+            max_steps=100)
+        assert result['steps'] == 101
+        assert result['error'] == "Step limit of 100 exceeded."
+
+    def test_run_batch(self, tmpdir):
+        """
+        Every program is run against every input.
+        """
+        write_files(tmpdir, {
+            'copier.hrm': COPIER, 'adder.hrm': ADDER,
+            'one.txt': "1 2", 'two.txt': "3 4 5"})
+        programs = batch.find_files(str(tmpdir), '.hrm')
+        inputs = batch.find_files(str(tmpdir), '.txt')
+        results = batch.run_batch(
+            programs, inputs, processes=1, max_steps=100)
+        assert [(r['program'], r['input'], r['output']) for r in results] == [
+            (programs[0], inputs[0], ["3"]),
+            (programs[0], inputs[1], ["7"]),
+            (programs[1], inputs[0], ["1", "2"]),
+            (programs[1], inputs[1], ["3", "4", "5"]),
+        ]
+
+    def test_run_batch_coverage(self, tmpdir):
+        """
+        With coverage, each result has a bitmap for each instruction of the
+        unoptimized program.
+        """
+        write_files(tmpdir, {'adder.hrm': ADDER, 'in.txt': "1 2 a 3"})
+        results = batch.run_batch(
+            [str(tmpdir.join('adder.hrm'))], [str(tmpdir.join('in.txt'))],
+            processes=1, coverage=True)
+        # The second ADD fails, so the instructions after it only ran once.
+        assert results[0]['coverage'] == [1, 1, 1, 1, 1, 1]
+        assert results[0]['error'] == "Can't add these."
+
+    def test_reports(self):
+        """
+        Reports can be written as JSON or CSV.
+        """
+        results = [{
+            'program': 'p.hrm', 'input': 'i.txt', 'steps': 6, 'error': None,
+            'seconds': 0.5, 'output': ["1", "a"]}]
+        fp = StringIO()
+        batch.write_report(results, fp, 'json')
+        assert json.loads(fp.getvalue()) == results
+        fp = StringIO()
+        batch.write_report(results, fp, 'csv')
+        assert fp.getvalue().splitlines() == [
+            "program,input,steps,error,seconds,output",
+            "p.hrm,i.txt,6,,0.5,1 a",
+        ]
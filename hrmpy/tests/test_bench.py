@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from hrmpy import bench
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+class TestBench(object):
+
+    def test_parse_stats(self):
+        """
+        The stats line is found among other stderr output and its times are
+        converted to seconds.
+        """
+        stats = bench.parse_stats("\n".join([
+            "Some warning",
+            "hrmpy-stats steps=42 parse=1500 build=250 run=2000000",
+        ]))
+        assert stats == {
+            'steps': 42, 'parse': 0.0015, 'build': 0.00025, 'run': 2.0}
+
+    def test_parse_stats_missing(self):
+        """
+        It is an error if there are no stats.
+        """
+        with pytest.raises(ValueError):
+            bench.parse_stats("Traceback: oops")
+
+    def test_compare(self):
+        """
+        Only workloads that are slower than the baseline by more than the
+        threshold are regressions.
+        """
+        baseline = {'a': {'run': 1.0}, 'b': {'run': 1.0}, 'c': {'run': 1.0}}
+        results = {'a': {'run': 1.1}, 'b': {'run': 1.5}, 'd': {'run': 9.0}}
+        assert bench.compare(results, baseline, 1.2) == [('b', 1.5)]
+        assert bench.compare(results, baseline, 1.05) == [
+            ('a', 1.1), ('b', 1.5)]
+
+    def test_benchmark_python(self, monkeypatch):
+        """
+        The untranslated interpreter can be benchmarked.
+        """
+        monkeypatch.chdir(REPO_ROOT)
+        result = bench.benchmark(
+            bench.target_command('python'), 'progs/01-mail-room.hrm',
+            'inputs/jot10.txt', repeat=2)
+        assert result['steps'] == 6
+        assert result['max_rss_kb'] > 0
+        assert result['steps_per_second'] > 0
+        assert set(result) == set([
+            'steps', 'parse', 'build', 'run', 'steps_per_second',
+            'max_rss_kb'])
+
+    def test_failed_workload(self, tmpdir):
+        """
+        A workload whose program fails is an error, even though it still
+        writes its stats.
+        """
+        program = tmpdir.join("fail.hrm")
+        program.write("-- HUMAN RESOURCE MACHINE PROGRAM --\nINBOX\nADD 0\n")
+        input_file = tmpdir.join("input.txt")
+        input_file.write("1")
+        with pytest.raises(ValueError) as excinfo:
+            bench.run_once(
+                bench.target_command('python'), str(program), str(input_file))
+        assert str(excinfo.value) == (
+            "Exited with status 1: "
+            "hrmpy.operations.IllegalOperation: No value in 0.")
+
+    def test_main_skips_failed_workloads(self, tmpdir, capsys, monkeypatch):
+        """
+        Failed workloads are reported and left out of the saved baseline.
+        """
+        monkeypatch.chdir(REPO_ROOT)
+        program = tmpdir.join("fail.hrm")
+        program.write("-- HUMAN RESOURCE MACHINE PROGRAM --\nINBOX\nADD 0\n")
+        baseline = tmpdir.join("baseline.json")
+        assert bench.main([
+            "--repeat", "1", "--save-baseline", str(baseline),
+            "--workload", "%s:inputs/jot10.txt" % (program,),
+            "--workload", "progs/01-mail-room.hrm:inputs/jot10.txt"]) == 1
+        out, _ = capsys.readouterr()
+        assert out.startswith("FAILED %s:inputs/jot10.txt: " % (program,))
+        assert baseline.read().count('"steps"') == 1
@@ -0,0 +1,85 @@
+import pytest
+
+from hrmpy.budget import Budget, BudgetExceeded
+from hrmpy.main import build_program, execute
+from hrmpy.parser import parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+def program_text(*lines):
+    return "\n".join(["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines))
+
+
+FOREVER = program_text("a:", "JUMP a")
+
+
+def run(text, budget, input_text="", optimized=True):
+    output = ListOutputSink()
+    steps = execute(build_program(text, optimized),
+                    ListInputQueue(parse_input_data(input_text)), output,
+                    budget=budget)
+    return steps, output.output
+
+
+class TestBudget(object):
+
+    def test_no_limits_never_due(self):
+        budget = Budget()
+        budget.start_from(0)
+        assert not budget.due(10 ** 12)
+
+    def test_step_limit_checked_once(self):
+        """
+        Without a time limit, nothing is checked until the step limit has
+        passed.
+        """
+        budget = Budget(max_steps=100, check_every=10)
+        budget.start_from(0)
+        assert not budget.due(100)
+        assert budget.due(101)
+        with pytest.raises(BudgetExceeded) as e:
+            budget.check(101, 3)
+        assert (e.value.steps, e.value.pc) == (101, 3)
+        assert str(e.value) == "Step limit of 100 exceeded."
+
+    def test_time_limit_checked_every_so_often(self):
+        budget = Budget(max_seconds=1000.0, check_every=10)
+        budget.start_from(5)
+        assert not budget.due(14)
+        assert budget.due(15)
+        budget.check(15, 0)
+        assert budget.next_check == 25
+        budget.start -= 2000
+        with pytest.raises(BudgetExceeded) as e:
+            budget.check(25, 0)
+        assert str(e.value) == "Time limit of 1000.0 seconds exceeded."
+        assert e.value.seconds > 1000
+
+
+class TestExecute(object):
+
+    @pytest.mark.parametrize("optimized", [True, False])
+    def test_infinite_loop_stopped_by_steps(self, optimized):
+        with pytest.raises(BudgetExceeded) as e:
+            run(FOREVER, Budget(max_steps=1000), optimized=optimized)
+        assert e.value.steps == 1001
+        assert e.value.pc == 0
+
+    def test_infinite_loop_stopped_by_time(self):
+        with pytest.raises(BudgetExceeded) as e:
+            run(FOREVER, Budget(max_seconds=0.0, check_every=50))
+        assert e.value.steps == 50
+
+    def test_output_kept(self):
+        text = program_text("a:", "INBOX", "OUTBOX", "JUMP a")
+        output = ListOutputSink()
+        with pytest.raises(BudgetExceeded):
+            execute(build_program(text),
+                    ListInputQueue(parse_input_data("1 2 3 4 5")), output,
+                    budget=Budget(max_steps=6))
+        assert output.output == ["1", "2", "3"]
+
+    def test_within_budget(self):
+        text = program_text("a:", "INBOX", "OUTBOX", "JUMP a")
+        assert run(text, Budget(max_steps=9, max_seconds=100.0),
+                   "1 2 3") == (9, ["1", "2", "3"])
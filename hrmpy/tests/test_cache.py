@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from hrmpy.cache import (
+    CacheError, ProgramCache, dump_program, load_operations, program_key)
+from hrmpy.main import Program, build_program, execute
+from hrmpy.parser import parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+PROGS = os.path.join(os.path.dirname(__file__), "..", "..", "progs")
+
+
+def program_text(*lines):
+    return "\n".join(["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines))
+
+
+def same_program(program, other):
+    for attr in ['opcodes', 'addrs', 'indirects', 'targets', 'steps', 'hops',
+                 'size', 'min_addr', 'max_addr']:
+        assert getattr(program, attr) == getattr(other, attr), attr
+    assert program.source_size == other.source_size
+    assert program.jump_labels() == other.jump_labels()
+    assert program.initial_memory() == other.initial_memory()
+    assert [str(op) for op in program] == [str(op) for op in other]
+
+
+class TestEncoding(object):
+
+    @pytest.mark.parametrize("optimized", [True, False])
+    @pytest.mark.parametrize("filename", sorted(
+        name for name in os.listdir(PROGS) if name.endswith(".hrm")))
+    def test_round_trip_shipped_programs(self, filename, optimized):
+        """
+        Every shipped program survives a round trip through the encoding.
+        """
+        with open(os.path.join(PROGS, filename)) as fp:
+            program = build_program(fp.read(), optimized)
+        same_program(Program(*load_operations(dump_program(program))), program)
+
+    def test_round_trip_everything(self):
+        """
+        Labels at the end, undefined labels, indirect and negative addresses,
+        and both kinds of initial value are all kept.
+        """
+        program = build_program(program_text(
+            ".memset 0 5", ".memset 1 c", "a:", "INBOX", "COPYTO [1]",
+            "COPYFROM -1", "SUB 0", "JUMPN b", "JUMP a", "b:", "JUMP c",
+            "z:"))
+        same_program(Program(*load_operations(dump_program(program))), program)
+
+    def test_loaded_program_runs(self):
+        text = program_text(
+            "a:", "INBOX", "COPYTO 0", "INBOX", "ADD 0", "OUTBOX", "JUMP a")
+        data = dump_program(build_program(text))
+        output = ListOutputSink()
+        steps = execute(
+            Program(*load_operations(data)),
+            ListInputQueue(parse_input_data("1 2 3 4")), output)
+        assert output.output == ["3", "7"]
+        assert steps == 12
+
+    @pytest.mark.parametrize("data", [
+        "", "HRMC", "XXXX\x00", "\x04HRMC\x63", "\x04HRMC\x01\x00\x01\x09",
+        "\x04HRMC\x01\x00\x00\x00\x00",
+    ])
+    def test_bad_data(self, data):
+        with pytest.raises(CacheError):
+            load_operations(data)
+
+
+class TestProgramCache(object):
+
+    def test_program_key(self):
+        """
+        Keys depend on the program text and whether it's optimized.
+        """
+        text = program_text("INBOX", "OUTBOX")
+        assert program_key(text, True) == program_key(text, True)
+        assert program_key(text, True) != program_key(text, False)
+        assert program_key(text, True) != program_key(text + "\n", True)
+
+    def test_miss_then_hit(self, tmpdir):
+        cache = ProgramCache(str(tmpdir.join("cache")))
+        text = program_text("a:", "INBOX", "OUTBOX", "JUMP a")
+        key = program_key(text, True)
+        assert cache.get(key) is None
+        program = build_program(text, cache=cache)
+        assert tmpdir.join("cache", key + ".hrmc").check()
+        same_program(Program(*cache.get(key)), program)
+
+    def test_cache_skips_parsing(self, tmpdir, monkeypatch):
+        """
+        A cached program is loaded without parsing its text.
+        """
+        cache = ProgramCache(str(tmpdir))
+        text = program_text("a:", "INBOX", "OUTBOX", "JUMP a")
+        program = build_program(text, cache=cache)
+
+        def no_parsing(text):
+            raise AssertionError("Parsed a cached program.")
+        monkeypatch.setattr("hrmpy.main.parse_program", no_parsing)
+        same_program(build_program(text, cache=cache), program)
+
+    def test_corrupt_entry_is_a_miss(self, tmpdir):
+        cache = ProgramCache(str(tmpdir))
+        text = program_text("INBOX", "OUTBOX")
+        key = program_key(text, True)
+        tmpdir.join(key + ".hrmc").write("garbage")
+        assert cache.get(key) is None
+        build_program(text, cache=cache)
+        assert cache.get(key) is not None
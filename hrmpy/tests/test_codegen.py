@@ -0,0 +1,133 @@
+import glob
+import os
+
+import pytest
+
+from hrmpy import codegen
+from hrmpy.main import Program, build_program, execute, read
+from hrmpy.operations import IllegalOperation
+from hrmpy.optimizer import optimize
+from hrmpy.parser import parse_program, parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def program(*lines):
+    instructions = ["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines)
+    return parse_program("\n".join(instructions))
+
+
+def run(executor, prog, input_text):
+    """
+    Run a compiled program and return its output, step count and the error
+    it raised, if any.
+    """
+    output = ListOutputSink()
+    error = None
+    try:
+        steps = executor(
+            prog, ListInputQueue(parse_input_data(input_text)), output)
+    except IllegalOperation as e:
+        error = str(e)
+        steps = e.steps
+    return output.output, steps, error
+
+
+def assert_same(prog, input_text):
+    expected = run(execute, prog, input_text)
+    assert run(codegen.execute_compiled, prog, input_text) == expected
+    return expected
+
+
+def ops_named(prog, name):
+    return [op for op in prog if op.name == name]
+
+
+class TestCodegen(object):
+
+    @pytest.mark.parametrize('lines,input_text', [
+        ((), "1 2"),
+        (("a:", "INBOX", "OUTBOX", "JUMP a"), "1 a -3"),
+        (("OUTBOX",), ""),
+        (("COPYFROM 3",), ""),
+        (("INBOX", "COPYTO 0", "INBOX", "ADD 0", "OUTBOX"), "2 3"),
+        (("INBOX", "COPYTO 0", "INBOX", "ADD 0", "OUTBOX"), "a 3"),
+        (("INBOX", "COPYTO 0", "INBOX", "SUB 0", "OUTBOX"), "b a"),
+        (("INBOX", "COPYTO 0", "INBOX", "SUB 0", "OUTBOX"), "b 1"),
+        (("INBOX", "COPYTO 0", "BUMPUP 0", "OUTBOX"), "a"),
+        (("INBOX", "COPYTO 0", "BUMPDN 0", "OUTBOX"), "a"),
+        (("a:", "INBOX", "JUMPZ x", "OUTBOX", "JUMP a"), "1 0"),
+        (("INBOX", "COPYTO 0", "b:", "BUMPDN 0", "JUMPZ x", "JUMP b"), "3"),
+        (("a:", "INBOX", "JUMPZ b", "OUTBOX", "JUMP a", "b:"), "1 a 0 2"),
+        (("a:", "INBOX", "JUMPN b", "OUTBOX", "JUMP a", "b:"), "1 a -1 2"),
+        (("JUMPZ a", "a:"), ""),
+        (("INBOX", "JUMP nowhere"), "1"),
+        ((".memset 7 0", "a:", "INBOX", "COPYTO [7]", "BUMPUP 7", "INBOX",
+          "COPYTO [7]", "COPYFROM [7]", "OUTBOX", "BUMPDN 7", "COPYFROM [7]",
+          "OUTBOX", "JUMP a"), "1 2 a b"),
+        ((".memset 0 a", "COPYFROM [0]"), ""),
+        ((".memset 0 70000", "COPYFROM [0]"), ""),
+        (("COPYTO 70000",), ""),
+        (("INBOX", "COPYTO [1]"), "1"),
+    ])
+    def test_same_as_mainloop(self, lines, input_text):
+        """
+        Compiled programs produce the same output, step counts and errors as
+        the interpreter, with and without the optimizer.
+        """
+        assert_same(Program(program(*lines)), input_text)
+        assert_same(Program(optimize(program(*lines))), input_text)
+
+    @pytest.mark.parametrize('filename', sorted(
+        glob.glob(os.path.join(REPO_ROOT, 'progs', '*.hrm'))))
+    def test_shipped_programs(self, filename):
+        """
+        Every shipped program behaves the same when compiled.
+        """
+        text = read(filename)
+        for input_name in ['jot10.txt', 'numstrs.txt', 'textstrs.txt']:
+            input_text = read(os.path.join(REPO_ROOT, 'inputs', input_name))
+            assert_same(build_program(text, False), input_text)
+            assert_same(build_program(text, True), input_text)
+
+    @pytest.mark.parametrize('loop,input_text', [
+        (("b:", "BUMPDN 0", "JUMPZ c", "JUMP b", "c:"), "3 1 7 a"),
+        (("b:", "BUMPUP 0", "JUMPN b"), "-4 0 5 -1"),
+        (("b:", "BUMPDN 0", "JUMPN c", "JUMP b", "c:"), "0 5 -2"),
+        (("b:", "BUMPUP 0", "JUMPZ b"), "-1 3"),
+    ])
+    def test_counting_loops(self, loop, input_text):
+        """
+        Collapsed counting loops behave the same when compiled.
+        """
+        lines = ("a:", "INBOX", "COPYTO 0") + loop + ("OUTBOX", "JUMP a")
+        prog = Program(optimize(program(*lines)))
+        assert ops_named(prog, 'COUNT_LOOP')
+        assert_same(prog, input_text)
+
+    def test_memory_locals(self):
+        """
+        Programs without indirect addressing keep tiles in local variables,
+        and others use lists.
+        """
+        source, _ = codegen.generate_source(
+            Program(program("INBOX", "COPYTO 3", "COPYFROM 3", "OUTBOX")))
+        assert "k3 = ak" in source
+        assert "kinds" not in source
+        source, _ = codegen.generate_source(
+            Program(program("INBOX", "COPYTO [3]")))
+        assert "kinds = [EMPTY] * MEMORY_SIZE" in source
+
+    def test_cache(self):
+        """
+        Identical programs share a compiled function.
+        """
+        lines = ("a:", "INBOX", "OUTBOX", "JUMP a")
+        run1 = codegen.compile_program(Program(program(*lines)))
+        run2 = codegen.compile_program(Program(program(*lines)))
+        run3 = codegen.compile_program(Program(program("INBOX")))
+        assert run1 is run2
+        assert run1 is not run3
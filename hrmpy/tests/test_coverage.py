@@ -0,0 +1,109 @@
+import json
+
+from hrmpy import coverage
+from hrmpy.main import build_program
+from hrmpy.profiler import COVERED, JUMP_NOT_TAKEN, JUMP_TAKEN
+
+
+SIGNS = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --",
+    "a:",
+    "    INBOX",
+    "    JUMPN b",
+    "    OUTBOX",
+    "    JUMP a",
+    "b:",
+    "    JUMPZ a",
+])
+
+BOTH = COVERED | JUMP_TAKEN | JUMP_NOT_TAKEN
+
+
+def write_files(tmpdir, files):
+    for name, content in files.items():
+        tmpdir.join(name).write(content)
+    return [str(tmpdir.join(name)) for name in sorted(files)]
+
+
+class TestCoverage(object):
+
+    def test_merge(self):
+        assert coverage.merge(
+            [0, COVERED, COVERED | JUMP_TAKEN],
+            [COVERED, COVERED, COVERED | JUMP_NOT_TAKEN]) == [
+                COVERED, COVERED, BOTH]
+
+    def test_summarize(self):
+        program = build_program(SIGNS, optimized=False)
+        assert coverage.possible(program) == [
+            COVERED, BOTH, COVERED, COVERED, BOTH]
+        assert coverage.summarize(program, [
+            COVERED, COVERED | JUMP_NOT_TAKEN, COVERED, COVERED, 0]) == (
+                "instructions 4/5 (80%), branches 1/4 (25%)")
+
+    def test_annotate(self):
+        """
+        Each instruction in the listing is marked with what was missed.
+        """
+        program = build_program(SIGNS, optimized=False)
+        listing = coverage.annotate(SIGNS, program, [
+            COVERED, COVERED | JUMP_NOT_TAKEN, COVERED, COVERED, 0])
+        assert listing.splitlines() == [
+            "             | -- HUMAN RESOURCE MACHINE PROGRAM --",
+            "             | a:",
+            "          ok |     INBOX",
+            " never jumps |     JUMPN b",
+            "          ok |     OUTBOX",
+            "          ok |     JUMP a",
+            "             | b:",
+            "       never |     JUMPZ a",
+        ]
+
+    def test_minimize(self):
+        """
+        Inputs that don't cover anything new are left out.
+        """
+        results = [
+            {'program': 'p', 'input': 'a', 'coverage': [COVERED, 0]},
+            {'program': 'p', 'input': 'b', 'coverage': [COVERED, COVERED]},
+            {'program': 'q', 'input': 'a', 'coverage': [BOTH]},
+            {'program': 'q', 'input': 'b', 'coverage': [COVERED]},
+            {'program': 'q', 'input': 'c', 'coverage': [COVERED]},
+        ]
+        assert coverage.minimize(results) == ['a', 'b']
+
+    def test_collect(self, tmpdir):
+        """
+        Coverage is merged across every input a program ran against.
+        """
+        one, signs, two = write_files(tmpdir, {
+            'signs.hrm': SIGNS, 'one.txt': "1 2", 'two.txt': "0 -1"})
+        results, merged = coverage.collect([signs], [one, two], 1)
+        assert [result['coverage'] for result in results] == [
+            [COVERED, COVERED | JUMP_NOT_TAKEN, COVERED, COVERED, 0],
+            [COVERED, BOTH, COVERED, COVERED, COVERED | JUMP_NOT_TAKEN]]
+        assert merged == {signs: [
+            COVERED, BOTH, COVERED, COVERED, COVERED | JUMP_NOT_TAKEN]}
+
+    def test_main(self, tmpdir, capsys):
+        """
+        Saved coverage is merged in, and the listings and the inputs needed
+        for the same coverage are written.
+        """
+        program, one, two = write_files(tmpdir, {
+            'a.hrm': SIGNS, 'one.txt': "1 2", 'two.txt': "0 -1"})
+        data = str(tmpdir.join('coverage.json'))
+        with open(data, 'wb') as fp:
+            json.dump({program: [0, 0, 0, 0, JUMP_TAKEN]}, fp)
+        assert coverage.main([
+            "--data", data, "--listing", str(tmpdir), "--minimize",
+            "--jobs", "1", program, str(tmpdir)]) == 0
+        out, _ = capsys.readouterr()
+        assert out.splitlines() == [
+            "%s: instructions 5/5 (100%%), branches 4/4 (100%%)" % (program,),
+            two,
+        ]
+        with open(data, 'rb') as fp:
+            assert json.load(fp) == {program: [
+                COVERED, BOTH, COVERED, COVERED, BOTH]}
+        assert "          ok |     JUMPZ a" in tmpdir.join('a.hrm.cov').read()
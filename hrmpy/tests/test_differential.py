@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+from hrmpy import differential
+from hrmpy.main import build_program
+from hrmpy.snapshot import Snapshot
+
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+
+# Inputs that take too long for the plain interpreter to be worth testing
+# every time.
+SLOW_INPUTS = ['rand1000.txt', 'rand3000.txt', 'rand10000.txt']
+
+
+def corpus_files(directory, extension, skip=()):
+    return sorted(
+        name for name in os.listdir(os.path.join(ROOT, directory))
+        if name.endswith(extension) and name not in skip)
+
+
+def read(directory, name):
+    with open(os.path.join(ROOT, directory, name)) as fp:
+        return fp.read()
+
+
+SUMS = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --", ".memset 0 0",
+    "a:", "INBOX", "ADD 0", "COPYTO 0", "OUTBOX", "JUMP a"])
+
+
+def snapshot(**kw):
+    fields = dict(
+        program_key=None, pc=0, acc_kind=1, acc=5, steps=10,
+        input_position=0, output_count=2, addrs=[0, 3], kinds=[1, 2],
+        integers=[7, 97])
+    fields.update(kw)
+    return Snapshot(**fields)
+
+
+class TestState(object):
+
+    def test_same(self):
+        state = differential.State(snapshot())
+        assert state.differences(differential.State(snapshot(pc=4))) == []
+
+    def test_differences(self):
+        state = differential.State(snapshot())
+        other = differential.State(snapshot(
+            acc=6, output_count=3, integers=[7, 98]))
+        assert state.differences(other) == [
+            "accumulator (1, 5) != (1, 6)", "output count 2 != 3",
+            "tile 3 (2, 97) != (2, 98)"]
+
+    def test_missing_tile(self):
+        state = differential.State(snapshot())
+        other = differential.State(snapshot(
+            addrs=[0], kinds=[1], integers=[7]))
+        assert state.differences(other) == ["tile 3 (2, 97) != None"]
+
+
+class TestDiffProgram(object):
+
+    def test_engines_agree(self):
+        assert differential.diff_program(SUMS, "1 2 3 4 5", interval=1) == []
+
+    def test_divergence_found_at_checkpoint(self, monkeypatch):
+        """
+        A broken engine is caught at the first checkpoint it gets wrong,
+        before the end of the run.
+        """
+        def broken_build(text, optimized=True):
+            if optimized:
+                text = text.replace("ADD 0", "SUB 0")
+            return build_program(text, optimized)
+        monkeypatch.setattr(differential, 'build_program', broken_build)
+        divergences = differential.diff_program(
+            SUMS, "1 2 3 4 5", ['plain', 'optimized'], interval=1)
+        assert len(divergences) == 1
+        divergence = divergences[0]
+        assert divergence.engine == 'optimized'
+        # Adding or subtracting the first value from zero leaves the same
+        # state, so it takes a second time around the loop to differ.
+        assert divergence.steps == 10
+        assert str(divergence) == (
+            "plain and optimized diverge at step 10 (pc 0 in plain, pc 0 in "
+            "optimized): tile 0 (1, 3) != (1, 1)")
+
+    def test_divergence_at_end(self):
+        expected = differential.Run(["1", "2"], 10, None)
+        run = differential.Run(["1", "3", "4"], 12, "Oops.")
+        assert str(differential.compare_runs("a", "b", expected, run)) == (
+            "a and b diverge at the end of the run: output 1 2 != 3")
+        run = differential.Run(["1", "2", "4"], 12, "Oops.")
+        assert str(differential.compare_runs("a", "b", expected, run)) == (
+            "a and b diverge at the end of the run: 2 outputs != 3; "
+            "steps 10 != 12; error None != Oops.")
+
+    def test_error_runs_agree(self):
+        text = "\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "ADD 0", "JUMP a"])
+        assert differential.diff_program(text, "1 2") == []
+
+    def test_undefined_label_runs_agree(self):
+        """
+        Every engine stops a jump to an undefined label with the same error
+        after the same number of steps, however the jumps were threaded.
+        """
+        text = "\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "INBOX", "JUMP b", "OUTBOX", "b:", "JUMP c"])
+        assert differential.diff_program(text, "1") == []
+
+    @pytest.mark.parametrize("lines", [
+        ["INBOX", "OUTBOX", "INBOX", "COPYTO 65536"],
+        ["JUMP a", "COPYTO 70000", "a:", "INBOX", "OUTBOX"],
+        ["INBOX", "COPYTO 0", "a:", "BUMPUP -1", "JUMPN a"],
+    ])
+    def test_address_out_of_range_runs_agree(self, lines):
+        """
+        A direct address outside memory is an error when it is used, in
+        every engine.
+        """
+        text = "\n".join(["-- HUMAN RESOURCE MACHINE PROGRAM --"] + lines)
+        assert differential.diff_program(text, "1 2") == []
+
+    @pytest.mark.parametrize("input_name", corpus_files(
+        "inputs", ".txt", SLOW_INPUTS))
+    @pytest.mark.parametrize("program_name", corpus_files("progs", ".hrm"))
+    def test_corpus(self, program_name, input_name):
+        """
+        Every engine agrees on every shipped program and input.
+        """
+        assert differential.diff_program(
+            read("progs", program_name), read("inputs", input_name)) == []
@@ -0,0 +1,111 @@
+import pytest
+
+from hrmpy import hooks
+from hrmpy.main import Machine, build_program, execute
+from hrmpy.operations import CHARACTER, INTEGER
+from hrmpy.parser import parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+SUMS = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --", ".memset 0 0",
+    "a:", "INBOX", "ADD 0", "COPYTO 0", "OUTBOX", "JUMP a"])
+
+
+class Recorder(hooks.Observer):
+    """
+    Records every event it observes.
+    """
+    def __init__(self, events):
+        self.events = events
+        self.seen = []
+
+    def on_inbox(self, pc, kind, integer):
+        self.seen.append(('inbox', pc, kind, integer))
+
+    def on_outbox(self, pc, kind, integer):
+        self.seen.append(('outbox', pc, kind, integer))
+
+    def on_write(self, pc, addr, kind, integer):
+        self.seen.append(('write', pc, addr, kind, integer))
+
+    def on_jump(self, pc, target):
+        self.seen.append(('jump', pc, target))
+
+
+def run(text, input_text, observers, optimized=True):
+    output = ListOutputSink()
+    steps = execute(
+        build_program(text, optimized),
+        ListInputQueue(parse_input_data(input_text)), output,
+        hooks=hooks.Hooks(observers))
+    return output.output, steps
+
+
+class TestHooks(object):
+
+    def test_unobserved_events(self):
+        """
+        Events nobody observes have no list, so the interpreter skips them.
+        """
+        registry = hooks.Hooks([Recorder(hooks.INBOX | hooks.JUMP)])
+        assert registry.inbox is not None
+        assert registry.outbox is None
+        assert registry.writes is None
+        assert registry.jumps is not None
+        assert hooks.Hooks([]).inbox is None
+
+    @pytest.mark.parametrize("optimized", [False, True])
+    def test_events(self, optimized):
+        """
+        Every observed event is reported in order, and the run is the same
+        as without observers.
+        """
+        recorder = Recorder(
+            hooks.INBOX | hooks.OUTBOX | hooks.WRITE | hooks.JUMP)
+        assert run(SUMS, "1 2", [recorder], optimized) == (["1", "3"], 10)
+        assert recorder.seen == [
+            ('inbox', 0, INTEGER, 1), ('write', 2, 0, INTEGER, 1),
+            ('outbox', 3, INTEGER, 1), ('jump', 4, 0),
+            ('inbox', 0, INTEGER, 2), ('write', 2, 0, INTEGER, 3),
+            ('outbox', 3, INTEGER, 3), ('jump', 4, 0)]
+
+    def test_some_events(self):
+        """
+        Each observer only hears about the events it observes.
+        """
+        writes = Recorder(hooks.WRITE)
+        outbox = Recorder(hooks.OUTBOX)
+        text = "\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "COPYTO 0", "COPYFROM 0", "OUTBOX", "JUMP a"])
+        assert run(text, "a 2", [writes, outbox]) == (["a", "2"], 10)
+        assert writes.seen == [
+            ('write', 0, 0, CHARACTER, ord("a")), ('write', 0, 0, INTEGER, 2)]
+        assert outbox.seen == [
+            ('outbox', 1, CHARACTER, ord("a")), ('outbox', 1, INTEGER, 2)]
+
+    def test_conditional_jumps(self):
+        """
+        Only jumps that are taken are reported.
+        """
+        jumps = Recorder(hooks.JUMP)
+        text = "\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "JUMPZ a", "OUTBOX", "JUMP a"])
+        assert run(text, "0 1", [jumps], optimized=False) == (["1"], 6)
+        assert jumps.seen == [('jump', 1, 0), ('jump', 3, 0)]
+
+    def test_machine_reset(self):
+        """
+        A machine keeps its hooks when it is reset.
+        """
+        recorder = Recorder(hooks.INBOX)
+        machine = Machine(
+            build_program(SUMS), ListInputQueue(parse_input_data("4")),
+            ListOutputSink(), hooks=hooks.Hooks([recorder]))
+        machine.run()
+        machine.reset(ListInputQueue(parse_input_data("5")))
+        machine.run()
+        assert recorder.seen == [
+            ('inbox', 0, INTEGER, 4), ('inbox', 0, INTEGER, 5)]
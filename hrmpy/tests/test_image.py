@@ -0,0 +1,86 @@
+import pytest
+
+from hrmpy import operations as ops
+from hrmpy.image import ImageError, MemoryImage, dump_image, is_image, main
+from hrmpy.main import Memory, PAGE_BITS, entry_point
+
+
+def filled_memory():
+    memory = Memory()
+    memory.set_addr(0, ops.INTEGER, 5)
+    memory.set_addr(1, ops.CHARACTER, ord('a'))
+    memory.set_addr(300, ops.INTEGER, -7)
+    memory.set_addr(65535, ops.INTEGER, 999)
+    return memory
+
+
+class TestMemoryImage(object):
+
+    def test_round_trip(self):
+        memory = Memory()
+        memory.load_image(MemoryImage(filled_memory().image()))
+        assert memory.tiles() == filled_memory().tiles()
+
+    def test_pages_loaded_lazily(self):
+        """
+        Pages are only decoded when something uses them.
+        """
+        memory = Memory()
+        memory.load_image(MemoryImage(filled_memory().image()))
+        assert memory._pages == [None] * len(memory._pages)
+        assert memory.get_value(300) == ops.Integer(-7)
+        assert memory.get_value(301) is None
+        assert memory.get_value(1000) is None
+        loaded = [i for i, page in enumerate(memory._pages) if page]
+        assert loaded == [300 >> PAGE_BITS, 1000 >> PAGE_BITS]
+
+    def test_write_before_read(self):
+        """
+        Writing to a tile keeps the rest of its page from the image.
+        """
+        memory = Memory()
+        memory.load_image(MemoryImage(filled_memory().image()))
+        memory.set_addr(1, ops.INTEGER, 3)
+        assert memory.get_value(0) == ops.Integer(5)
+        assert memory.get_value(1) == ops.Integer(3)
+
+    def test_is_image(self):
+        assert is_image(Memory().image())
+        assert not is_image("0 5\n")
+
+    @pytest.mark.parametrize("data", [
+        "", "nonsense", "\x04HRMI\x63",
+        dump_image(1024, 8, [], [], []) + "x",
+        dump_image(1024, 8, [2000], [ops.INTEGER], [1]),
+    ])
+    def test_bad_data(self, data):
+        with pytest.raises(ImageError):
+            MemoryImage(data)
+
+    def test_wrong_layout(self):
+        image = MemoryImage(dump_image(1024, PAGE_BITS, [], [], []))
+        with pytest.raises(ImageError):
+            Memory().load_image(image)
+
+
+class TestEntryPoint(object):
+
+    def test_image_file(self, tmpdir, capfd):
+        """
+        A floor file converted to an image gives the same floor.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --", ".memset 1 9",
+            "COPYFROM 0", "OUTBOX", "COPYFROM 1", "OUTBOX", "COPYFROM 2",
+            "OUTBOX"]))
+        tmpdir.join("input.txt").write("")
+        tmpdir.join("floor.txt").write("0 5\n1 7\n2 c\n")
+        assert main([
+            "hrmpy.image", str(tmpdir.join("floor.txt")),
+            str(tmpdir.join("floor.hrmi"))]) == 0
+        assert entry_point([
+            "hrmpy", str(tmpdir.join("prog.hrm")),
+            str(tmpdir.join("input.txt")),
+            str(tmpdir.join("floor.hrmi"))]) == 0
+        out, err = capfd.readouterr()
+        assert out.split() == ["5", "9", "c"]
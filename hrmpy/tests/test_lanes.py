@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+from hrmpy import lanes
+from hrmpy.main import build_program
+from hrmpy.parser import parse_input_data
+
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+
+needs_numpy = pytest.mark.skipif(
+    lanes.numpy is None, reason="NumPy is not installed.")
+
+# Run every test with NumPy (if it's there) and without.
+ENGINES = [False, pytest.param(True, marks=needs_numpy)]
+
+
+def read(directory, name):
+    with open(os.path.join(ROOT, directory, name)) as fp:
+        return fp.read()
+
+
+def program(*lines):
+    return build_program("\n".join(
+        ("-- HUMAN RESOURCE MACHINE PROGRAM --",) + lines), optimized=False)
+
+
+def run(prog, input_texts, vectorized, max_steps=-1):
+    return lanes.run_lanes(
+        prog, [parse_input_data(text) for text in input_texts], max_steps,
+        vectorized)
+
+
+def result(output, steps, error=None):
+    return {'output': output, 'steps': steps, 'error': error}
+
+
+@pytest.mark.parametrize("vectorized", ENGINES)
+class TestLanes(object):
+
+    def test_copier(self, vectorized):
+        """
+        Each input set gets its own output and step count.
+        """
+        prog = program("a:", "INBOX", "OUTBOX", "JUMP a")
+        assert run(prog, ["1 a", "", "b"], vectorized) == [
+            result(["1", "a"], 6), result([], 0), result(["b"], 3)]
+
+    def test_divergent_jumps(self, vectorized):
+        """
+        Lanes that take different branches still get the right results.
+        """
+        prog = program(
+            ".memset 0 0",
+            "a:", "INBOX", "JUMPN b", "JUMPZ c", "OUTBOX", "JUMP a",
+            "b:", "BUMPUP 0", "JUMP a",
+            "c:", "COPYFROM 0", "OUTBOX", "JUMP a")
+        assert run(prog, ["-1 -2 0 5", "3 0", "-4 -4 -4 0"], vectorized) == [
+            result(["2", "5"], 19), result(["3", "0"], 11),
+            result(["3"], 18)]
+
+    def test_errors(self, vectorized):
+        """
+        A lane that fails stops with the same message and step count as the
+        interpreter, and leaves the other lanes alone.
+        """
+        prog = program("a:", "INBOX", "COPYTO 0", "INBOX", "ADD 0",
+                       "OUTBOX", "JUMP a")
+        assert run(prog, ["1 2 3 4", "1 2 a 3", "a"], vectorized) == [
+            result(["3", "7"], 12), result(["3"], 9, "Can't add these."),
+            result([], 2)]
+
+    def test_indirect(self, vectorized):
+        """
+        Pointers are followed per lane, including past the highest direct
+        address.
+        """
+        prog = program("a:", "INBOX", "COPYTO 0", "COPYTO [0]",
+                       "COPYFROM [0]", "OUTBOX", "JUMP a")
+        assert run(prog, ["5 300", "a", "-1"], vectorized) == [
+            result(["5", "300"], 12),
+            result([], 2, "No integer in 0."),
+            result([], 2, "Address -1 in 0 out of range.")]
+
+    def test_address_out_of_range(self, vectorized):
+        """
+        A direct address outside memory only fails the lanes that use it.
+        """
+        prog = program("INBOX", "JUMPZ a", "COPYTO 70000", "a:", "OUTBOX")
+        assert run(prog, ["0", "1"], vectorized) == [
+            result(["0"], 3), result([], 2, "Address 70000 out of range.")]
+
+    def test_undefined_label(self, vectorized):
+        prog = program("INBOX", "JUMPZ nowhere", "OUTBOX")
+        assert run(prog, ["0", "1"], vectorized) == [
+            result([], 2, "Jump to undefined label nowhere."),
+            result(["1"], 3)]
+
+    def test_max_steps(self, vectorized):
+        """
+        A lane that runs too long is stopped the same way a Budget stops
+        it.
+        """
+        prog = program("INBOX", "COPYTO 0", "a:", "BUMPUP 0", "JUMPZ b",
+                       "JUMP a", "b:")
+        assert run(prog, ["-3", "-300"], vectorized, max_steps=20) == [
+            result([], 10), result([], 23, "Step limit of 20 exceeded.")]
+
+    def test_optimized_program(self, vectorized):
+        prog = build_program("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "COPYTO 0", "JUMP a"]))
+        with pytest.raises(ValueError):
+            lanes.run_lanes(prog, [], vectorized=vectorized)
+
+    @pytest.mark.parametrize("program_name", sorted(
+        name for name in os.listdir(os.path.join(ROOT, "progs"))
+        if name.endswith(".hrm")))
+    def test_corpus(self, program_name, vectorized):
+        """
+        Every line of every small shipped input gets the same result as the
+        interpreter gives it.
+        """
+        prog = build_program(read("progs", program_name), optimized=False)
+        input_sets = []
+        for name in ["alphabetwords.txt", "numstrs.txt", "textstrs.txt"]:
+            input_sets.extend(lanes.read_input_sets(read("inputs", name)))
+        expected = lanes.run_lanes(prog, input_sets, 100000, False)
+        assert lanes.run_lanes(prog, input_sets, 100000, vectorized) == (
+            expected)
+
+
+def test_read_input_sets():
+    input_sets = lanes.read_input_sets("1 2 0\n\na b 0\n")
+    assert [[str(value) for value in values] for values in input_sets] == [
+        ["1", "2", "0"], [], ["a", "b", "0"]]
+
+
+def test_vectorized_needs_numpy(monkeypatch):
+    monkeypatch.setattr(lanes, "numpy", None)
+    with pytest.raises(ValueError):
+        lanes.run_lanes(program("INBOX"), [[]], vectorized=True)
@@ -1,8 +1,10 @@
 import pytest
 
-from hrmpy.main import mainloop
+from hrmpy.main import mainloop, entry_point, Machine, Memory, Program
+from hrmpy import operations as ops
 from hrmpy.operations import IllegalOperation
 from hrmpy.parser import parse_program, parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
 
 
 input = parse_input_data
@@ -13,6 +15,161 @@ def program(*lines):
     return parse_program("\n".join(instructions))
 
 
+class TestMemory(object):
+    def test_empty_tile(self):
+        """
+        Reading an empty tile is an error.
+        """
+        memory = Memory()
+        assert memory.get_value(3) is None
+        with pytest.raises(IllegalOperation):
+            memory.get_kind(3)
+
+    def test_set_and_get(self):
+        """
+        Tiles hold unboxed values.
+        """
+        memory = Memory()
+        memory.set_addr(3, ops.CHARACTER, ord('a'))
+        assert memory.get_kind(3) == ops.CHARACTER
+        assert memory.get_integer(3) == ord('a')
+        assert memory.get_value(3) == ops.Character('a')
+
+    def test_resolve_indirect(self):
+        """
+        Indirect operands must point through a tile holding an integer.
+        """
+        memory = Memory()
+        memory.set_addr(0, ops.INTEGER, 5)
+        memory.set_addr(1, ops.CHARACTER, ord('a'))
+        assert memory.resolve(0, False) == 0
+        assert memory.resolve(0, True) == 5
+        with pytest.raises(IllegalOperation):
+            memory.resolve(1, True)
+        with pytest.raises(IllegalOperation):
+            memory.resolve(2, True)
+
+    def test_sparse_pages(self):
+        """
+        Only pages that have been written to are allocated.
+        """
+        memory = Memory()
+        memory.set_addr(65535, ops.INTEGER, 1)
+        assert memory.get_value(65535) == ops.Integer(1)
+        assert memory.get_value(65534) is None
+        assert memory.get_value(0) is None
+        assert len([p for p in memory._pages if p is not None]) == 1
+
+    def test_resolve_out_of_range(self):
+        """
+        Indirect operands must point inside memory.
+        """
+        memory = Memory(size=16)
+        memory.set_addr(0, ops.INTEGER, 16)
+        memory.set_addr(1, ops.INTEGER, -1)
+        memory.set_addr(2, ops.INTEGER, 15)
+        assert memory.resolve(2, True) == 15
+        with pytest.raises(IllegalOperation) as excinfo:
+            memory.resolve(0, True)
+        assert str(excinfo.value) == "Address 16 in 0 out of range."
+        with pytest.raises(IllegalOperation):
+            memory.resolve(1, True)
+
+
+class TestProgram(object):
+    def test_empty_program(self):
+        """
+        An empty program compiles to empty arrays.
+        """
+        prog = Program([])
+        assert prog.size == 0
+        assert prog.opcodes == []
+
+    def test_opcodes_and_operands(self):
+        """
+        Each operation compiles to an opcode with its operand arrays.
+        """
+        prog = Program(program("INBOX", "COPYTO [3]", "ADD 4", "OUTBOX"))
+        assert prog.opcodes == [
+            ops.OP_INBOX, ops.OP_COPYTO, ops.OP_ADD, ops.OP_OUTBOX]
+        assert prog.addrs == [0, 3, 4, 0]
+        assert prog.indirects == [False, True, False, False]
+
+    def test_jump_targets(self):
+        """
+        Jump labels are resolved to absolute instruction indexes.
+        """
+        prog = Program(program(
+            "a:", "INBOX", "JUMPZ b", "OUTBOX", "JUMP a", "b:", "JUMPN c"))
+        assert prog.targets == [-1, 4, -1, 0, -1]
+        assert prog.jump_target(1) == 4
+        assert prog.jump_target(3) == 0
+        with pytest.raises(IllegalOperation) as e:
+            prog.jump_target(4)
+        assert str(e.value) == "Jump to undefined label c."
+
+
+class TestMachine(object):
+    def machine(self, input_text, *lines):
+        return Machine(Program(program(*lines)),
+                       ListInputQueue(input(input_text)), ListOutputSink())
+
+    def test_run(self):
+        machine = self.machine(
+            "1 2", "a:", "INBOX", "COPYTO 0", "OUTBOX", "JUMP a")
+        assert machine.run() == 8
+        assert machine.finished
+        assert machine.output.output == ["1", "2"]
+        assert machine.memory.get_value(0) == ops.Integer(2)
+
+    def test_step(self):
+        machine = self.machine("1 2", "a:", "INBOX", "OUTBOX", "JUMP a")
+        assert machine.step()
+        assert (machine.pc, machine.steps) == (1, 1)
+        assert (machine.acc_kind, machine.acc) == (ops.INTEGER, 1)
+        assert machine.step(3)
+        assert (machine.pc, machine.steps) == (1, 4)
+        assert machine.output.output == ["1"]
+        # There is no more input, so this finishes early.
+        assert not machine.step(100)
+        assert machine.steps == 6
+        assert not machine.step()
+        assert machine.steps == 6
+
+    def test_run_after_step(self):
+        machine = self.machine("1 2 3", "a:", "INBOX", "OUTBOX", "JUMP a")
+        machine.step(4)
+        assert machine.run() == 9
+        assert machine.output.output == ["1", "2", "3"]
+
+    def test_reset(self):
+        """
+        Resetting empties memory, keeping the pages it has allocated.
+        """
+        machine = self.machine(
+            "1 2", ".memset 1 7", "a:", "INBOX", "COPYTO 0", "JUMP a")
+        machine.run()
+        pages = list(machine.memory._pages)
+        output = ListOutputSink()
+        machine.reset(ListInputQueue(input("")), output)
+        assert not machine.finished
+        assert (machine.pc, machine.steps) == (0, 0)
+        assert machine.memory._pages == pages
+        assert machine.memory.get_value(0) is None
+        assert machine.memory.get_value(1) == ops.Integer(7)
+        assert machine.output is output
+        assert machine.run() == 0
+
+    def test_error_keeps_state(self):
+        machine = self.machine("1 a", "INBOX", "COPYTO 0", "INBOX", "ADD 0")
+        with pytest.raises(IllegalOperation) as e:
+            machine.run()
+        assert e.value.steps == 3
+        assert machine.finished
+        assert (machine.pc, machine.steps) == (3, 3)
+        assert (machine.acc_kind, machine.acc) == (ops.CHARACTER, ord('a'))
+
+
 class TestMainloop(object):
     def test_empty_program(self, cachedsys):
         """
@@ -88,6 +245,47 @@ class TestMainloop(object):
             ".memset 0 1"), [])
         assert cachedsys.output_data == "1 b"
 
+    @pytest.mark.parametrize("optimized", [False, True])
+    def test_address_out_of_range(self, cachedsys, optimized):
+        """
+        It is an error to use a direct address outside memory, when the
+        instruction runs.
+        """
+        with pytest.raises(IllegalOperation) as excinfo:
+            mainloop(program("INBOX", "OUTBOX", "INBOX", "COPYTO 65536"),
+                     input("1 2"), optimized=optimized)
+        assert str(excinfo.value) == "Address 65536 out of range."
+        assert excinfo.value.steps == 3
+        assert cachedsys.output_data == "1"
+
+    def test_unreachable_address_out_of_range(self, cachedsys):
+        """
+        A direct address outside memory is fine if it is never used.
+        """
+        mainloop(program("JUMP a", "COPYTO 70000", "a:", "INBOX", "OUTBOX"),
+                 input("1"), optimized=False)
+        assert cachedsys.output_data == "1"
+
+    def test_memset_out_of_range(self, cachedsys):
+        """
+        A .memset outside memory is an error before anything runs.
+        """
+        with pytest.raises(IllegalOperation) as excinfo:
+            mainloop(program(".memset 70000 1", "INBOX", "OUTBOX"),
+                     input("1"))
+        assert str(excinfo.value) == "Address 70000 out of range."
+        assert cachedsys.output_data == ""
+
+    def test_indirect_address_out_of_range(self, cachedsys):
+        """
+        It is an error to use an indirect address outside memory.
+        """
+        with pytest.raises(IllegalOperation):
+            mainloop(
+                program(".memset 0 -1", "INBOX", "OUTBOX", "COPYTO [0]"),
+                input("1"))
+        assert cachedsys.output_data == "1"
+
     def test_COPYTO_no_value(self, cachedsys):
         """
         It is an error to COPYTO a null value.
@@ -104,6 +302,66 @@ class TestMainloop(object):
             mainloop(program("COPYFROM 0"), [])
         assert cachedsys.output_data == ""
 
+    def test_step_count(self, cachedsys):
+        """
+        The number of steps executed is returned. An INBOX with no input left
+        doesn't count.
+        """
+        steps = mainloop(
+            program("a:", "INBOX", "OUTBOX", "JUMP a"), input("1 a"))
+        assert steps == 6
+        assert cachedsys.output_data == "1 a"
+
+    def test_step_count_on_error(self, cachedsys):
+        """
+        The number of steps completed before an error is stored on the
+        exception.
+        """
+        with pytest.raises(IllegalOperation) as excinfo:
+            mainloop(program("INBOX", "OUTBOX", "OUTBOX"), input("1"))
+        assert excinfo.value.steps == 2
+
+    @pytest.mark.parametrize("optimized", [False, True])
+    def test_undefined_label(self, cachedsys, optimized):
+        """
+        Taking a jump to an undefined label is an error, and the jump counts
+        as a step. Jumps to undefined labels that aren't taken are fine.
+        """
+        with pytest.raises(IllegalOperation) as excinfo:
+            mainloop(program("a:", "INBOX", "JUMPZ x", "OUTBOX", "JUMP a"),
+                     input("1 0"), optimized=optimized)
+        assert str(excinfo.value) == "Jump to undefined label x."
+        assert excinfo.value.steps == 6
+        assert cachedsys.output_data == "1"
+
+    @pytest.mark.parametrize("optimized", [False, True])
+    def test_jump_to_undefined_jump(self, cachedsys, optimized):
+        """
+        A jump to a JUMP to an undefined label counts both jumps.
+        """
+        with pytest.raises(IllegalOperation) as excinfo:
+            mainloop(program("INBOX", "JUMP b", "OUTBOX", "b:", "JUMP c"),
+                     input("1"), optimized=optimized)
+        assert excinfo.value.steps == 3
+
+    def test_output_sink(self, cachedsys):
+        """
+        Output can be sent to a sink instead of stdout.
+        """
+        output = ListOutputSink()
+        mainloop(program("a:", "INBOX", "OUTBOX", "JUMP a"), input("1 a"),
+                 output)
+        assert output.output == ["1", "a"]
+        assert cachedsys.output_data == ""
+
+    def test_output_flushed_on_error(self, cachedsys):
+        """
+        Output produced before an error is not lost in the buffer.
+        """
+        with pytest.raises(IllegalOperation):
+            mainloop(program("INBOX", "OUTBOX", "OUTBOX"), input("1"))
+        assert cachedsys.output_data == "1"
+
     def test_COPYTO_COPYFROM_different_addresses(self, cachedsys):
         """
         COPYTO and COPYFROM with different addresses will use different memory
@@ -322,3 +580,126 @@ class TestMainloop(object):
             "COPYFROM [7]", "OUTBOX", "BUMPDN 7", "COPYFROM [7]", "OUTBOX",
             "JUMP a"), input("1 2 a b"))
         # assert cachedsys.output_data == "2 1 b a"
+
+
+class TestEntryPoint(object):
+    def test_run(self, tmpdir, capfd):
+        """
+        The entry point runs a program file against an input file.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "OUTBOX", "JUMP a"]))
+        tmpdir.join("input.txt").write("1 a 2")
+        assert entry_point([
+            "hrmpy", str(tmpdir.join("prog.hrm")),
+            str(tmpdir.join("input.txt"))]) == 0
+        out, err = capfd.readouterr()
+        assert out.split() == ["1", "a", "2"]
+        assert err == ""
+
+    def test_missing_arguments(self, capfd):
+        """
+        The entry point needs a program and an input file.
+        """
+        assert entry_point(["hrmpy"]) == 1
+        assert entry_point(["hrmpy", "prog.hrm"]) == 1
+        assert entry_point(["hrmpy", "--bad-option", "prog.hrm", "in"]) == 1
+        out, err = capfd.readouterr()
+        assert out.splitlines() == [
+            "I can't run a program if you don't give me one.",
+            "I can't run a program if you don't give me input.",
+            "Unknown option: --bad-option",
+        ]
+
+    def test_stats(self, tmpdir, capfd):
+        """
+        With --stats, the step count and phase times are written to stderr.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "OUTBOX", "JUMP a"]))
+        tmpdir.join("input.txt").write("1 a 2")
+        assert entry_point([
+            "hrmpy", "--stats", str(tmpdir.join("prog.hrm")),
+            str(tmpdir.join("input.txt"))]) == 0
+        out, err = capfd.readouterr()
+        fields = err.split()
+        assert fields[:2] == ["hrmpy-stats", "steps=9"]
+        assert [f.split("=")[0] for f in fields[2:]] == [
+            "parse", "build", "run"]
+
+    def test_cache_dir(self, tmpdir, capfd):
+        """
+        With --cache-dir, the built program is cached and reused.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "OUTBOX", "JUMP a"]))
+        tmpdir.join("input.txt").write("1 a 2")
+        argv = [
+            "hrmpy", "--cache-dir=%s" % (tmpdir.join("cache"),),
+            str(tmpdir.join("prog.hrm")), str(tmpdir.join("input.txt"))]
+        assert entry_point(argv) == 0
+        assert len(tmpdir.join("cache").listdir()) == 1
+        assert entry_point(argv) == 0
+        out, err = capfd.readouterr()
+        assert out.split() == ["1", "a", "2"] * 2
+        assert err == ""
+
+    def test_floor_file(self, tmpdir, capfd):
+        """
+        A floor file sets tiles before the program starts, and .memset is
+        applied on top of it.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --", ".memset 1 9",
+            "COPYFROM 0", "OUTBOX", "COPYFROM 1", "OUTBOX", "COPYFROM 2",
+            "OUTBOX"]))
+        tmpdir.join("input.txt").write("")
+        tmpdir.join("floor.txt").write("# Floor\n0 5\n1 7\n2 c\n")
+        assert entry_point([
+            "hrmpy", str(tmpdir.join("prog.hrm")),
+            str(tmpdir.join("input.txt")),
+            str(tmpdir.join("floor.txt"))]) == 0
+        out, err = capfd.readouterr()
+        assert out.split() == ["5", "9", "c"]
+
+    def test_snapshot_and_resume(self, tmpdir, capfd):
+        """
+        With --snapshot, a run writes snapshots that a later run can resume
+        from by passing one as the memory file.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --", ".memset 0 0",
+            "a:", "INBOX", "ADD 0", "COPYTO 0", "OUTBOX", "JUMP a"]))
+        tmpdir.join("input.txt").write("1 2 3 4 5 6")
+        snap = str(tmpdir.join("run.snap"))
+        argv = ["hrmpy", str(tmpdir.join("prog.hrm")),
+                str(tmpdir.join("input.txt"))]
+        assert entry_point(
+            argv[:1] + ["--snapshot=%s" % (snap,), "--snapshot-every=20"] +
+            argv[1:]) == 0
+        out, err = capfd.readouterr()
+        assert out.split() == ["1", "3", "6", "10", "15", "21"]
+        assert entry_point(argv + [snap]) == 0
+        out, err = capfd.readouterr()
+        assert out.split() == ["15", "21"]
+        assert entry_point(["hrmpy", "--no-optimize"] + argv[1:] + [snap]) == 1
+        out, err = capfd.readouterr()
+        assert out == "The snapshot was taken from a different program.\n"
+
+    def test_max_steps(self, tmpdir, capfd):
+        """
+        With --max-steps, a program that doesn't stop is stopped.
+        """
+        tmpdir.join("prog.hrm").write("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --", "a:", "JUMP a"]))
+        tmpdir.join("input.txt").write("")
+        assert entry_point([
+            "hrmpy", "--stats", "--max-steps=1000",
+            str(tmpdir.join("prog.hrm")), str(tmpdir.join("input.txt"))]) == 2
+        out, err = capfd.readouterr()
+        lines = err.splitlines()
+        assert lines[0] == "Step limit of 1000 exceeded."
+        assert lines[1].split()[:2] == ["hrmpy-stats", "steps=1001"]
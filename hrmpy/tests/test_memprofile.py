@@ -0,0 +1,114 @@
+from hrmpy.main import (
+    MEMORY_SIZE, PAGE_SIZE, build_program, entry_point, execute)
+from hrmpy.memprofile import MemoryProfiler, write_memory_report
+from hrmpy.operations import IllegalOperation
+from hrmpy.parser import parse_input_data
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+def program_text(*lines):
+    return "\n".join(["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines))
+
+
+# Stores each input through a pointer that counts up from tile 1, and adds
+# them up in a tile near the top of memory.
+STORE = program_text(
+    ".memset 0 1", ".memset 1000 0",
+    "a:", "INBOX", "COPYTO [0]", "ADD 1000", "COPYTO 1000", "BUMPUP 0",
+    "JUMP a")
+
+
+def profile(text, input_text, optimized=False):
+    program = build_program(text, optimized)
+    profiler = MemoryProfiler(program, MEMORY_SIZE, PAGE_SIZE)
+    try:
+        execute(program, ListInputQueue(parse_input_data(input_text)),
+                ListOutputSink(), memory_profiler=profiler)
+    except IllegalOperation:
+        pass
+    return profiler
+
+
+class TestMemoryProfiler(object):
+
+    def test_counts(self):
+        """
+        Reads and writes are counted for each tile, split into direct and
+        indirect accesses.
+        """
+        profiler = profile(STORE, "3 4 5")
+        assert profiler.touched() == [0, 1, 2, 3, 1000]
+        assert profiler.max_addr == 1000
+        # The pointer is read by COPYTO [0] and bumped.
+        assert profiler.direct_reads[0] == 6
+        assert profiler.direct_writes[0] == 3
+        assert [profiler.indirect_writes[addr] for addr in [1, 2, 3]] == [
+            1, 1, 1]
+        assert profiler.indirect_reads[1] == 0
+        assert profiler.direct_reads[1000] == 3
+        assert profiler.direct_writes[1000] == 3
+
+    def test_optimized(self):
+        """
+        The counts are the same for an optimized program without counting
+        loops.
+        """
+        plain = profile(STORE, "3 4 5")
+        optimized = profile(STORE, "3 4 5", optimized=True)
+        for addr in [0, 1, 2, 3, 1000]:
+            assert optimized.total(addr) == plain.total(addr)
+
+    def test_bad_pointer(self):
+        """
+        An instruction that fails on its pointer only reads the pointer.
+        """
+        profiler = profile(program_text("INBOX", "COPYTO [5]"), "1")
+        assert profiler.touched() == [5]
+        assert profiler.direct_reads[5] == 1
+
+    def test_clusters(self):
+        """
+        Tiles less than a page apart are in the same cluster, and the
+        clusters are packed together for the dense range.
+        """
+        profiler = profile(STORE, "3 4 5")
+        assert profiler.clusters() == [(0, 3), (1000, 1000)]
+        assert profiler.dense_moves() == [(0, 3, 0), (1000, 1000, 4)]
+
+    def test_report(self, tmpdir):
+        profiler = profile(STORE, "3 4 5")
+        path = tmpdir.join("memory.txt")
+        write_memory_report(profiler, str(path))
+        lines = path.read().splitlines()
+        assert lines[:5] == [
+            "Tiles touched: 5",
+            "Highest address: 1000",
+            "Pages touched: 2",
+            "Reads: 9 direct, 0 indirect",
+            "Writes: 6 direct, 3 indirect",
+        ]
+        assert "Recommended dense range: 0-4" in lines
+        assert "  Move 1000-1000 to 4-4" in lines
+        assert "      0 |@...            |" in lines
+        assert "    992 |        *       |" in lines
+
+    def test_csv(self, tmpdir):
+        profiler = profile(STORE, "3 4")
+        path = tmpdir.join("memory.csv")
+        write_memory_report(profiler, str(path))
+        assert path.read().splitlines() == [
+            "addr,direct_reads,indirect_reads,direct_writes,indirect_writes",
+            "0,4,0,2,0",
+            "1,0,0,0,1",
+            "2,0,0,0,1",
+            "1000,2,0,2,0",
+        ]
+
+    def test_entry_point(self, tmpdir):
+        tmpdir.join("prog.hrm").write(STORE)
+        tmpdir.join("input.txt").write("3 4")
+        assert entry_point([
+            "hrmpy", "--memory-profile=%s" % (tmpdir.join("memory.csv"),),
+            str(tmpdir.join("prog.hrm")), str(tmpdir.join("input.txt")),
+        ]) == 0
+        assert tmpdir.join("memory.csv").read().startswith("addr,")
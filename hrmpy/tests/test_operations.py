@@ -0,0 +1,102 @@
+import pytest
+
+from hrmpy import operations as ops
+from hrmpy.operations import IllegalOperation, Integer, Character
+
+
+class TestUnboxedValues(object):
+
+    def test_values_unbox(self):
+        """
+        Integers unbox to themselves and characters to their code points.
+        """
+        assert (Integer(-3).kind, Integer(-3).unboxed()) == (ops.INTEGER, -3)
+        assert (Character('a').kind, Character('a').unboxed()) == (
+            ops.CHARACTER, ord('a'))
+
+    def test_box(self):
+        """
+        Unboxed values can be turned back into Value objects.
+        """
+        assert ops.box(ops.INTEGER, 7) == Integer(7)
+        assert ops.box(ops.CHARACTER, ord('z')) == Character('z')
+
+    def test_tostr(self):
+        """
+        Unboxed values print the same way as their boxed equivalents.
+        """
+        assert ops.tostr(ops.INTEGER, -12) == "-12"
+        assert ops.tostr(ops.CHARACTER, ord('q')) == "q"
+
+    def test_add(self):
+        """
+        Only integers can be added.
+        """
+        assert ops.add(ops.INTEGER, 2, ops.INTEGER, 3) == 5
+        for kinds in [(ops.INTEGER, ops.CHARACTER),
+                      (ops.CHARACTER, ops.INTEGER),
+                      (ops.CHARACTER, ops.CHARACTER)]:
+            with pytest.raises(IllegalOperation):
+                ops.add(kinds[0], 1, kinds[1], 1)
+
+    def test_sub(self):
+        """
+        Integers can be subtracted from integers and characters from
+        characters, but they can't be mixed.
+        """
+        assert ops.sub(ops.INTEGER, 2, ops.INTEGER, 3) == -1
+        assert ops.sub(
+            ops.CHARACTER, ord('b'), ops.CHARACTER, ord('a')) == 1
+        with pytest.raises(IllegalOperation):
+            ops.sub(ops.INTEGER, 1, ops.CHARACTER, ord('a'))
+        with pytest.raises(IllegalOperation):
+            ops.sub(ops.CHARACTER, ord('a'), ops.INTEGER, 1)
+
+
+def test_padding():
+    assert ops.ljust("ab", 4) == "ab  "
+    assert ops.rjust("ab", 4) == "  ab"
+    assert ops.ljust("abcde", 4) == ops.rjust("abcde", 4) == "abcde"
+
+
+def test_operation_tostr():
+    """
+    Operations print with their names padded, the same way they always
+    have.
+    """
+    assert ops.MemoryOperation('COPYTO', 3).tostr() == "COPYTO   3"
+    assert str(ops.IndirectMemoryOperation('ADD', 4)) == "ADD      [4]"
+    assert str(ops.JumpOperation('JUMPZ', 'a')) == "JUMPZ    a"
+    assert ops.SuperOperation(
+        'BUMPDN_JUMPZ', ops.MemoryOperation('BUMPDN', 0),
+        ops.JumpOperation('JUMPZ', 'a')).tostr() == (
+            "BUMPDN   0; JUMPZ    a")
+
+
+class TestCountingLoop(object):
+
+    @pytest.mark.parametrize('bump', ['BUMPUP', 'BUMPDN'])
+    @pytest.mark.parametrize('jump', ['JUMPZ', 'JUMPN'])
+    @pytest.mark.parametrize('back', [True, False])
+    def test_iterations(self, bump, jump, back):
+        """
+        The closed form agrees with going around the loop one bump at a time.
+        """
+        back_jump = None
+        if back:
+            back_jump = ops.JumpOperation('JUMP', 'a')
+        loop = ops.CountingLoop(
+            ops.MemoryOperation(bump, 0), ops.JumpOperation(jump, 'b'),
+            back_jump)
+        for start in range(-20, 21):
+            value = start
+            iterations = 0
+            while iterations < 100:
+                value += loop.delta
+                iterations += 1
+                condition = value == 0 if jump == 'JUMPZ' else value < 0
+                if condition == back:
+                    break
+            else:
+                iterations = -1
+            assert loop.iterations(start) == iterations, start
@@ -0,0 +1,251 @@
+import pytest
+
+from hrmpy.main import mainloop
+from hrmpy.operations import IllegalOperation
+from hrmpy.optimizer import (
+    optimize, thread_jumps, eliminate_dead_code, collapse_counting_loops,
+    fuse_operations)
+from hrmpy.parser import parse_program, parse_input_data
+from hrmpy.streams import ListOutputSink
+
+
+def program(*lines):
+    instructions = ["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines)
+    return parse_program("\n".join(instructions))
+
+
+def run(operations, input_text, optimized):
+    """
+    Run a program and return its output, step count and the error it raised,
+    if any.
+    """
+    output = ListOutputSink()
+    error = None
+    try:
+        steps = mainloop(
+            operations, parse_input_data(input_text), output, optimized)
+    except IllegalOperation as e:
+        error = str(e)
+        steps = e.steps
+    return output.output, steps, error
+
+
+class TestFuseOperations(object):
+
+    def test_fuse_pairs(self):
+        """
+        Adjacent pairs of operations are fused into superinstructions.
+        """
+        ops = fuse_operations(program(
+            "INBOX", "COPYTO 0", "COPYFROM [0]", "OUTBOX", "a:", "SUB 1",
+            "JUMPZ a", "BUMPDN 2", "JUMPN a"))
+        assert [op.name for op in ops] == [
+            'INBOX_COPYTO', 'COPYFROM_OUTBOX', 'jumplabel', 'SUB_JUMPZ',
+            'BUMPDN_JUMPN']
+        assert map(str, ops) == [
+            'INBOX; COPYTO   0', 'COPYFROM [0]; OUTBOX', 'jumplabel',
+            'SUB      1; JUMPZ    a', 'BUMPDN   2; JUMPN    a']
+
+    def test_no_fusion_across_labels(self):
+        """
+        Operations are not fused if something might jump between them.
+        """
+        ops = fuse_operations(program("INBOX", "a:", "COPYTO 0", "JUMP a"))
+        assert map(str, ops) == [
+            'INBOX', 'jumplabel', 'COPYTO   0', 'JUMP     a']
+
+    def test_each_operation_fused_once(self):
+        """
+        An operation is only ever part of one superinstruction.
+        """
+        ops = fuse_operations(program("INBOX", "COPYTO 0", "OUTBOX"))
+        assert [op.name for op in ops] == ['INBOX_COPYTO', 'OUTBOX']
+
+    def test_no_fusion_of_failing_operations(self):
+        """
+        Operations that can fail after the first one succeeds aren't fused.
+        """
+        ops = fuse_operations(program(
+            "INBOX", "COPYTO [0]", "INBOX", "COPYTO 65536"))
+        assert [op.name for op in ops] == [
+            'INBOX', 'COPYTO', 'INBOX', 'COPYTO']
+
+
+class TestThreadJumps(object):
+
+    def test_jump_chain(self):
+        """
+        Jumps to unconditional jumps go straight to the final destination.
+        """
+        ops = thread_jumps(program(
+            "a:", "INBOX", "JUMPZ b", "OUTBOX", "b:", "c:", "JUMP d",
+            "d:", "JUMP a"))
+        assert map(str, ops)[2] == 'JUMPZ    a'
+        assert map(str, ops)[6] == 'JUMP     a'
+        assert map(str, ops)[8] == 'JUMP     a'
+
+    def test_jump_cycle(self):
+        """
+        A cycle of jumps is left alone.
+        """
+        ops = thread_jumps(program("a:", "JUMP b", "b:", "JUMP a"))
+        assert map(str, ops) == [
+            'jumplabel', 'JUMP     a', 'jumplabel', 'JUMP     b']
+
+    def test_undefined_label(self):
+        """
+        Jumps to undefined labels are left alone.
+        """
+        ops = thread_jumps(program("JUMP x"))
+        assert map(str, ops) == ['JUMP     x']
+
+    def test_jump_to_undefined_label(self):
+        """
+        Jumps aren't threaded through a JUMP to an undefined label, so the
+        error still comes after that JUMP's step.
+        """
+        ops = thread_jumps(program(
+            "INBOX", "JUMP b", "OUTBOX", "b:", "JUMP c"))
+        assert map(str, ops) == [
+            'INBOX', 'JUMP     b', 'OUTBOX', 'jumplabel', 'JUMP     c']
+
+
+class TestEliminateDeadCode(object):
+
+    def test_drop_unreachable(self):
+        """
+        Operations after an unconditional jump that nothing jumps to are
+        dropped, but labels and memsets are kept.
+        """
+        ops = eliminate_dead_code(program(
+            ".memset 0 1", "a:", "INBOX", "OUTBOX", "JUMP a", "COPYFROM 0",
+            "b:", "OUTBOX"))
+        assert map(str, ops) == [
+            '.memset 0 1', 'jumplabel', 'INBOX', 'OUTBOX', 'JUMP     a',
+            'jumplabel']
+
+    def test_keep_jump_targets(self):
+        """
+        Code after an unconditional jump is kept if something jumps to it.
+        """
+        ops = eliminate_dead_code(program(
+            "a:", "INBOX", "JUMPZ b", "JUMP a", "b:", "OUTBOX", "JUMP a"))
+        assert map(str, ops) == [
+            'jumplabel', 'INBOX', 'JUMPZ    b', 'JUMP     a', 'jumplabel',
+            'OUTBOX', 'JUMP     a']
+
+    def test_undefined_label(self):
+        """
+        A jump to an undefined label stops the program, so nothing after an
+        unconditional one is reachable through it.
+        """
+        ops = eliminate_dead_code(program("JUMPZ x", "JUMP x", "OUTBOX"))
+        assert map(str, ops) == ['JUMPZ    x', 'JUMP     x']
+
+
+def counting_loop(bump, jump, back):
+    """
+    A program that runs a counting loop on each input and outputs what the
+    loop leaves in the accumulator.
+    """
+    if back:
+        loop = ["b:", bump + " 0", jump + " c", "JUMP b", "c:"]
+    else:
+        loop = ["b:", bump + " 0", jump + " b"]
+    lines = ["a:", "INBOX", "COPYTO 0"] + loop + ["OUTBOX", "JUMP a"]
+    return program(*lines)
+
+
+COUNTING_LOOPS = [
+    (bump, jump, back)
+    for bump in ["BUMPUP", "BUMPDN"]
+    for jump in ["JUMPZ", "JUMPN"]
+    for back in [True, False]]
+
+
+class TestCollapseCountingLoops(object):
+
+    @pytest.mark.parametrize('bump,jump,back', COUNTING_LOOPS)
+    def test_collapse(self, bump, jump, back):
+        ops = collapse_counting_loops(counting_loop(bump, jump, back))
+        assert [op.name for op in ops] == [
+            'jumplabel', 'INBOX', 'COPYTO', 'jumplabel', 'COUNT_LOOP'] + (
+                ['jumplabel'] if back else []) + ['OUTBOX', 'JUMP']
+
+    def test_label_inside(self):
+        """
+        Loops with labels inside them are left alone.
+        """
+        ops = collapse_counting_loops(program(
+            "a:", "BUMPDN 0", "b:", "JUMPZ c", "JUMP a", "c:"))
+        assert 'COUNT_LOOP' not in [op.name for op in ops]
+
+    def test_other_loops(self):
+        """
+        Loops that do anything else, or bump through a pointer, are left
+        alone.
+        """
+        for lines in [("a:", "BUMPDN [0]", "JUMPZ a"),
+                      ("a:", "BUMPDN 0", "JUMPZ b", "OUTBOX", "JUMP a", "b:"),
+                      ("a:", "SUB 0", "JUMPZ a"),
+                      ("a:", "BUMPDN 0", "JUMPZ b", "JUMP b", "b:")]:
+            ops = collapse_counting_loops(program(*lines))
+            assert 'COUNT_LOOP' not in [op.name for op in ops]
+
+    @pytest.mark.parametrize('bump,jump,back', COUNTING_LOOPS)
+    def test_same_results(self, bump, jump, back):
+        """
+        Collapsed loops leave the same state and take the same number of
+        steps as the loops they replace, for every input they stop on.
+        """
+        ops = counting_loop(bump, jump, back)
+        loop = [op for op in optimize(ops) if op.name == 'COUNT_LOOP'][0]
+        values = [str(v) for v in range(-5, 6)
+                  if loop.iterations(v) >= 0]
+        for input_text in [" ".join(values), "a"]:
+            assert run(ops, input_text, True) == run(ops, input_text, False)
+
+
+class TestOptimizedSemantics(object):
+
+    @pytest.mark.parametrize('lines,input_text', [
+        (("a:", "INBOX", "COPYTO 0", "COPYFROM 0", "OUTBOX", "JUMP a"),
+         "1 a -3"),
+        (("INBOX", "COPYTO [0]"), "1"),
+        (("COPYFROM 0", "OUTBOX"), ""),
+        (("a:", "INBOX", "COPYTO 0", "b:", "COPYFROM 0", "OUTBOX",
+          "BUMPDN 0", "JUMPN a", "JUMP b"), "3 0 2"),
+        (("a:", "INBOX", "COPYTO 0", "b:", "BUMPDN 0", "JUMPZ a", "JUMP b"),
+         "3 a"),
+        (("INBOX", "COPYTO 0", "a:", "INBOX", "SUB 0", "JUMPZ a",
+          "OUTBOX"), "5 5 5 6"),
+        (("INBOX", "COPYTO 0", "a:", "INBOX", "SUB 0", "JUMPN a",
+          "OUTBOX"), "b a a c"),
+        (("INBOX", "COPYTO 0", "INBOX", "SUB 0", "JUMPZ a", "a:"), "1 b"),
+        (("SUB 0", "JUMPZ a", "a:"), ""),
+        (("INBOX", "JUMPZ b", "OUTBOX", "a:", "JUMP b", "b:", "JUMP c",
+          "c:"), "0"),
+        (("a:", "INBOX", "JUMPZ b", "OUTBOX", "JUMP a", "b:", "JUMP a"),
+         "0 1 0 2"),
+        ((".memset 0 9", "INBOX", "COPYTO [0]"), "1"),
+        (("INBOX", "COPYTO 65536"), "1"),
+        (("a:", "BUMPUP -1", "JUMPN a"), ""),
+        (("INBOX", "JUMP a", "COPYTO 70000", "a:", "OUTBOX"), "1"),
+    ])
+    def test_same_results(self, lines, input_text):
+        """
+        Optimized programs produce the same output, step counts and errors as
+        unoptimized ones.
+        """
+        ops = program(*lines)
+        assert run(ops, input_text, True) == run(ops, input_text, False)
+
+    def test_optimize(self):
+        """
+        The full optimizer threads jumps, drops dead code and then fuses
+        operations.
+        """
+        ops = optimize(program("a:", "INBOX", "COPYTO 0", "JUMP b", "b:",
+                               "JUMP a"))
+        assert map(str, ops) == [
+            'jumplabel', 'INBOX; COPYTO   0', 'JUMP     a', 'jumplabel']
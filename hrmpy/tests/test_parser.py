@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from hrmpy.operations import Integer, Character
@@ -102,6 +104,35 @@ class TestParseProgram(object):
             'COPYFROM [0]', 'OUTBOX', 'COPYFROM 1', 'OUTBOX',
             '.memset 0 2', '.memset 1 a', '.memset 2 b']
 
+    def test_instruction_lines(self):
+        """
+        Each instruction's line number can be found, skipping everything
+        that isn't an instruction.
+        """
+        assert parser.instruction_lines("\n".join([
+            "Some nonsense.",
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:",
+            "    INBOX",
+            "",
+            "COMMENT 0",
+            "    OUTBOX",
+            "DEFINE COMMENT 0",
+            "eJwTYGBg;",
+            "",
+            "    JUMP a",
+            ".memset 0 1",
+        ])) == [4, 7, 11]
+
+
+class TestParseFloor(object):
+
+    def test_tiles_and_comments(self):
+        memsets = parser.parse_floor("\n".join([
+            "# A lookup table.", "0 5", "", "  7\tz  # last letter", "-1 0"]))
+        assert [(m.addr, m.value) for m in memsets] == [
+            (0, Integer(5)), (7, Character('z')), (-1, Integer(0))]
+
 
 class TestParseInput(object):
 
@@ -141,3 +172,117 @@ class TestParseInput(object):
         input_data = parser.parse_input_data("1 2 a b 3")
         assert input_data == [
             Integer(1), Integer(2), Character('a'), Character('b'), Integer(3)]
+
+
+class TestInputTokenizer(object):
+
+    def test_empty_input(self):
+        """
+        An empty string has no values.
+        """
+        tokenizer = parser.InputTokenizer("")
+        assert tokenizer.pop() is None
+
+    def test_whitespace_only(self):
+        """
+        A string containing only whitespace has no values.
+        """
+        tokenizer = parser.InputTokenizer(" \t\r\n  ")
+        assert tokenizer.pop() is None
+
+    def test_lazy_values(self):
+        """
+        Values are parsed one at a time as they are popped.
+        """
+        tokenizer = parser.InputTokenizer("  12\ta\n-3 ")
+        assert tokenizer.pop() == Integer(12)
+        assert tokenizer._pos == 4
+        assert tokenizer.pop() == Character('a')
+        assert tokenizer.pop() == Integer(-3)
+        assert tokenizer.pop() is None
+
+    def test_values_across_chunks(self):
+        """
+        Values that span chunk boundaries are joined back together.
+        """
+        class ChunkedTokenizer(parser.InputTokenizer):
+            chunks = ["1", "2 ", " a", " -", "3"]
+
+            def _read_chunk(self):
+                if self.chunks:
+                    return self.chunks.pop(0)
+                return ""
+
+        tokenizer = ChunkedTokenizer()
+        assert tokenizer.pop() == Integer(12)
+        assert tokenizer.pop() == Character('a')
+        assert tokenizer.pop() == Integer(-3)
+        assert tokenizer.pop() is None
+
+
+    def test_position_across_chunks(self):
+        """
+        Positions count from the start of the input, not the chunk.
+        """
+        class ChunkedTokenizer(parser.InputTokenizer):
+            chunks = ["1", "2 ", " a", " -", "3"]
+
+            def _read_chunk(self):
+                if self.chunks:
+                    return self.chunks.pop(0)
+                return ""
+
+        tokenizer = ChunkedTokenizer()
+        assert tokenizer.position() == 0
+        tokenizer.pop()
+        assert tokenizer.position() == 2
+        tokenizer.pop()
+        assert tokenizer.position() == 5
+        tokenizer.pop()
+        assert tokenizer.position() == 8
+
+
+class TestFileInputTokenizer(object):
+
+    def test_read_from_fd(self, tmpdir):
+        """
+        Values are read from a file descriptor in small chunks.
+        """
+        path = tmpdir.join("input.txt")
+        path.write("123 a\n-45 b 6789\n")
+        fd = os.open(str(path), os.O_RDONLY)
+        try:
+            tokenizer = parser.FileInputTokenizer(fd, chunk_size=3)
+            values = []
+            while True:
+                value = tokenizer.pop()
+                if value is None:
+                    break
+                values.append(value)
+        finally:
+            os.close(fd)
+        assert values == [
+            Integer(123), Character('a'), Integer(-45), Character('b'),
+            Integer(6789)]
+
+    def test_seek_back(self, tmpdir):
+        """
+        A tokenizer can go back to a position from an earlier run.
+        """
+        path = tmpdir.join("input.txt")
+        path.write("123 a\n-45 b 6789\n")
+        fd = os.open(str(path), os.O_RDONLY)
+        try:
+            tokenizer = parser.FileInputTokenizer(fd, chunk_size=3)
+            tokenizer.pop()
+            tokenizer.pop()
+            tokenizer.pop()
+            position = tokenizer.position()
+            assert position == 9
+            other = parser.FileInputTokenizer(fd, chunk_size=3)
+            other.seek(position)
+            assert other.pop() == Character('b')
+            assert other.pop() == Integer(6789)
+            assert other.pop() is None
+        finally:
+            os.close(fd)
@@ -0,0 +1,114 @@
+import json
+
+from hrmpy.main import Program, build_program, count_instructions, execute
+from hrmpy.optimizer import optimize
+from hrmpy.parser import parse_program, parse_input_data
+from hrmpy.profiler import (
+    COVERED, JUMP_NOT_TAKEN, JUMP_TAKEN, Profiler, write_report)
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+COUNTDOWN = [
+    "a:", "INBOX", "COPYTO 0", "b:", "COPYFROM 0", "OUTBOX", "COPYFROM 0",
+    "JUMPZ a", "BUMPDN 0", "JUMP c", "c:", "JUMP b",
+]
+
+
+def program(*lines):
+    instructions = ["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines)
+    return parse_program("\n".join(instructions))
+
+
+def profile(operations, input_text, optimized=False):
+    source_size = count_instructions(operations)
+    if optimized:
+        operations = optimize(operations)
+    prog = Program(operations, source_size)
+    profiler = Profiler(prog)
+    steps = execute(
+        prog, ListInputQueue(parse_input_data(input_text)), ListOutputSink(),
+        profiler)
+    return steps, profiler
+
+
+class TestProfiler(object):
+
+    def test_counts(self):
+        """
+        The profiler counts instructions, opcodes and loop iterations.
+        """
+        steps, profiler = profile(program(*COUNTDOWN), "2 1")
+        assert profiler.total_steps() == steps == 33
+        assert profiler.size() == 9
+        assert profiler.hits == [2, 2, 5, 5, 5, 5, 3, 3, 3]
+        assert profiler.opcode_counts() == {
+            'INBOX': 2, 'COPYTO': 2, 'COPYFROM': 10, 'OUTBOX': 5,
+            'JUMPZ': 5, 'BUMPDN': 3, 'JUMP': 6}
+        assert profiler.label_iterations() == {'a': 2, 'b': 3, 'c': 3}
+
+    def test_optimized_counts(self):
+        """
+        Superinstructions and threaded jumps are counted as the instructions
+        they replaced.
+        """
+        _, plain = profile(program(*COUNTDOWN), "2 1")
+        _, optimized = profile(program(*COUNTDOWN), "2 1", True)
+        assert optimized.total_steps() == plain.total_steps()
+        assert optimized.size() == plain.size()
+        assert optimized.opcode_counts() == plain.opcode_counts()
+
+    def test_coverage(self):
+        """
+        Coverage bitmaps show which instructions ran and which ways each
+        conditional jump went.
+        """
+        _, profiler = profile(program(
+            "a:", "INBOX", "JUMPZ a", "JUMPN b", "OUTBOX", "b:", "INBOX"),
+            "0 1")
+        assert profiler.coverage() == [
+            COVERED, COVERED | JUMP_TAKEN | JUMP_NOT_TAKEN,
+            COVERED | JUMP_NOT_TAKEN, COVERED, 0]
+        # The run stopped at the last INBOX when it ran out of input.
+        assert profiler.coverage(4) == [
+            COVERED, COVERED | JUMP_TAKEN | JUMP_NOT_TAKEN,
+            COVERED | JUMP_NOT_TAKEN, COVERED, COVERED]
+
+    def test_size_counts_dead_code(self):
+        """
+        The size is the size of the program as written, even if the
+        optimizer drops dead code.
+        """
+        prog = build_program("\n".join([
+            "-- HUMAN RESOURCE MACHINE PROGRAM --",
+            "a:", "INBOX", "OUTBOX", "JUMP a", "OUTBOX", "OUTBOX"]))
+        assert prog.size == 3
+        assert Profiler(prog).size() == 5
+
+    def test_json_report(self, tmpdir):
+        """
+        A JSON report holds the same counts.
+        """
+        _, profiler = profile(program(*COUNTDOWN), "2 1")
+        path = str(tmpdir.join("profile.json"))
+        write_report(profiler, path)
+        with open(path) as fp:
+            report = json.load(fp)
+        assert report['steps'] == 33
+        assert report['size'] == 9
+        assert report['opcodes'] == profiler.opcode_counts()
+        assert report['labels'] == profiler.label_iterations()
+        assert report['pc_hits'] == profiler.hits
+        assert report['pc_jumps'] == profiler.jumps
+
+    def test_text_report(self, tmpdir):
+        """
+        A text report lists the counts along with each instruction.
+        """
+        _, profiler = profile(program(*COUNTDOWN), "2 1")
+        path = tmpdir.join("profile.txt")
+        write_report(profiler, str(path))
+        lines = path.read().splitlines()
+        assert lines[:2] == ["Steps: 33", "Size: 9"]
+        assert "  BUMPDN                3" in lines
+        assert "  b                     3" in lines
+        assert "      8            3  JUMP     b" in lines
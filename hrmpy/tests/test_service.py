@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from hrmpy import service
+
+
+COPIER = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --",
+    "a:", "INBOX", "OUTBOX", "JUMP a",
+])
+
+ADDER = "\n".join([
+    "-- HUMAN RESOURCE MACHINE PROGRAM --",
+    "a:", "INBOX", "COPYTO 0", "INBOX", "ADD 0", "OUTBOX", "JUMP a",
+])
+
+FOREVER = "-- HUMAN RESOURCE MACHINE PROGRAM --\na:\nJUMP a"
+
+
+@pytest.fixture
+def address(tmpdir):
+    """
+    Run a server on a Unix socket for the length of a test.
+    """
+    path = str(tmpdir.join("hrmpy.sock"))
+    server = service.make_server(path, processes=2, max_steps=10000)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield path
+    finally:
+        server.shutdown()
+        thread.join()
+        service.close_server(server)
+
+
+class TestRunRequest(object):
+
+    def test_run(self):
+        assert service.run_request(
+            {'id': 7, 'program': COPIER, 'input': "1 a"}) == {
+                'id': 7, 'output': ["1", "a"], 'steps': 6, 'error': None}
+
+    def test_error(self):
+        assert service.run_request(
+            {'program': ADDER, 'input': "1 2 a 3"}) == {
+                'id': None, 'output': ["3"], 'steps': 9,
+                'error': "Can't add these."}
+
+    def test_bad_request(self):
+        response = service.run_request({'input': "1"})
+        assert response['error'] == "Bad request: KeyError: 'program'"
+
+    def test_limits(self):
+        """
+        A request can lower the server's limits but not raise them.
+        """
+        response = service.run_request(
+            {'program': FOREVER, 'max_steps': 50})
+        assert response['error'] == "Step limit of 50 exceeded."
+        response = service.run_request(
+            {'program': FOREVER, 'max_steps': -1, 'max_seconds': 0})
+        assert response['error'] == "Time limit of 0 seconds exceeded."
+
+    def test_machines_kept(self):
+        service.run_request({'program': COPIER, 'input': "1"})
+        machine = service._get_machine(COPIER, True)
+        response = service.run_request({'program': COPIER, 'input': "2"})
+        assert response['output'] == ["2"]
+        assert service._get_machine(COPIER, True) is machine
+        assert service._get_machine(COPIER, False) is not machine
+
+
+class TestServer(object):
+
+    def test_requests(self, address):
+        responses = service.submit(address, [
+            {'id': 1, 'program': COPIER, 'input': "1 2 3"},
+            {'id': 2, 'program': ADDER, 'input': "1 2 3 4"},
+            {'id': 3, 'program': FOREVER},
+        ])
+        assert sorted(responses, key=lambda r: r['id']) == [
+            {'id': 1, 'output': ["1", "2", "3"], 'steps': 9, 'error': None},
+            {'id': 2, 'output': ["3", "7"], 'steps': 12, 'error': None},
+            {'id': 3, 'output': [], 'steps': 10001,
+             'error': "Step limit of 10000 exceeded."},
+        ]
+
+    def test_bad_json(self, address):
+        responses = service.submit(address, ["not an object"])
+        assert responses[0]['error'] == (
+            "Bad request: Requests must be objects.")
+
+    def test_concurrent_clients(self, address):
+        """
+        Clients connected at the same time each get their own output.
+        """
+        results = {}
+
+        def client(n):
+            results[n] = service.submit(address, [
+                {'id': n, 'program': COPIER, 'input': str(n)}])
+
+        threads = [threading.Thread(target=client, args=(n,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == dict(
+            (n, [{'id': n, 'output': [str(n)], 'steps': 3, 'error': None}])
+            for n in range(8))
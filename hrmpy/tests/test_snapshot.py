@@ -0,0 +1,118 @@
+import pytest
+
+from hrmpy.main import build_program, execute
+from hrmpy.parser import InputTokenizer, parse_input_data
+from hrmpy.snapshot import (
+    Checkpointer, Snapshot, SnapshotError, dump_snapshot, is_snapshot,
+    load_snapshot, read_snapshot)
+from hrmpy.streams import ListInputQueue, ListOutputSink
+
+
+def program_text(*lines):
+    return "\n".join(["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines))
+
+
+# Outputs the running total of its input.
+SUMS = program_text(
+    ".memset 0 0", "a:", "INBOX", "ADD 0", "COPYTO 0", "OUTBOX", "JUMP a")
+
+
+class MemoryCheckpointer(Checkpointer):
+    """
+    A checkpointer that keeps its snapshots instead of writing them.
+    """
+    def __init__(self, interval):
+        Checkpointer.__init__(self, None, "key", interval)
+        self.snapshots = []
+
+    def save(self, snapshot):
+        self.snapshots.append(snapshot)
+        self.next_steps = snapshot.steps + self.interval
+
+
+def make_snapshot(**kw):
+    fields = dict(
+        program_key="abc", pc=3, acc_kind=1, acc=-7, steps=1234,
+        input_position=56, output_count=7, addrs=[0, 1, 300, 70000],
+        kinds=[1, 2, 1, 1], integers=[5, 97, -1, 1 << 40])
+    fields.update(kw)
+    return Snapshot(**fields)
+
+
+class TestEncoding(object):
+
+    def test_round_trip(self):
+        snapshot = make_snapshot()
+        loaded = load_snapshot(dump_snapshot(snapshot))
+        assert vars(loaded) == vars(snapshot)
+
+    def test_is_snapshot(self):
+        assert is_snapshot(dump_snapshot(make_snapshot()))
+        assert not is_snapshot("0 5\n1 a\n")
+        assert not is_snapshot("")
+
+    @pytest.mark.parametrize("data", [
+        "", "nonsense", "\x04HRMS\x63", "\x04HRMC\x01",
+    ])
+    def test_bad_data(self, data):
+        with pytest.raises(SnapshotError):
+            load_snapshot(data)
+
+    def test_truncated_and_trailing(self):
+        data = dump_snapshot(make_snapshot())
+        with pytest.raises(SnapshotError):
+            load_snapshot(data[:-1])
+        with pytest.raises(SnapshotError):
+            load_snapshot(data + "x")
+
+
+class TestCheckpointer(object):
+
+    def test_due_and_save(self, tmpdir):
+        path = str(tmpdir.join("run.snap"))
+        checkpointer = Checkpointer(path, "abc", 100)
+        assert not checkpointer.due(99)
+        assert checkpointer.due(100)
+        checkpointer.save(make_snapshot(steps=150))
+        assert checkpointer.next_steps == 250
+        assert vars(read_snapshot(path)) == vars(make_snapshot(steps=150))
+        assert tmpdir.listdir() == [tmpdir.join("run.snap")]
+
+
+class TestResume(object):
+
+    def run(self, inputs, snapshot=None, checkpointer=None):
+        output = ListOutputSink()
+        steps = execute(build_program(SUMS), inputs, output,
+                        snapshot=snapshot, checkpointer=checkpointer)
+        return steps, output.output
+
+    @pytest.mark.parametrize("make_inputs", [
+        lambda text: ListInputQueue(parse_input_data(text)),
+        InputTokenizer,
+    ])
+    def test_resume_from_every_snapshot(self, make_inputs):
+        """
+        Resuming from any snapshot gives the rest of the output and the same
+        total step count as an uninterrupted run.
+        """
+        text = "1 2 3 4 5 6 7 8 9 10"
+        checkpointer = MemoryCheckpointer(7)
+        steps, output = self.run(make_inputs(text), checkpointer=checkpointer)
+        assert output[-1] == "55"
+        assert len(checkpointer.snapshots) > 3
+        for snapshot in checkpointer.snapshots:
+            resumed_steps, rest = self.run(make_inputs(text), snapshot)
+            assert resumed_steps == steps
+            assert output[:snapshot.output_count] + rest == output
+
+    def test_snapshots_continue_after_resume(self):
+        checkpointer = MemoryCheckpointer(10)
+        self.run(InputTokenizer("1 2 3 4 5 6"), checkpointer=checkpointer)
+        first = checkpointer.snapshots[0]
+        resumed = MemoryCheckpointer(10)
+        self.run(InputTokenizer("1 2 3 4 5 6"), first, resumed)
+        assert [s.steps for s in resumed.snapshots] == [
+            s.steps for s in checkpointer.snapshots[1:]]
+        assert [s.output_count for s in resumed.snapshots] == [
+            s.output_count for s in checkpointer.snapshots[1:]]
@@ -0,0 +1,121 @@
+import os
+
+from hrmpy.operations import Integer, Character
+from hrmpy.streams import (
+    ListInputQueue, ListOutputSink, CallbackOutputSink, FileOutputSink,
+    PrintOutputSink)
+
+
+class TestListInputQueue(object):
+
+    def test_empty(self):
+        """
+        An empty queue has nothing to pop.
+        """
+        queue = ListInputQueue([])
+        assert queue.pop() is None
+
+    def test_pop_in_order(self):
+        """
+        Values are popped in order, and None is returned once they run out.
+        """
+        values = [Integer(1), Character('a'), Integer(-2)]
+        queue = ListInputQueue(values)
+        assert queue.pop() == Integer(1)
+        assert queue.pop() == Character('a')
+        assert queue.pop() == Integer(-2)
+        assert queue.pop() is None
+        assert queue.pop() is None
+
+    def test_list_not_modified(self):
+        """
+        Popping values from the queue does not modify the underlying list.
+        """
+        values = [Integer(1), Integer(2)]
+        queue = ListInputQueue(values)
+        queue.pop()
+        assert values == [Integer(1), Integer(2)]
+
+    def test_position_and_seek(self):
+        """
+        A queue can go back to a position from an earlier run.
+        """
+        values = [Integer(1), Integer(2), Integer(3)]
+        queue = ListInputQueue(values)
+        queue.pop()
+        queue.pop()
+        assert queue.position() == 2
+        other = ListInputQueue(values)
+        other.seek(queue.position())
+        assert other.pop() == Integer(3)
+        assert other.pop() is None
+
+
+class TestOutputSinks(object):
+
+    def test_list_sink(self):
+        """
+        A list sink collects everything written to it.
+        """
+        sink = ListOutputSink()
+        sink.write("1")
+        sink.write("a")
+        sink.flush()
+        assert sink.output == ["1", "a"]
+        assert sink.count == 2
+
+    def test_callback_sink(self):
+        """
+        A callback sink calls its callback for every value.
+        """
+        written = []
+        sink = CallbackOutputSink(written.append)
+        sink.write("1")
+        sink.write("a")
+        assert written == ["1", "a"]
+
+    def test_file_sink_block_buffered(self, tmpdir):
+        """
+        A file sink only writes when its buffer fills up or it is flushed.
+        """
+        path = tmpdir.join("output.txt")
+        fd = os.open(str(path), os.O_WRONLY | os.O_CREAT)
+        try:
+            sink = FileOutputSink(fd, buffer_size=6)
+            sink.write("1")
+            sink.write("a")
+            assert path.read() == ""
+            sink.write("-3")
+            assert path.read() == "1\na\n-3\n"
+            sink.write("b")
+            assert path.read() == "1\na\n-3\n"
+            sink.flush()
+            assert path.read() == "1\na\n-3\nb\n"
+        finally:
+            os.close(fd)
+
+    def test_file_sink_line_buffered(self, tmpdir):
+        """
+        A line-buffered file sink writes every value immediately.
+        """
+        path = tmpdir.join("output.txt")
+        fd = os.open(str(path), os.O_WRONLY | os.O_CREAT)
+        try:
+            sink = FileOutputSink(fd, line_buffered=True)
+            sink.write("1")
+            assert path.read() == "1\n"
+            sink.write("a")
+            assert path.read() == "1\na\n"
+        finally:
+            os.close(fd)
+
+    def test_print_sink(self, capsys):
+        """
+        A print sink writes to stdout when it is flushed.
+        """
+        sink = PrintOutputSink()
+        sink.write("1")
+        sink.write("a")
+        assert capsys.readouterr()[0] == ""
+        sink.flush()
+        assert capsys.readouterr()[0] == "1\na\n"
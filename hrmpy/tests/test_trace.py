@@ -0,0 +1,165 @@
+import pytest
+
+from hrmpy import operations as ops
+from hrmpy.main import Machine, build_program
+from hrmpy.parser import parse_input_data
+from hrmpy.replay import Replay, interact
+from hrmpy.streams import ListInputQueue, ListOutputSink
+from hrmpy.trace import (
+    TraceError, Tracer, dump_trace, load_trace, read_trace, write_trace)
+
+
+def program_text(*lines):
+    return "\n".join(["-- HUMAN RESOURCE MACHINE PROGRAM --"] + list(lines))
+
+
+# Stores each input through a pointer that counts up from tile 1.
+STORE = program_text(
+    ".memset 0 1", "a:", "INBOX", "COPYTO [0]", "BUMPUP 0", "JUMP a")
+
+
+def machine(text, input_text, tracer_size=None, optimized=False):
+    program = build_program(text, optimized)
+    tracer = None
+    if tracer_size is not None:
+        tracer = Tracer(program, tracer_size)
+    return Machine(program, ListInputQueue(parse_input_data(input_text)),
+                   ListOutputSink(), tracer=tracer)
+
+
+def traced(text, input_text, size=100, optimized=False):
+    """
+    Run a traced program and return the trace, decoded from its encoding.
+    """
+    m = machine(text, input_text, size, optimized)
+    try:
+        m.run()
+    except ops.IllegalOperation as e:
+        m.tracer.error = e.msg
+    return load_trace(dump_trace(m.tracer))
+
+
+def tiles(m):
+    addrs, kinds, integers = m.memory.tiles()
+    return dict(zip(addrs, zip(kinds, integers)))
+
+
+class TestTracer(object):
+
+    def test_records_writes(self):
+        m = machine(STORE, "5 6", 100)
+        m.run()
+        tracer = m.tracer
+        assert tracer.count == 9
+        assert tracer.pcs[:9] == [0, 1, 2, 3, 0, 1, 2, 3, 0]
+        assert tracer.steps[:9] == [0, 1, 2, 3, 4, 5, 6, 7, 8]
+        assert tracer.write_addrs[:9] == [-1, 1, 0, -1, -1, 2, 0, -1, -1]
+        assert tracer.old_kinds[1] == ops.EMPTY
+        assert (tracer.old_kinds[2], tracer.old_integers[2]) == (
+            ops.INTEGER, 1)
+
+    def test_incomplete_instruction(self):
+        """
+        An instruction that fails, or an INBOX with no input, didn't
+        complete, so it isn't part of the trace.
+        """
+        m = machine(STORE, "5", 100)
+        m.run()
+        assert m.tracer.count == 5
+        assert m.tracer.incomplete
+        assert m.tracer.entries() == 4
+        assert m.tracer.final_pc == 0
+
+    def test_complete_run(self):
+        m = machine(program_text("INBOX", "OUTBOX"), "5", 100)
+        m.run()
+        assert not m.tracer.incomplete
+        assert m.tracer.entries() == 2
+        assert m.tracer.final_pc == 2
+
+    def test_ring_buffer(self):
+        m = machine(STORE, "1 2 3 4 5", 6)
+        m.run()
+        assert m.tracer.count == 21
+        assert m.tracer.dropped() == 15
+        assert m.tracer.entries() == 5
+        trace = load_trace(dump_trace(m.tracer))
+        assert trace.dropped == 15
+        assert [e.steps for e in trace.entries] == [15, 16, 17, 18, 19]
+
+    def test_bad_data(self):
+        data = dump_trace(machine(STORE, "1", 10).tracer)
+        for bad in ["", "nonsense", data[:-1], data + "x"]:
+            with pytest.raises(TraceError):
+                load_trace(bad)
+
+    def test_file(self, tmpdir):
+        m = machine(STORE, "1 2", 10)
+        m.run()
+        path = str(tmpdir.join("run.hrmt"))
+        write_trace(m.tracer, path)
+        trace = read_trace(path)
+        assert [" ".join(i.split()) for i in trace.instructions] == [
+            "INBOX", "COPYTO [0]", "BUMPUP 0", "JUMP a"]
+        assert trace.final.steps == 8
+
+
+class TestReplay(object):
+
+    @pytest.mark.parametrize("optimized", [False, True])
+    def test_every_step_matches_machine(self, optimized):
+        """
+        Going backwards from the end gives the same state as running a
+        machine to the same step.
+        """
+        replay = Replay(traced(STORE, "5 6 7", optimized=optimized))
+        while True:
+            state = replay.state()
+            m = machine(STORE, "5 6 7", optimized=optimized)
+            m.step(state.steps)
+            assert (m.pc, m.steps) == (state.pc, state.steps)
+            assert (m.acc_kind, m.acc) == (state.acc_kind, state.acc)
+            assert tiles(m) == replay.tiles
+            if replay.position == 0:
+                break
+            replay.backward()
+
+    def test_forward_after_backward(self):
+        replay = Replay(traced(STORE, "5 6 7"))
+        end_tiles = dict(replay.tiles)
+        replay.backward(100)
+        assert replay.position == 0
+        assert replay.tiles == {0: (ops.INTEGER, 1)}
+        replay.forward(100)
+        assert replay.tiles == end_tiles
+
+    def test_goto(self):
+        replay = Replay(traced(STORE, "5 6 7"))
+        replay.goto(5)
+        assert (replay.state().steps, replay.state().pc) == (5, 1)
+        assert replay.tiles == {0: (ops.INTEGER, 2), 1: (ops.INTEGER, 5)}
+
+    def test_error(self):
+        text = program_text("INBOX", "COPYTO 0", "INBOX", "ADD 0", "OUTBOX")
+        replay = Replay(traced(text, "1 a"))
+        assert replay.describe() == [
+            "stopped with: Can't add these., after 3 steps",
+            "step 3, pc 3: ADD 0",
+            "  acc: a",
+            "  [0] 1",
+        ]
+        replay.backward()
+        assert replay.describe() == [
+            "step 2, pc 2: INBOX", "  acc: 1", "  [0] 1"]
+
+    def test_interact(self):
+        replay = Replay(traced(STORE, "5 6"))
+        written = []
+        interact(replay, ["b 2\n", "g 1\n", "x\n", "q\n", "p\n"],
+                 written.append)
+        assert "".join(written).splitlines() == [
+            "step 6, pc 2: BUMPUP 0", "  acc: 6", "  [0] 2", "  [1] 5",
+            "  [2] 6",
+            "step 1, pc 1: COPYTO [0]", "  acc: 5", "  [0] 1",
+            "Unknown command: x",
+        ]
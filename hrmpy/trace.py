@@ -0,0 +1,282 @@
+"""
+Execution traces, for finding out how a program got where it did.
+
+A tracer keeps the last few million instructions a program ran in a ring
+buffer. For each one it records the instruction index, the step count and
+the accumulator before the instruction ran, and for instructions that write
+to memory, the tile written and the value it held before. The value written
+is always the accumulator after the instruction, which is recorded by the
+next entry.
+
+When the run ends, the final state and every tile in memory are kept too.
+Going backwards from the end, undoing each write, gives the full state
+before any instruction in the buffer. See `hrmpy.replay`.
+"""
+
+import hrmpy.operations as ops
+from hrmpy.encoding import (
+    DecodeError, Decoder, Encoder, read_file, write_file_atomically)
+
+
+MAGIC = "HRMT"
+FORMAT_VERSION = 1
+
+# Instructions kept by default.
+TRACE_SIZE = 1 << 20
+
+# Opcodes that write the accumulator to the tile they address.
+WRITE_OPCODES = [
+    ops.OP_COPYTO, ops.OP_BUMPUP, ops.OP_BUMPDN, ops.OP_INBOX_COPYTO,
+    ops.OP_BUMPDN_JUMPZ, ops.OP_BUMPDN_JUMPN, ops.OP_COUNT_LOOP]
+
+
+class TraceError(DecodeError):
+    """
+    Raised when a trace can't be decoded.
+    """
+
+
+class Tracer(object):
+    """
+    Records instructions into a ring buffer of parallel lists.
+    """
+    def __init__(self, program, capacity=TRACE_SIZE):
+        assert capacity > 0
+        self.program = program
+        self.capacity = capacity
+        self.writes = [program.opcodes[pc] in WRITE_OPCODES
+                       for pc in range(program.size)]
+        self.pcs = [0] * capacity
+        self.steps = [0] * capacity
+        self.acc_kinds = [0] * capacity
+        self.accs = [0] * capacity
+        self.write_addrs = [-1] * capacity
+        self.old_kinds = [0] * capacity
+        self.old_integers = [0] * capacity
+        # The number of instructions recorded, including any that have been
+        # overwritten.
+        self.count = 0
+        # The index the next instruction is recorded at.
+        self.index = 0
+        # Whether the last instruction recorded didn't complete.
+        self.incomplete = False
+        self.final_pc = 0
+        self.final_steps = 0
+        self.final_acc_kind = ops.EMPTY
+        self.final_acc = 0
+        self.addrs = []
+        self.kinds = []
+        self.integers = []
+        self.error = ""
+
+    def record(self, pc, steps, acc_kind, acc, memory):
+        """
+        Record the state before the instruction at `pc` runs.
+        """
+        i = self.index
+        self.pcs[i] = pc
+        self.steps[i] = steps
+        self.acc_kinds[i] = acc_kind
+        self.accs[i] = acc
+        if self.writes[pc]:
+            self._record_write(i, pc, memory)
+        else:
+            self.write_addrs[i] = -1
+        self.count += 1
+        self.index = i + 1
+        if self.index == self.capacity:
+            self.index = 0
+
+    def _record_write(self, i, pc, memory):
+        addr = self._write_addr(pc, memory)
+        self.write_addrs[i] = addr
+        if addr >= 0:
+            kind = memory.tile_kind(addr)
+            self.old_kinds[i] = kind
+            if kind == ops.EMPTY:
+                self.old_integers[i] = 0
+            else:
+                self.old_integers[i] = memory.get_integer(addr)
+
+    def _write_addr(self, pc, memory):
+        """
+        Return the address an instruction will write to, or -1 if it will
+        fail before writing anything.
+        """
+        addr = self.program.addrs[pc]
+        if not 0 <= addr < memory.size:
+            return -1
+        if not self.program.indirects[pc]:
+            return addr
+        if memory.tile_kind(addr) != ops.INTEGER:
+            return -1
+        ptr = memory.get_integer(addr)
+        if not 0 <= ptr < memory.size:
+            return -1
+        return ptr
+
+    def finish(self, pc, steps, acc_kind, acc, memory):
+        """
+        Record the state at the end of the run. An instruction that didn't
+        complete, because it failed or ran out of input, is dropped.
+        """
+        if self.count > 0:
+            last = (self.count - 1) % self.capacity
+            if self.pcs[last] == pc and self.steps[last] == steps:
+                self.incomplete = True
+        self.final_pc = pc
+        self.final_steps = steps
+        self.final_acc_kind = acc_kind
+        self.final_acc = acc
+        self.addrs, self.kinds, self.integers = memory.tiles()
+
+    def dropped(self):
+        """
+        Return the number of instructions that have been overwritten.
+        """
+        return self.count - min(self.count, self.capacity)
+
+    def entries(self):
+        """
+        Return the number of completed instructions still in the buffer.
+        """
+        entries = min(self.count, self.capacity)
+        if self.incomplete:
+            entries -= 1
+        return entries
+
+    def first(self):
+        """
+        Return the buffer index of the oldest instruction still in it.
+        """
+        if self.count <= self.capacity:
+            return 0
+        return self.count % self.capacity
+
+
+def dump_trace(tracer):
+    """
+    Encode a finished tracer as a string. The program's instructions are
+    included so the trace can be read on its own.
+    """
+    encoder = Encoder()
+    encoder.write_string(MAGIC)
+    encoder.write_uint(FORMAT_VERSION)
+    program = tracer.program
+    encoder.write_uint(len(program))
+    for pc in range(len(program)):
+        encoder.write_string(program[pc].tostr())
+    encoder.write_string(tracer.error)
+    encoder.write_uint(tracer.dropped())
+    encoder.write_int(tracer.final_pc)
+    encoder.write_uint(tracer.final_steps)
+    encoder.write_uint(tracer.final_acc_kind)
+    encoder.write_int(tracer.final_acc)
+    encoder.write_uint(len(tracer.addrs))
+    for i in range(len(tracer.addrs)):
+        encoder.write_uint(tracer.addrs[i])
+        encoder.write_uint(tracer.kinds[i])
+        encoder.write_int(tracer.integers[i])
+    entries = tracer.entries()
+    encoder.write_uint(entries)
+    prev_steps = 0
+    for n in range(entries):
+        i = (tracer.first() + n) % tracer.capacity
+        # Steps only go up, and usually by one or two.
+        encoder.write_int(tracer.steps[i] - prev_steps)
+        prev_steps = tracer.steps[i]
+        encoder.write_uint(tracer.pcs[i])
+        encoder.write_uint(tracer.acc_kinds[i])
+        encoder.write_int(tracer.accs[i])
+        encoder.write_int(tracer.write_addrs[i])
+        if tracer.write_addrs[i] >= 0:
+            encoder.write_uint(tracer.old_kinds[i])
+            encoder.write_int(tracer.old_integers[i])
+    return encoder.getvalue()
+
+
+def write_trace(tracer, filename):
+    write_file_atomically(filename, dump_trace(tracer))
+
+
+class _Decoder(Decoder):
+    def error(self, msg):
+        raise TraceError(msg)
+
+
+class Entry(object):
+    """
+    One recorded instruction, with the state before it ran.
+    """
+    def __init__(self, pc, steps, acc_kind, acc, write_addr, old_kind,
+                 old_integer):
+        self.pc = pc
+        self.steps = steps
+        self.acc_kind = acc_kind
+        self.acc = acc
+        self.write_addr = write_addr
+        self.old_kind = old_kind
+        self.old_integer = old_integer
+
+
+class Trace(object):
+    """
+    A decoded trace.
+
+    `instructions` are the program's instructions as text, `dropped` is the
+    number of instructions that ran before the oldest one in `entries`, and
+    `tiles` maps addresses to (kind, integer) pairs at the end of the run.
+    """
+    def __init__(self, instructions, error, dropped, final, tiles, entries):
+        self.instructions = instructions
+        self.error = error
+        self.dropped = dropped
+        self.final = final
+        self.tiles = tiles
+        self.entries = entries
+
+
+def load_trace(data):
+    """
+    Decode a string from `dump_trace()`. Raises TraceError if the data is
+    bad. This is only used by CPython tools.
+    """
+    decoder = _Decoder(data)
+    if decoder.read_string() != MAGIC:
+        raise TraceError("Not a trace.")
+    if decoder.read_uint() != FORMAT_VERSION:
+        raise TraceError("Wrong trace format version.")
+    instructions = [decoder.read_string()
+                    for _ in range(decoder.read_uint())]
+    error = decoder.read_string()
+    dropped = decoder.read_uint()
+    final = Entry(decoder.read_int(), decoder.read_uint(), decoder.read_uint(),
+                  decoder.read_int(), -1, ops.EMPTY, 0)
+    tiles = {}
+    for _ in range(decoder.read_uint()):
+        addr = decoder.read_uint()
+        tiles[addr] = (decoder.read_uint(), decoder.read_int())
+    entries = []
+    steps = 0
+    for _ in range(decoder.read_uint()):
+        steps += decoder.read_int()
+        pc = decoder.read_uint()
+        if pc >= len(instructions):
+            raise TraceError("Bad instruction index %d in trace." % (pc,))
+        acc_kind = decoder.read_uint()
+        acc = decoder.read_int()
+        write_addr = decoder.read_int()
+        old_kind = ops.EMPTY
+        old_integer = 0
+        if write_addr >= 0:
+            old_kind = decoder.read_uint()
+            old_integer = decoder.read_int()
+        entries.append(Entry(pc, steps, acc_kind, acc, write_addr, old_kind,
+                             old_integer))
+    if not decoder.at_end():
+        raise TraceError("Trailing data in trace.")
+    return Trace(instructions, error, dropped, final, tiles, entries)
+
+
+def read_trace(filename):
+    return load_trace(read_file(filename))
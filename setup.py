@@ -11,4 +11,5 @@ setup(
     description=("An implementation of the Human Resource Machine in RPython"),
     long_description=open("README.rst", "r").read(),
     packages=["hrmpy"],
+    extras_require={"lanes": ["numpy"]},
 )